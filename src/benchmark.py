@@ -0,0 +1,512 @@
+"""End-to-end pipeline benchmark with a deterministic stub LLM
+
+The LLM is replaced by StubBackend, which answers with generated JSON
+matching the requested schema after a configurable first-token latency and
+at a configurable token rate, so runs are repeatable without Ollama. Embeddings come from a
+hashing encoder by default (--embedder model uses the SentenceTransformer).
+
+Stages are measured separately: extraction (reading and chunking generated
+standards PDFs with PDFExtractor), sections (extract_policy_sections),
+embedding (policy section queries), retrieval, analysis (one
+GapAnalyzer.analyze_batch call over every policy, pre-screen included),
+revision and roadmap. Each reports throughput, p50/p95 latency and peak
+RSS, and the results are written as JSON for comparison between commits.
+
+The pre-screen's covered_similarity threshold is calibrated on labelled
+sections: restated knowledge base chunks that should be skipped and
+synthetic policy text that should not. The sweep reports precision, recall
+and the share of LLM calls skipped per threshold. The control coverage
+threshold is swept the same way over (section, control) pairs.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Iterator, Optional, Callable
+
+import numpy as np
+
+from llm_backends import LLMBackend
+
+TOPICS = ["Access Control", "Password Management", "Incident Response", "Logging and Monitoring",
+          "Backup and Recovery", "Asset Inventory", "Vendor Management", "Encryption",
+          "Remote Access", "Security Awareness Training", "Change Management", "Vulnerability Management",
+          "Physical Security", "Data Classification", "Network Security", "Business Continuity"]
+
+WORDS = ["access", "accounts", "administrators", "assets", "audit", "authentication", "backups", "controls",
+         "data", "devices", "employees", "encryption", "events", "incidents", "information", "logs",
+         "management", "monitoring", "network", "passwords", "privileged", "procedures", "recovery",
+         "reviewed", "risk", "security", "sensitive", "systems", "training", "users", "vendors", "vulnerabilities"]
+
+# CSF subcategories stated by the synthetic standards, so the control index
+# and the coverage calibration have something to work on
+CONTROLS = ["GV.OC-01", "GV.RM-02", "ID.AM-01", "ID.AM-02", "ID.RA-01", "PR.AA-01", "PR.AA-03", "PR.AT-01",
+            "PR.DS-01", "PR.PS-01", "DE.CM-01", "DE.CM-09", "DE.AE-02", "RS.MA-01", "RS.AN-03", "RC.RP-01"]
+
+def _sentence(rng: random.Random, length: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+def synthetic_policy(seed: int, sections: int, sentences_per_section: int) -> str:
+    """A policy document with ## headed sections of generated sentences"""
+    rng = random.Random(seed)
+    lines = [f"Document ID: POL-{seed} Version: 1.{seed % 10} Owner: CISO", ""]
+    for i in range(sections):
+        lines.append(f"## {i + 1}.0 {TOPICS[i % len(TOPICS)]}")
+        lines.append(" ".join(_sentence(rng, rng.randint(8, 18)) for _ in range(sentences_per_section)))
+        lines.append("")
+    return "\n".join(lines)
+
+def synthetic_standard(seed: int, sentences: int, sentences_per_page: int = 10) -> List[str]:
+    """Pages of standards-like prose for the knowledge base; every tenth sentence states a control"""
+    rng = random.Random(seed)
+    lines = [(f"{rng.choice(CONTROLS)}: " if i % 10 == 0 else "") + _sentence(rng, rng.randint(10, 25))
+             for i in range(sentences)]
+    return [" ".join(lines[i:i + sentences_per_page]) for i in range(0, len(lines), sentences_per_page)]
+
+def write_pdf(path: str, pages: List[str]):
+    """Minimal PDF with one Helvetica text line per page ("" for a blank page)"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET" if text else ""
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(out)
+
+class StubBackend(LLMBackend):
+    """Deterministic backend: same prompt, same answer, with simulated timing
+
+    With a JSON schema the answer is a generated instance of the schema;
+    otherwise it is prose. The response is emitted as ~4 character tokens
+    after latency seconds, at token_rate tokens per second.
+    """
+    name = "stub"
+    supports_streaming = True
+    supports_schema = True
+
+    def __init__(self, latency: float = 0.05, token_rate: float = 200.0, string_words: int = 12,
+                 array_items: int = 2):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.string_words = string_words
+        self.array_items = array_items
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> str:
+        # Each run gets its own concurrency limit and circuit breaker
+        return f"stub:{id(self)}"
+
+    def _instance(self, schema: Dict, rng: random.Random) -> Any:
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        kind = schema.get("type")
+        if kind == "object":
+            return {key: self._instance(value, rng) for key, value in schema.get("properties", {}).items()}
+        if kind == "array":
+            return [self._instance(schema.get("items", {}), rng) for _ in range(self.array_items)]
+        if kind == "integer":
+            return rng.randint(1, 10)
+        if kind == "number":
+            return round(rng.random(), 3)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        return " ".join(rng.choice(WORDS) for _ in range(self.string_words))
+
+    def respond(self, prompt: str, json_schema: Optional[Dict] = None) -> str:
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        if json_schema is not None:
+            return json.dumps(self._instance(json_schema, rng))
+        return " ".join(_sentence(rng, 12) for _ in range(3))
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def generate(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> str:
+        with self._lock:
+            self.calls += 1
+        text = self.respond(prompt, json_schema)
+        time.sleep(self.latency + len(self._tokens(text)) / self.token_rate)
+        return text
+
+    def stream(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> Iterator[str]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        for token in self._tokens(self.respond(prompt, json_schema)):
+            time.sleep(1 / self.token_rate)
+            yield token
+
+class HashingEncoder:
+    """SentenceTransformer stand-in embedding text by hashed word counts"""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = hashlib.md5(word.encode('utf-8')).digest()
+                vectors[row, int.from_bytes(digest[:4], 'little') % self.dimension] += 1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class RSSSampler:
+    """Track peak RSS while a block runs by sampling in a background thread"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RSSSampler":
+        self.peak_mb = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+def measure_stage(items: List[Any], operation: Callable[[Any], Any], workers: int = 1) -> Dict[str, Any]:
+    """Run operation over items and report throughput, latency percentiles and peak RSS"""
+    latencies: List[float] = []
+    outputs: List[Any] = []
+
+    def timed(item):
+        start = time.perf_counter()
+        output = operation(item)
+        return output, time.perf_counter() - start
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(timed, items))
+        else:
+            results = [timed(item) for item in items]
+        wall = time.perf_counter() - start
+
+    for output, latency in results:
+        outputs.append(output)
+        latencies.append(latency)
+    ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "stats": {
+            "operations": len(items),
+            "wall_s": round(wall, 4),
+            "throughput_per_s": round(len(items) / wall, 2) if wall > 0 else None,
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "peak_rss_mb": round(rss.peak_mb, 1)
+        },
+        "outputs": outputs
+    }
+
+def calibrate_prescreen(vector_store, chunks: List[Dict], samples: int = 50, seed: int = 0,
+                        target_precision: float = 0.99,
+                        thresholds: Optional[List[float]] = None) -> Dict[str, Any]:
+    """Sweep covered_similarity over labelled sections
+
+    Positives restate a knowledge base chunk with about a tenth of its words
+    dropped; negatives are synthetic policy sections. The recommended
+    threshold is the lowest one whose "covered" verdicts reach
+    target_precision, since a section wrongly skipped hides its gaps.
+    """
+    from prescreen import similarity_from_distance
+
+    rng = random.Random(seed)
+    positives = [" ".join(word for word in chunk['text'].split() if rng.random() > 0.1)
+                 for chunk in rng.sample(chunks, min(samples, len(chunks)))]
+    negatives = [" ".join(_sentence(rng, rng.randint(8, 18)) for _ in range(4)) for _ in range(samples)]
+    hits = vector_store.search_batch(positives + negatives, k=1)
+    similarities = [similarity_from_distance(row[0]['score']) if row else 0.0 for row in hits]
+    labels = [True] * len(positives) + [False] * len(negatives)
+
+    sweep = []
+    for threshold in thresholds or [round(float(t), 2) for t in np.arange(0.5, 1.0, 0.05)]:
+        predicted = [similarity >= threshold for similarity in similarities]
+        true_positives = sum(p and l for p, l in zip(predicted, labels))
+        flagged = sum(predicted)
+        sweep.append({
+            "threshold": threshold,
+            "precision": round(true_positives / flagged, 4) if flagged else 1.0,
+            "recall": round(true_positives / len(positives), 4) if positives else 0.0,
+            "skipped_fraction": round(flagged / len(labels), 4)
+        })
+    recommended = min((row["threshold"] for row in sweep if row["precision"] >= target_precision and row["recall"] > 0),
+                      default=None)
+    return {"positives": len(positives), "negatives": len(negatives), "target_precision": target_precision,
+            "sweep": sweep, "recommended_covered_similarity": recommended}
+
+def calibrate_coverage(vector_store, chunks: List[Dict], samples: int = 50, seed: int = 0,
+                       target_precision: float = 0.95,
+                       thresholds: Optional[List[float]] = None) -> Dict[str, Any]:
+    """Sweep the control coverage threshold over labelled (section, control) pairs
+
+    Positives keep about half the words of a chunk stating a control, plus
+    a sentence of policy filler, and are labelled as covering every control
+    that chunk states; negatives are synthetic policy sections covering
+    none. The recommended threshold is the lowest one whose "covered"
+    pairs reach target_precision, since a pair wrongly counted as covered
+    hides a gap, and lower thresholds report fewer spurious ones.
+    """
+    from csf import ControlIndex, find_controls
+
+    index = ControlIndex.build(chunks)
+    rng = random.Random(seed)
+    positives, stated = [], []
+    for control in [rng.choice(index.controls) for _ in range(samples)] if len(index) else []:
+        text = chunks[rng.choice(index.chunk_ids[control])]['text']
+        positives.append(" ".join(word for word in text.split() if rng.random() > 0.5) + " " + _sentence(rng, 10))
+        stated.append(find_controls(text))
+    negatives = [" ".join(_sentence(rng, rng.randint(8, 18)) for _ in range(4)) for _ in range(samples)]
+
+    scores = np.zeros((len(positives) + len(negatives), len(index)), dtype='float32')
+    labels = np.zeros(scores.shape, dtype=bool)
+    if len(index):
+        matrix = index.coverage(vector_store.encode_queries(positives + negatives), vector_store.embeddings,
+                                threshold=-1.0)
+        for row, column, score in matrix['entries']:
+            scores[row, column] = score
+        for row, controls in enumerate(stated):
+            labels[row, [index.controls.index(control) for control in controls if control in index.chunk_ids]] = True
+
+    sweep = []
+    for threshold in thresholds or [round(float(t), 2) for t in np.arange(0.3, 1.0, 0.05)]:
+        predicted = scores >= threshold
+        true_positives = int((predicted & labels).sum())
+        flagged = int(predicted.sum())
+        sweep.append({
+            "threshold": threshold,
+            "precision": round(true_positives / flagged, 4) if flagged else 1.0,
+            "recall": round(true_positives / int(labels.sum()), 4) if labels.any() else 0.0
+        })
+    recommended = min((row["threshold"] for row in sweep if row["precision"] >= target_precision and row["recall"] > 0),
+                      default=None)
+    return {"controls": len(index), "positives": len(positives), "negatives": len(negatives),
+            "target_precision": target_precision, "sweep": sweep, "recommended_coverage_threshold": recommended}
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(policies: int = 8, section_counts: List[int] = (4, 8, 16), sentences_per_section: int = 4,
+                  standards_docs: int = 20, standards_sentences: int = 200, latency: float = 0.05,
+                  token_rate: float = 200.0, workers: int = 4, embedder: str = "hash",
+                  index_type: str = "flat", seed: int = 0, prescreen: bool = True,
+                  covered_similarity: Optional[float] = None) -> Dict[str, Any]:
+    """Run every stage; covered_similarity defaults to the calibrated threshold"""
+    from embedding_system import VectorStore
+    from llm_handler import LocalLLMHandler
+    from gap_analyzer import GapAnalyzer
+    from policy_reviser import PolicyReviser
+    from data_preparation import PDFExtractor
+    from tokenization import TokenCounter
+    from prescreen import PreScreener
+
+    counter = TokenCounter()
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    # Extraction: read generated standards PDFs page by page and stream chunks
+    pages = 0
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        documents = []
+        for i in range(standards_docs):
+            path = os.path.join(pdf_dir, f"standard_{i}.pdf")
+            document_pages = synthetic_standard(seed + i, standards_sentences)
+            write_pdf(path, document_pages)
+            pages += len(document_pages)
+            documents.append(path)
+        extraction = measure_stage(documents, lambda path: list(
+            PDFExtractor(path, token_counter=counter).iter_chunks(chunk_size=256, overlap=32)))
+    stages["extraction"] = dict(extraction["stats"], pages=pages)
+    chunks = [dict(chunk, chunk_id=i) for i, chunk in
+              enumerate(chunk for output in extraction["outputs"] for chunk in output)]
+
+    vector_store = VectorStore(index_type=index_type)
+    if embedder == "hash":
+        vector_store.model = HashingEncoder()
+    build = measure_stage([chunks], vector_store.create_embeddings)
+    stages["index_build"] = dict(build["stats"], chunks=len(chunks))
+
+    # Calibrate the pre-screen for this embedder before using it
+    calibration = calibrate_prescreen(vector_store, chunks, seed=seed)
+    coverage_calibration = calibrate_coverage(vector_store, chunks, seed=seed)
+    if covered_similarity is None:
+        covered_similarity = calibration["recommended_covered_similarity"] or 1.0
+
+    texts = {f"policy_{i}": synthetic_policy(seed + i, section_counts[i % len(section_counts)], sentences_per_section)
+             for i in range(policies)}
+    split = measure_stage(list(texts.values()), GapAnalyzer.extract_policy_sections)
+    stages["sections"] = split["stats"]
+    sections = dict(zip(texts, split["outputs"]))
+
+    # Embedding: section queries per policy; the query cache starts empty
+    embedding = measure_stage(list(sections.values()), lambda s: vector_store.encode_queries(list(s.values())))
+    stages["embedding"] = embedding["stats"]
+
+    # Retrieval: batched search per policy (query embeddings are cached by now)
+    retrieval = measure_stage(list(sections.values()), lambda s: vector_store.search_batch(list(s.values()), k=3))
+    stages["retrieval"] = retrieval["stats"]
+
+    backend = StubBackend(latency=latency, token_rate=token_rate)
+    llm = LocalLLMHandler(backend=backend, use_cache=False, max_concurrent=workers)
+    screener = PreScreener(covered_similarity) if prescreen else None
+    analyzer = GapAnalyzer(vector_store, llm, max_workers=workers, prescreen=screener)
+
+    # Analysis: the production batch path (pre-screen, batched retrieval, one
+    # structured call per section needing review on the worker pool)
+    analysis = measure_stage([texts], analyzer.analyze_batch)
+    analyses = analysis["outputs"][0]
+    stats = analysis["stats"]
+    section_total = sum(len(s) for s in sections.values())
+    stages["analysis"] = dict(stats, sections=section_total, llm_calls=backend.calls,
+                              sections_per_s=round(section_total / stats["wall_s"], 2) if stats["wall_s"] else None)
+    if screener:
+        for name in ("covered", "trivial", "needs_review"):
+            stages["analysis"][name] = sum(result["prescreen"][name] for result in analyses.values())
+
+    # Revision: sectioned map-reduce revision per policy
+    reviser = PolicyReviser(llm, max_workers=workers, mode="sections")
+    calls_before = backend.calls
+    revision = measure_stage(list(texts), lambda name: reviser.revise_policy(texts[name], analyses[name]))
+    stages["revision"] = dict(revision["stats"], llm_calls=backend.calls - calls_before)
+
+    roadmap = measure_stage(list(texts), lambda name: reviser.create_roadmap(analyses[name]))
+    stages["roadmap"] = roadmap["stats"]
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "policies": policies, "section_counts": list(section_counts),
+            "sentences_per_section": sentences_per_section, "standards_docs": standards_docs,
+            "standards_sentences": standards_sentences, "latency_s": latency, "token_rate": token_rate,
+            "workers": workers, "embedder": embedder, "index_type": index_type, "seed": seed,
+            "prescreen": prescreen, "covered_similarity": covered_similarity
+        },
+        "stages": stages,
+        "prescreen_calibration": calibration,
+        "coverage_calibration": coverage_calibration
+    }
+
+def main():
+    from embedding_system import INDEX_TYPES
+
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline with a deterministic stub LLM")
+    parser.add_argument("--policies", type=int, default=8, help="Synthetic policies to process")
+    parser.add_argument("--sections", default="4,8,16", help="Comma-separated section counts to cycle through")
+    parser.add_argument("--sentences", type=int, default=4, help="Sentences per policy section")
+    parser.add_argument("--standards-docs", type=int, default=20, help="Synthetic standards documents")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub LLM seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Stub LLM tokens per second")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent generation calls")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="Hashing encoder, or the real SentenceTransformer")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS index type for the knowledge base")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-prescreen", action="store_true", help="Send every section to the stub LLM")
+    parser.add_argument("--covered-similarity", type=float,
+                        help="Pre-screen threshold for sections already covered by the standards "
+                             "(default: the calibrated one)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        policies=args.policies,
+        section_counts=[int(n) for n in args.sections.split(",")],
+        sentences_per_section=args.sentences,
+        standards_docs=args.standards_docs,
+        latency=args.latency,
+        token_rate=args.token_rate,
+        workers=args.workers,
+        embedder=args.embedder,
+        index_type=args.index_type,
+        seed=args.seed,
+        prescreen=not args.no_prescreen,
+        covered_similarity=args.covered_similarity
+    )
+
+    print(f"{'stage':<12} {'ops':>6} {'ops/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'peak MB':>9}")
+    for stage, stats in results["stages"].items():
+        print(f"{stage:<12} {stats['operations']:>6} {stats['throughput_per_s'] or 0:>10.2f} "
+              f"{stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} {stats['peak_rss_mb']:>9.1f}")
+
+    calibration = results["prescreen_calibration"]
+    print(f"\n{'threshold':>9} {'precision':>10} {'recall':>8} {'skipped':>8}")
+    for row in calibration["sweep"]:
+        print(f"{row['threshold']:>9.2f} {row['precision']:>10.3f} {row['recall']:>8.3f} {row['skipped_fraction']:>8.3f}")
+    print(f"Recommended --covered-similarity: {calibration['recommended_covered_similarity']}")
+
+    coverage = results["coverage_calibration"]
+    print(f"\n{'threshold':>9} {'precision':>10} {'recall':>8}")
+    for row in coverage["sweep"]:
+        print(f"{row['threshold']:>9.2f} {row['precision']:>10.3f} {row['recall']:>8.3f}")
+    print(f"Recommended --coverage-threshold: {coverage['recommended_coverage_threshold']}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Measure import and CLI startup time in fresh interpreters
+
+Each measurement runs in a new Python process so nothing is already
+imported. Reports the median wall time per module import and for
+`main.py --help`, and which heavy dependencies the pipeline modules pull in
+at import time (there should be none).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, Any, List
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PIPELINE_MODULES = ["main", "llm_handler", "embedding_system", "gap_analyzer", "policy_reviser",
+                    "data_preparation", "pipeline", "roadmap"]
+
+# Imported only when embedding, searching or reading PDFs
+HEAVY_MODULES = ["sentence_transformers", "faiss", "torch", "transformers", "PyPDF2"]
+
+def _run(args: List[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=SRC_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def median_ms(args: List[str], repeat: int) -> float:
+    return round(1000 * statistics.median(_run(args) for _ in range(repeat)), 1)
+
+def heavy_imports(modules: List[str]) -> List[str]:
+    """Heavy modules present in sys.modules after importing the given modules"""
+    code = (f"import sys, json\n"
+            f"for name in {modules!r}: __import__(name)\n"
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_benchmark(repeat: int = 5) -> Dict[str, Any]:
+    baseline = median_ms(["-c", "pass"], repeat)
+    imports = {module: median_ms(["-c", f"import {module}"], repeat) for module in PIPELINE_MODULES}
+    return {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "interpreter_ms": baseline,
+        "import_ms": imports,
+        "cli_help_ms": median_ms(["main.py", "--help"], repeat),
+        "heavy_modules_at_import": heavy_imports(PIPELINE_MODULES)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import and CLI startup time")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (median is reported)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    
+    results = run_benchmark(args.repeat)
+    print(f"Interpreter startup: {results['interpreter_ms']} ms")
+    for module, ms in results["import_ms"].items():
+        print(f"  import {module:<18} {ms:>8.1f} ms")
+    print(f"main.py --help:      {results['cli_help_ms']} ms")
+    print(f"Heavy modules loaded at import: {', '.join(results['heavy_modules_at_import']) or 'none'}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,65 @@
-import json
-from embedding_system import VectorStore
-from data_preparation import PDFExtractor
 import os
+import argparse
+from typing import List, Optional
+from embedding_system import VectorStore, INDEX_TYPES
+from data_preparation import PDFExtractor
+from tokenization import TokenCounter
+from csf import ControlIndex, tag_chunk
+
+DEFAULT_PDF = "../data/cis-ms-isac-nist-cybersecurity-framework-policy-template-guide-2024.pdf"
+
+def build_knowledge_base(pdf_paths: Optional[List[str]] = None, index_type: str = "flat",
+                         output_dir: str = "../models/knowledge_base",
+                         chunk_size: int = 256, overlap: int = 32, tokenizer: Optional[str] = None):
+    vector_store = VectorStore(index_type=index_type)
+    # Chunk sizes are measured with the embedding model's own tokenizer so
+    # chunks fit its input window
+    token_counter = TokenCounter(vector_store.model.tokenizer)
+    # Stored token counts are in the LLM's units (the same tokenizer the
+    # handler is given, or the estimate) so prompt packing can use them
+    llm_counter = TokenCounter.from_pretrained(tokenizer) if tokenizer else TokenCounter()
+    vector_store.token_counter = llm_counter.name
+
+    # Extract and chunk every reference document (CIS, NIST 800-53, ISO 27001, ...)
+    chunks = []
+    for pdf_path in pdf_paths or [DEFAULT_PDF]:
+        extractor = PDFExtractor(pdf_path, token_counter=token_counter)
+        for chunk in extractor.iter_chunks(chunk_size=chunk_size, overlap=overlap):
+            chunk['chunk_id'] = len(chunks)
+            chunk['source'] = os.path.basename(pdf_path)
+            chunk['token_count'] = llm_counter.count(chunk['text'])
+            # CSF function/category/subcategory tags from control IDs in the text
+            chunks.append(tag_chunk(chunk))
 
-def build_knowledge_base():
-    # Extract text from PDF
-    pdf_path = "../data/cis-ms-isac-nist-cybersecurity-framework-policy-template-guide-2024.pdf"
-    extractor = PDFExtractor(pdf_path)
-    text = extractor.extract_text()
-    
-    # Chunk the text
-    chunks = extractor.chunk_text(text, chunk_size=500)
-    
     # Create embeddings
-    vector_store = VectorStore()
     embeddings = vector_store.create_embeddings(chunks)
-    
-    # Save index
-    os.makedirs("../models", exist_ok=True)
-    vector_store.save_index(
-        "../models/faiss_index.bin",
-        "../models/chunks.pkl"
-    )
-    
+
+    # Save index, embeddings and chunks in the memory-mapped format
+    vector_store.save_compact(output_dir)
+
+    # Controls -> chunk ids, for coverage scoring without a search per control
+    controls = ControlIndex.build(chunks)
+    controls.save(output_dir)
+
     print(f"Knowledge base created with {len(chunks)} chunks")
+    print(f"CSF controls indexed: {len(controls)} in {len(controls.categories)} categories")
     print(f"Embedding dimension: {embeddings.shape[1]}")
-    
-    # Also save text chunks for reference
-    with open("../data/reference_chunks.json", "w") as f:
-        json.dump(chunks, f, indent=2)
-    
+
+    if index_type != "flat":
+        report = vector_store.recall_at_k(k=10)
+        print(f"{index_type} recall@{report['k']} vs flat: {report['recall']:.3f} "
+              f"({report['index_ms_per_query']:.3f} ms vs {report['exact_ms_per_query']:.3f} ms per query)")
+
     return vector_store
 
 if __name__ == "__main__":
-    build_knowledge_base()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the reference knowledge base")
+    parser.add_argument("pdfs", nargs="*", help=f"Reference PDFs (default: {DEFAULT_PDF})")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index type")
+    parser.add_argument("--output-dir", default="../models/knowledge_base")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Maximum tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=32, help="Tokens shared between consecutive chunks")
+    parser.add_argument("--tokenizer",
+                        help="Hugging Face tokenizer of the LLM, as given to main.py, to store chunk token counts in")
+    args = parser.parse_args()
+    build_knowledge_base(args.pdfs, args.index_type, args.output_dir, args.chunk_size, args.overlap, args.tokenizer)
@@ -0,0 +1,95 @@
+"""Submit policy files to a running server.py and wait for the results"""
+import sys
+import json
+import time
+import argparse
+import http.client
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+from server import DEFAULT_PORT
+
+class PolicyClient:
+    """Client for the analysis server; waits and retries when its queue is full"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), json.loads(response.read() or b"{}")
+        finally:
+            conn.close()
+
+    def submit(self, policy_name: str, policy_text: str, max_wait: float = 600) -> str:
+        """Submit a job, backing off while the server reports a full queue"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            status, headers, body = self._request("POST", "/jobs",
+                                                  {"policy_name": policy_name, "policy_text": policy_text})
+            if status == 202:
+                return body["job_id"]
+            if status != 503 or time.monotonic() > deadline:
+                raise RuntimeError(f"Server refused {policy_name}: {body.get('error', status)}")
+            time.sleep(float(headers.get("Retry-After", 5)))
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        status, _, body = self._request("GET", f"/jobs/{job_id}")
+        if status != 200:
+            raise RuntimeError(f"Job {job_id}: {body.get('error', status)}")
+        return body
+
+    def wait(self, job_id: str, poll_interval: float = 1.0) -> Dict[str, Any]:
+        """Poll until the job is done or failed"""
+        while True:
+            job = self.status(job_id)
+            if job["status"] in ("done", "error"):
+                return job
+            time.sleep(poll_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit policies to a running PolicyGapFixer server")
+    parser.add_argument("policies", nargs="+", help="Policy files or directories")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--no-wait", action="store_true", help="Print job ids without waiting for results")
+    args = parser.parse_args()
+
+    files: List[Path] = []
+    for target in args.policies:
+        path = Path(target)
+        files.extend(sorted(path.glob("*.txt")) if path.is_dir() else [path])
+
+    client = PolicyClient(args.host, args.port)
+    try:
+        jobs = {client.submit(path.stem, path.read_text()): path.stem for path in files}
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.no_wait:
+        for job_id, policy_name in jobs.items():
+            print(f"{policy_name}: {job_id}")
+        return
+
+    failed = 0
+    for job_id, policy_name in jobs.items():
+        job = client.wait(job_id)
+        if job["status"] == "error":
+            failed += 1
+            print(f" {policy_name}: failed ({job['error']})")
+            continue
+        result = job["result"]
+        summary = result["gap_analysis"]["summary"]
+        print(f" {policy_name}: {summary['total_gaps']} gaps ({summary['high_priority_gaps']} high) "
+              f"-> {result['output_dir']}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""NIST CSF control taxonomy, knowledge base tagging and control coverage
+
+Subcategory IDs such as PR.AC-1 (CSF 1.1) or GV.OC-01 (CSF 2.0) are found
+in chunk text and normalized to two-digit form (PR.AC-01). The knowledge
+base build tags every chunk with its functions, categories and
+subcategories and saves a ControlIndex mapping each control to the chunks
+that state it. At analysis time the index turns section embeddings into a
+sparse section x control coverage matrix with one matrix product over the
+tagged rows of the memory-mapped embeddings.
+"""
+import os
+import re
+import json
+from typing import Dict, List, Any, Optional
+import numpy as np
+
+# CSF 2.0 function codes in dependency order; Govern is new in 2.0
+FUNCTIONS = {"GV": "Govern", "ID": "Identify", "PR": "Protect", "DE": "Detect", "RS": "Respond", "RC": "Recover"}
+FUNCTION_NAMES = list(FUNCTIONS.values())
+
+CONTROL_ID = re.compile(r"\b(GV|ID|PR|DE|RS|RC)\.([A-Z]{2})-(\d{1,2})\b")
+
+# Section similarity at or above which a section covers a control. Not yet
+# calibrated for the real embedding model (benchmark.py sweeps it), so
+# coverage is opt-in (--coverage) and its gaps are Low severity and kept
+# out of the summary totals
+DEFAULT_COVERAGE_THRESHOLD = 0.5
+
+def find_controls(text: str) -> List[str]:
+    """Normalized control IDs mentioned in text, in order of first mention"""
+    found = []
+    for function, category, number in CONTROL_ID.findall(text or ""):
+        control = f"{function}.{category}-{int(number):02d}"
+        if control not in found:
+            found.append(control)
+    return found
+
+def function_of(control: str) -> Optional[str]:
+    """CSF function name for a control or category ID, e.g. PR.AC-01 -> Protect"""
+    return FUNCTIONS.get(control[:2])
+
+def category_of(control: str) -> str:
+    return control.split("-")[0]
+
+def tag_chunk(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Add csf_subcategories, csf_categories and csf_functions to a chunk
+
+    Values are ;-separated strings (empty when the chunk names no control)
+    so they fit the string columns of the memory-mapped chunk store.
+    """
+    controls = find_controls(chunk.get('text', ''))
+    categories = list(dict.fromkeys(category_of(control) for control in controls))
+    functions = list(dict.fromkeys(function_of(control) for control in controls))
+    chunk['csf_subcategories'] = ";".join(controls)
+    chunk['csf_categories'] = ";".join(categories)
+    chunk['csf_functions'] = ";".join(functions)
+    return chunk
+
+def _description(text: str, control: str, limit: int = 200) -> str:
+    """Text following the first mention of a control, as a short description"""
+    for match in CONTROL_ID.finditer(text):
+        if f"{match.group(1)}.{match.group(2)}-{int(match.group(3)):02d}" == control:
+            rest = text[match.end():].lstrip(" :-–—")
+            # Stop at the next control ID
+            rest = CONTROL_ID.split(rest)[0]
+            return " ".join(rest.split())[:limit].strip()
+    return ""
+
+class ControlIndex:
+    """Controls mapped to the knowledge base chunk ids that state them"""
+    FILENAME = "control_index.json"
+
+    def __init__(self, chunk_ids: Dict[str, List[int]], descriptions: Optional[Dict[str, str]] = None):
+        self.chunk_ids = {control: sorted(set(ids)) for control, ids in chunk_ids.items() if ids}
+        self.controls = sorted(self.chunk_ids, key=lambda c: (FUNCTION_NAMES.index(function_of(c)), c))
+        self.descriptions = descriptions or {}
+        self.categories: Dict[str, List[str]] = {}
+        for control in self.controls:
+            self.categories.setdefault(category_of(control), []).append(control)
+
+    def __len__(self) -> int:
+        return len(self.controls)
+
+    @classmethod
+    def build(cls, chunks: List[Dict[str, Any]]) -> "ControlIndex":
+        """Index chunks by the controls they mention; chunk ids are list positions"""
+        chunk_ids: Dict[str, List[int]] = {}
+        descriptions: Dict[str, str] = {}
+        for position, chunk in enumerate(chunks):
+            text = chunk.get('text', '')
+            for control in find_controls(text):
+                chunk_ids.setdefault(control, []).append(position)
+                if not descriptions.get(control):
+                    descriptions[control] = _description(text, control)
+        return cls(chunk_ids, descriptions)
+
+    def save(self, kb_dir: str):
+        with open(os.path.join(kb_dir, self.FILENAME), 'w') as f:
+            json.dump({"chunk_ids": self.chunk_ids, "descriptions": self.descriptions}, f, indent=2)
+
+    @classmethod
+    def load(cls, kb_dir: str) -> Optional["ControlIndex"]:
+        """The index saved with a knowledge base, or None for one built without it"""
+        path = os.path.join(kb_dir, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data["chunk_ids"], data.get("descriptions"))
+
+    def coverage(self, section_embeddings: np.ndarray, kb_embeddings: np.ndarray,
+                 threshold: float = DEFAULT_COVERAGE_THRESHOLD) -> Dict[str, Any]:
+        """Sparse section x control coverage matrix
+
+        The score of a (section, control) pair is the highest cosine
+        similarity between the section and any chunk stating the control;
+        embeddings are assumed normalized. Only tagged rows of kb_embeddings
+        are read, so a memory-mapped array stays mostly on disk. Returns
+        controls (column order), entries as [row, column, score] for scores
+        at or above threshold, and best, each control's highest score.
+        """
+        if not self.controls or len(section_embeddings) == 0:
+            return {"controls": self.controls, "entries": [], "best": [0.0] * len(self.controls)}
+        columns = np.array([i for control in self.controls for i in self.chunk_ids[control]], dtype=np.int64)
+        starts = np.cumsum([0] + [len(self.chunk_ids[control]) for control in self.controls[:-1]])
+        rows, inverse = np.unique(columns, return_inverse=True)
+        chunk_vectors = np.asarray(kb_embeddings[rows], dtype='float32')
+
+        similarities = np.asarray(section_embeddings, dtype='float32') @ chunk_vectors.T
+        scores = np.maximum.reduceat(similarities[:, inverse], starts, axis=1)
+        hit_rows, hit_columns = np.nonzero(scores >= threshold)
+        return {
+            "controls": self.controls,
+            "entries": [[int(r), int(c), round(float(scores[r, c]), 4)] for r, c in zip(hit_rows, hit_columns)],
+            "best": [round(float(score), 4) for score in scores.max(axis=0)]
+        }
+
+    def uncovered(self, coverage: Dict[str, Any], scope: str = "categories") -> List[str]:
+        """Controls no section covers
+
+        With scope "categories" only controls in categories the policy
+        covers at least partly are reported, so a password policy is not
+        faulted for lacking a recovery plan; "all" reports every control.
+        """
+        covered = {self.controls[column] for _, column, _ in coverage["entries"]}
+        if scope == "all":
+            return [control for control in self.controls if control not in covered]
+        touched = {category_of(control) for control in covered}
+        return [control for control in self.controls
+                if control not in covered and category_of(control) in touched]
+
+    def gap(self, control: str) -> Dict[str, Any]:
+        """Gap entry for an uncovered control, in the shape the LLM produces
+
+        Severity is Low: the gap rests on a similarity threshold, not on an
+        LLM reading of the policy.
+        """
+        description = self.descriptions.get(control, "")
+        return {
+            "gap_description": f"No policy section addresses {control}" + (f": {description}" if description else ""),
+            "severity": "Low",
+            "nist_function": function_of(control),
+            "recommendation": f"Add policy requirements that meet {control}",
+            "control": control
+        }
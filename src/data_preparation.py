@@ -1,58 +1,174 @@
-import PyPDF2
 import re
-from typing import List, Dict
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterator, Iterable, Optional, Tuple
 import json
+from tokenization import TokenCounter
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract text for pages [start, stop); runs in a worker process"""
+    from PyPDF2 import PdfReader
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, stop)]
 
 class PDFExtractor:
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, max_workers: Optional[int] = None, pages_per_task: int = 8,
+                 token_counter: Optional[TokenCounter] = None):
         self.pdf_path = pdf_path
-        
+        # Without a token counter chunk sizes are measured in words
+        self.token_counter = token_counter
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+
+    def page_count(self) -> int:
+        from PyPDF2 import PdfReader
+        with open(self.pdf_path, 'rb') as file:
+            return len(PdfReader(file).pages)
+
+    def iter_pages(self) -> Iterator[Tuple[int, str]]:
+        """Yield (page_number, text) in page order
+
+        Page ranges are extracted in a process pool. Only a bounded window of
+        ranges is in flight at once, so memory does not grow with the PDF.
+        """
+        total = self.page_count()
+        ranges = [(start, min(start + self.pages_per_task, total))
+                  for start in range(0, total, self.pages_per_task)]
+
+        if self.max_workers <= 1 or len(ranges) <= 1:
+            for start, stop in ranges:
+                for offset, text in enumerate(_extract_page_range(self.pdf_path, start, stop)):
+                    yield start + offset + 1, text
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            remaining = iter(ranges)
+            for start, stop in remaining:
+                pending.append((start, executor.submit(_extract_page_range, self.pdf_path, start, stop)))
+                if len(pending) >= self.max_workers * 2:
+                    break
+            while pending:
+                start, future = pending.popleft()
+                for offset, text in enumerate(future.result()):
+                    yield start + offset + 1, text
+                next_range = next(remaining, None)
+                if next_range is not None:
+                    pending.append((next_range[0], executor.submit(_extract_page_range, self.pdf_path, *next_range)))
+
     def extract_text(self) -> str:
         """Extract text from PDF"""
-        text = ""
-        with open(self.pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
-        return text
-    
-    def chunk_text(self, text: str, chunk_size: int = 1000) -> List[Dict]:
+        return "".join(text for _, text in self.iter_pages())
+
+    def iter_sentences(self) -> Iterator[Tuple[int, int, str]]:
+        """Yield (first_page, last_page, sentence), joining sentences split across pages"""
+        carry = ""
+        carry_page = page_num = 1
+        for page_num, text in self.iter_pages():
+            if not carry:
+                carry_page = page_num
+            # Keep the last word of a page apart from the first word of the next
+            pieces = SENTENCE_BOUNDARY.split(f"{carry}\n{text}" if carry else text)
+            # The last piece may continue on the next page
+            for piece in pieces[:-1]:
+                yield carry_page, page_num, piece
+                carry_page = page_num
+            carry = pieces[-1]
+            # unless the page ends on a sentence boundary
+            if carry.rstrip().endswith(('.', '!', '?')):
+                yield carry_page, page_num, carry
+                carry = ""
+        if carry.strip():
+            yield carry_page, page_num, carry
+
+    def iter_chunks(self, chunk_size: int = 1000, overlap: int = 0) -> Iterator[Dict]:
+        """Stream chunks with page provenance as the PDF is read"""
+        return self._pack_sentences(self.iter_sentences(), chunk_size, overlap, with_pages=True)
+
+    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 0) -> List[Dict]:
         """Split text into manageable chunks"""
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        chunks = []
-        current_chunk = []
+        sentences = ((None, None, sentence) for sentence in SENTENCE_BOUNDARY.split(text))
+        return list(self._pack_sentences(sentences, chunk_size, overlap, with_pages=False))
+
+    def _measure(self, text: str) -> int:
+        if self.token_counter is not None:
+            return self.token_counter.count(text)
+        return len(text.split())
+
+    def _split_long(self, text: str, chunk_size: int) -> List[str]:
+        if self.token_counter is not None:
+            return self.token_counter.split(text, chunk_size)
+        words = text.split()
+        return [' '.join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
+
+    def _pack_sentences(self, sentences: Iterable[Tuple[Optional[int], Optional[int], str]], chunk_size: int,
+                        overlap: int, with_pages: bool) -> Iterator[Dict]:
+        """Greedily pack sentences into chunks of at most chunk_size tokens
+
+        Sentences longer than chunk_size are split on word boundaries. Each
+        chunk after the first starts with trailing sentences of the previous
+        one totalling at most overlap tokens. Chunks carry their token_count
+        when a token counter is configured.
+        """
+        chunk_id = 0
+        current: List[Tuple[Optional[int], Optional[int], str, int]] = []
         current_length = 0
-        
-        for sentence in sentences:
-            sentence_length = len(sentence.split())
-            if current_length + sentence_length > chunk_size and current_chunk:
-                chunks.append({
-                    'text': ' '.join(current_chunk),
-                    'chunk_id': len(chunks)
-                })
-                current_chunk = [sentence]
-                current_length = sentence_length
+
+        def make_chunk():
+            chunk = {'text': ' '.join(item[2] for item in current), 'chunk_id': chunk_id}
+            if self.token_counter is not None:
+                chunk['token_count'] = current_length
+            if with_pages:
+                chunk['page_start'] = current[0][0]
+                chunk['page_end'] = current[-1][1]
+            return chunk
+
+        def overlap_tail():
+            tail = []
+            tail_length = 0
+            for item in reversed(current):
+                if tail_length + item[3] > overlap:
+                    break
+                tail.insert(0, item)
+                tail_length += item[3]
+            return tail, tail_length
+
+        for first_page, last_page, sentence in sentences:
+            # Blank pages and empty documents would otherwise yield empty chunks
+            if not sentence.strip():
+                continue
+            sentence_length = self._measure(sentence)
+            if sentence_length > chunk_size:
+                parts = [(first_page, last_page, part, self._measure(part))
+                         for part in self._split_long(sentence, chunk_size)]
             else:
-                current_chunk.append(sentence)
-                current_length += sentence_length
-        
-        if current_chunk:
-            chunks.append({
-                'text': ' '.join(current_chunk),
-                'chunk_id': len(chunks)
-            })
-        
-        return chunks
+                parts = [(first_page, last_page, sentence, sentence_length)]
+
+            for part in parts:
+                if current_length + part[3] > chunk_size and current:
+                    yield make_chunk()
+                    chunk_id += 1
+                    current, current_length = overlap_tail() if overlap > 0 else ([], 0)
+                    # Drop overlap that would not leave room for the new sentence
+                    while current and current_length + part[3] > chunk_size:
+                        current_length -= current.pop(0)[3]
+                current.append(part)
+                current_length += part[3]
+
+        if current:
+            yield make_chunk()
 
 
 if __name__ == "__main__":
     extractor = PDFExtractor("../data/cis-ms-isac-nist-cybersecurity-framework-policy-template-guide-2024.pdf")
-    text = extractor.extract_text()
-    chunks = extractor.chunk_text(text)
-    
+    chunks = list(extractor.iter_chunks())
+
     # Save chunks
     with open("../data/reference_chunks.json", "w") as f:
         json.dump(chunks, f, indent=2)
-    
-    print(f"Extracted {len(chunks)} chunks")
\ No newline at end of file
+
+    print(f"Extracted {len(chunks)} chunks")
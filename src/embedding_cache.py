@@ -0,0 +1,100 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+import numpy as np
+
+
+class EmbeddingCache:
+    """In-process LRU cache of query embeddings keyed by normalized text.
+
+    An optional SQLite file backs the in-memory entries so embeddings of
+    boilerplate sections survive between runs.
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None, namespace: str = ""):
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse whitespace so trivially reformatted sections share an entry"""
+        return ' '.join(text.split())
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\n{self.normalize(text)}".encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return the cached embedding for text, or None on a miss"""
+        key = self.key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            elif self._conn is not None:
+                row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype='float32')
+                    self._remember(key, vector)
+
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def put(self, text: str, vector: np.ndarray):
+        """Store an embedding in memory and in the backing file"""
+        key = self.key(text)
+        vector = np.asarray(vector, dtype='float32')
+        with self._lock:
+            self._remember(key, vector)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    (key, vector.tobytes())
+                )
+                self._conn.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self)
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
@@ -1,16 +1,179 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
 import pickle
 import os
-from typing import List, Dict
+import json
+import mmap
+import time
+from typing import List, Dict, Any, Optional
+from embedding_cache import EmbeddingCache
+from tracing import tracer
+
+KB_FORMAT_VERSION = 1
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so a squared L2 distance d is a cosine of 1 - d/2"""
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def is_normalized(vectors: np.ndarray, sample: int = 256, tolerance: float = 1e-3) -> bool:
+    """Whether the first sample rows have unit length (all-zero rows allowed)"""
+    norms = np.linalg.norm(np.asarray(vectors[:sample], dtype='float32'), axis=1)
+    return bool(np.all((np.abs(norms - 1.0) < tolerance) | (norms == 0)))
+
+class ChunkStore:
+    """Read-only chunk sequence backed by memory-mapped files
+    
+    Text fields live in one concatenated UTF-8 buffer with an offsets array
+    and integer fields in .npy arrays, so opening the store costs the same
+    regardless of corpus size and only the chunks that are accessed get
+    decoded. Pages are shared between processes mapping the same files.
+    """
+    
+    def __init__(self, kb_dir: str, fields: Dict[str, str], count: int):
+        self.kb_dir = kb_dir
+        self.count = count
+        self._ints = {}
+        self._strings = {}
+        for name, kind in fields.items():
+            if kind == 'int':
+                self._ints[name] = np.load(os.path.join(kb_dir, f"{name}.npy"), mmap_mode='r')
+            else:
+                offsets = np.load(os.path.join(kb_dir, f"{name}_offsets.npy"), mmap_mode='r')
+                self._strings[name] = (self._map_buffer(os.path.join(kb_dir, f"{name}.bin")), offsets)
+    
+    @staticmethod
+    def _map_buffer(path: str):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    @staticmethod
+    def write(kb_dir: str, chunks: List[Dict]) -> Dict[str, str]:
+        """Write chunks in columnar form; returns the field types"""
+        fields = {}
+        # Union of keys in first-seen order; chunks lacking a key store None
+        keys = list(dict.fromkeys(key for chunk in chunks for key in chunk)) if chunks else ['text']
+        for key in keys:
+            values = [chunk.get(key) for chunk in chunks]
+            if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+                fields[key] = 'int'
+                np.save(os.path.join(kb_dir, f"{key}.npy"), np.asarray(values, dtype=np.int64))
+            else:
+                fields[key] = 'str'
+                encoded = [("" if v is None else str(v)).encode('utf-8') for v in values]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(b) for b in encoded], out=offsets[1:])
+                with open(os.path.join(kb_dir, f"{key}.bin"), 'wb') as f:
+                    f.write(b"".join(encoded))
+                np.save(os.path.join(kb_dir, f"{key}_offsets.npy"), offsets)
+        return fields
+    
+    def field(self, name: str, idx: int) -> Any:
+        """Decode a single field of a single chunk"""
+        if name in self._ints:
+            return int(self._ints[name][idx])
+        buffer, offsets = self._strings[name]
+        return buffer[int(offsets[idx]):int(offsets[idx + 1])].decode('utf-8')
+    
+    def text(self, idx: int) -> str:
+        return self.field('text', idx)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __getitem__(self, idx) -> Dict[str, Any]:
+        idx = int(idx)
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        chunk = {name: self.field(name, idx) for name in self._ints}
+        chunk.update({name: self.field(name, idx) for name in self._strings})
+        return chunk
+    
+    def __iter__(self):
+        for idx in range(self.count):
+            yield self[idx]
 
 class VectorStore:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
-        self.index = None
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", index_type: str = "flat",
+                 nlist: int = 100, pq_m: int = 16, hnsw_m: int = 32,
+                 nprobe: int = 10, ef_search: int = 64, batch_size: int = 32,
+                 embedding_cache: Optional[EmbeddingCache] = None):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+        # The embedding model and FAISS index are loaded on first use, so runs
+        # that never embed or search (all sections cached) skip both
+        self._model = None
+        self._index = None
+        self._index_path = None
+        self._dimension = None
+        self.model_name = model_name
         self.chunks = []
-        self.dimension = 384  
+        self.embeddings = None
+        # Whether corpus embeddings have unit length (None if unknown); query
+        # embeddings always do, so scores convert to cosine similarities
+        self.normalized: Optional[bool] = True
+        # Name of the TokenCounter that produced the chunks' token_count, so
+        # prompt packing can tell whether the stored counts are in its units
+        self.token_counter: Optional[str] = None
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.hnsw_m = hnsw_m
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.batch_size = batch_size
+        # Query embeddings of repeated sections ("Purpose", "Scope", ...) skip the model
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache(namespace=model_name)
+    
+    @property
+    def model(self):
+        """SentenceTransformer, loaded on first access"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    @property
+    def index(self):
+        """FAISS index; one opened with load_compact is read on first access"""
+        if self._index is None and self._index_path is not None:
+            self._index = self._read_index(self._index_path)
+            self._apply_search_params(self._index)
+        return self._index
+    
+    @index.setter
+    def index(self, index):
+        self._index = index
+        self._index_path = None
+    
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.model.get_sentence_embedding_dimension()
+        return self._dimension
+    
+    @dimension.setter
+    def dimension(self, dimension: int):
+        self._dimension = dimension
+    
+    @staticmethod
+    def _read_index(index_path: str):
+        """Memory-map the index file where FAISS supports it"""
+        import faiss
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except (RuntimeError, AttributeError):
+            # Index types without mmap support are read normally
+            return faiss.read_index(index_path)
         
     def create_embeddings(self, chunks: List[Dict]) -> np.ndarray:
         """Create embeddings for text chunks"""
@@ -18,37 +181,221 @@ class VectorStore:
         self.chunks = chunks
         
         print("Creating embeddings...")
-        embeddings = self.model.encode(texts, show_progress_bar=True)
+        self.embeddings = normalize(self.model.encode(texts, show_progress_bar=True))
+        self.normalized = True
+        
+        self.dimension = self.embeddings.shape[1]
+        self.index = self._build_index(self.embeddings)
+        
+        return self.embeddings
+    
+    def _build_index(self, embeddings: np.ndarray):
+        """Build (and train, for IVF types) the configured FAISS index"""
+        import faiss
+        n, d = embeddings.shape
+        if self.index_type == "flat":
+            index = faiss.IndexFlatL2(d)
+        elif self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(d, self.hnsw_m)
+        else:
+            # IVF needs at least one training point per list
+            nlist = max(1, min(self.nlist, n))
+            quantizer = faiss.IndexFlatL2(d)
+            if self.index_type == "ivf_flat":
+                index = faiss.IndexIVFFlat(quantizer, d, nlist)
+            else:
+                if d % self.pq_m:
+                    raise ValueError(f"pq_m={self.pq_m} must divide the embedding dimension {d}")
+                # PQ codebooks need 2**nbits training points
+                nbits = max(1, min(8, int(np.log2(max(n, 2)))))
+                index = faiss.IndexIVFPQ(quantizer, d, nlist, self.pq_m, nbits)
+            print(f"Training {self.index_type} index with {nlist} lists...")
+            index.train(embeddings)
+        
+        index.add(embeddings)
+        self._apply_search_params(index)
+        return index
+    
+    def _apply_search_params(self, index):
+        """Push nprobe / efSearch onto an index that supports them"""
+        import faiss
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = self.nprobe
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = self.ef_search
+    
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune the recall/speed trade-off of an approximate index"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self._index is not None:
+            self._apply_search_params(self._index)
+    
+    def recall_at_k(self, k: int = 10, num_queries: int = 100, seed: int = 0) -> Dict[str, Any]:
+        """Compare the index against exact flat search using corpus vectors as queries"""
+        import faiss
+        embeddings = np.asarray(self.embeddings, dtype='float32')
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+        queries = embeddings[sample]
+        k = min(k, len(embeddings))
+        
+        exact = faiss.IndexFlatL2(embeddings.shape[1])
+        exact.add(embeddings)
+        start = time.perf_counter()
+        _, truth = exact.search(queries, k)
+        exact_time = time.perf_counter() - start
         
-       
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.index.add(embeddings.astype('float32'))
+        start = time.perf_counter()
+        _, found = self.index.search(queries, k)
+        index_time = time.perf_counter() - start
         
-        return embeddings
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        return {
+            "index_type": self.index_type,
+            "k": k,
+            "queries": len(queries),
+            "recall": hits / (len(queries) * k),
+            "exact_ms_per_query": 1000 * exact_time / len(queries),
+            "index_ms_per_query": 1000 * index_time / len(queries)
+        }
     
     def save_index(self, index_path: str, chunks_path: str):
         """Save FAISS index and chunks"""
+        import faiss
         faiss.write_index(self.index, index_path)
         with open(chunks_path, 'wb') as f:
             pickle.dump(self.chunks, f)
     
     def load_index(self, index_path: str, chunks_path: str):
         """Load FAISS index and chunks"""
+        import faiss
         self.index = faiss.read_index(index_path)
+        self.dimension = self.index.d
+        self._apply_search_params(self.index)
+        try:
+            self.normalized = is_normalized(self.index.reconstruct_n(0, min(256, self.index.ntotal)))
+        except RuntimeError:
+            # Index types that cannot reconstruct vectors
+            self.normalized = None
         with open(chunks_path, 'rb') as f:
             self.chunks = pickle.load(f)
     
+    def save_compact(self, kb_dir: str):
+        """Save the knowledge base in the memory-mappable directory format"""
+        import faiss
+        os.makedirs(kb_dir, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(kb_dir, "index.faiss"))
+        
+        embeddings = self.embeddings
+        if embeddings is None:
+            embeddings = self.index.reconstruct_n(0, self.index.ntotal)
+        np.save(os.path.join(kb_dir, "embeddings.npy"), np.ascontiguousarray(embeddings, dtype='float32'))
+        
+        fields = ChunkStore.write(kb_dir, list(self.chunks))
+        with open(os.path.join(kb_dir, "manifest.json"), 'w') as f:
+            json.dump({
+                "version": KB_FORMAT_VERSION,
+                "model_name": self.model_name,
+                "count": len(self.chunks),
+                "dimension": int(embeddings.shape[1]) if len(embeddings) else self.dimension,
+                "index_type": self.index_type,
+                "normalized": is_normalized(embeddings),
+                "token_counter": self.token_counter,
+                "fields": fields
+            }, f, indent=2)
+    
+    def load_compact(self, kb_dir: str):
+        """Open a knowledge base saved with save_compact without reading it into memory
+        
+        The FAISS index is opened on first search.
+        """
+        with open(os.path.join(kb_dir, "manifest.json"), 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("version") != KB_FORMAT_VERSION:
+            raise ValueError(f"Unsupported knowledge base version: {manifest.get('version')}")
+        
+        # Opened on first search, so loading a knowledge base does not import FAISS
+        self._index = None
+        self._index_path = os.path.join(kb_dir, "index.faiss")
+        
+        if manifest.get("model_name") not in (None, self.model_name):
+            print(f"Warning: knowledge base was embedded with {manifest['model_name']}, "
+                  f"queries use {self.model_name}")
+        self.index_type = manifest.get("index_type", "flat")
+        
+        self.embeddings = np.load(os.path.join(kb_dir, "embeddings.npy"), mmap_mode='r')
+        # Knowledge bases saved before the flag are checked on a sample of rows
+        self.normalized = manifest.get("normalized")
+        if self.normalized is None:
+            self.normalized = is_normalized(self.embeddings)
+        self.token_counter = manifest.get("token_counter")
+        self.chunks = ChunkStore(kb_dir, manifest["fields"], manifest["count"])
+        self.dimension = manifest["dimension"]
+    
+    def encode_queries(self, queries: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Embed queries, encoding only those missing from the embedding cache"""
+        vectors: List[Optional[np.ndarray]] = [None] * len(queries)
+        missing: Dict[str, List[int]] = {}
+        for i, query in enumerate(queries):
+            if self.embedding_cache is None:
+                missing.setdefault(query, []).append(i)
+                continue
+            cached = self.embedding_cache.get(query)
+            if cached is None:
+                missing.setdefault(EmbeddingCache.normalize(query), []).append(i)
+            else:
+                vectors[i] = cached
+        
+        cache_hits = len(queries) - sum(len(positions) for positions in missing.values())
+        tracer.count("embedding_cache_hits_total", cache_hits)
+        tracer.count("embedding_cache_misses_total", len(queries) - cache_hits)
+        span = tracer.current()
+        if span is not None:
+            span.set("cache_hits", cache_hits)
+        
+        if missing:
+            # Encode each distinct missing query once, using its first occurrence
+            texts = [queries[positions[0]] for positions in missing.values()]
+            with tracer.span("vector_store.encode", texts=len(texts)):
+                encoded = np.asarray(self.model.encode(texts, batch_size=batch_size or self.batch_size),
+                                     dtype='float32')
+            for text, positions, vector in zip(texts, missing.values(), encoded):
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(text, vector)
+                for i in positions:
+                    vectors[i] = vector
+        
+        return normalize(np.vstack(vectors))
+    
     def search(self, query: str, k: int = 5) -> List[Dict]:
         """Search for similar chunks"""
-        query_embedding = self.model.encode([query])
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
-        
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.chunks):
-                results.append({
-                    'chunk': self.chunks[idx],
-                    'score': float(distances[0][i])
-                })
-        
-        return results
\ No newline at end of file
+        return self.search_batch([query], k)[0]
+    
+    def search_batch(self, queries: List[str], k: int = 5, batch_size: Optional[int] = None) -> List[List[Dict]]:
+        """Search for many queries with batched encoding and one index search
+        
+        Queries are encoded batch_size at a time (default self.batch_size) and
+        the whole query matrix goes through a single FAISS search.
+        """
+        if not queries:
+            return []
+        with tracer.span("vector_store.search", queries=len(queries), k=k, index_type=self.index_type):
+            query_embeddings = self.encode_queries(queries, batch_size)
+            distances, indices = self.index.search(np.asarray(query_embeddings, dtype='float32'), k)
+        
+        all_results = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for distance, idx in zip(row_distances, row_indices):
+                if 0 <= idx < len(self.chunks):
+                    results.append({
+                        'chunk': self.chunks[idx],
+                        'score': float(distance)
+                    })
+            all_results.append(results)
+        
+        return all_results
@@ -1,92 +1,345 @@
 import json
-from typing import List, Dict, Any
-from embedding_system import VectorStore
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, TYPE_CHECKING
 from llm_handler import LocalLLMHandler
+from json_schema import schema_from_example
+from prescreen import PreScreener
+from csf import FUNCTION_NAMES, ControlIndex, DEFAULT_COVERAGE_THRESHOLD
+from tracing import tracer
+
+if TYPE_CHECKING:
+    # Only needed for annotations; importing it here would slow startup
+    from embedding_system import VectorStore
+
+# Identical for every section so backends can reuse the cached prompt prefix
+SECTION_ANALYSIS_PREAMBLE = """Analyze the policy section below against cybersecurity standards.
+
+Identify specific gaps where the policy is missing or insufficient compared to best practices.
+For each gap, specify:
+1. Gap Description
+2. Severity (High/Medium/Low)
+3. Relevant NIST CSF Function
+4. Recommended improvement
+
+Provide the analysis in structured format."""
+
+SECTION_OUTPUT_FORMAT = {
+    "section": "Policy section title",
+    "gaps": [
+        {
+            "gap_description": "Description of the gap",
+            "severity": "High/Medium/Low",
+            "nist_function": "Govern/Identify/Protect/Detect/Respond/Recover",
+            "recommendation": "Specific recommendation to address gap"
+        }
+    ]
+}
+
+# CSF 2.0 functions in dependency order, from the control taxonomy
+NIST_FUNCTIONS = list(FUNCTION_NAMES)
+
+# Pseudo-section holding gaps for controls no policy section covers
+COVERAGE_SECTION = "Control coverage"
+
+# Constrained decoding schema: same shape as SECTION_OUTPUT_FORMAT with the
+# severity and NIST function restricted to their allowed values
+SECTION_SCHEMA = schema_from_example(SECTION_OUTPUT_FORMAT, enums={
+    "severity": ["High", "Medium", "Low"],
+    "nist_function": NIST_FUNCTIONS
+})
+
+def split_policy_sections(policy_text: str) -> List[Tuple[str, str, List[str]]]:
+    """Split policy text into (title, heading line, body lines) in document order
+
+    Lines starting with ## or ** are headings; text before the first one is
+    the "Header" section. Body lines are stripped.
+    """
+    sections = []
+    current_section = "Header"
+    current_heading = ""
+    current_content = []
+    
+    for line in policy_text.split('\n'):
+        line = line.strip()
+        if line and (line.startswith('##') or line.startswith('**')):
+            if current_content:
+                sections.append((current_section, current_heading, current_content))
+            current_section = line.replace('#', '').replace('*', '').strip()
+            current_heading = line
+            current_content = []
+        else:
+            current_content.append(line)
+    
+    if current_content:
+        sections.append((current_section, current_heading, current_content))
+    
+    return sections
 
 class GapAnalyzer:
-    def __init__(self, vector_store: VectorStore, llm_handler: LocalLLMHandler):
+    def __init__(self, vector_store: "VectorStore", llm_handler: LocalLLMHandler, max_workers: int = 1,
+                 prescreen: Optional[PreScreener] = None, controls: Optional[ControlIndex] = None,
+                 coverage_threshold: float = DEFAULT_COVERAGE_THRESHOLD, coverage_scope: str = "categories"):
         self.vector_store = vector_store
         self.llm = llm_handler
-        self.nist_functions = ["Identify", "Protect", "Detect", "Respond", "Recover"]
+        self.max_workers = max_workers
+        self.nist_functions = list(NIST_FUNCTIONS)
+        # Pre-screen and coverage thresholds are cosine similarities, which
+        # scores only give for unit-length embeddings
+        if (prescreen is not None or controls is not None) and getattr(vector_store, "normalized", True) is False:
+            raise ValueError("Pre-screening and control coverage need normalized embeddings; "
+                             "rebuild the knowledge base")
+        # With a PreScreener only needs_review sections are sent to the LLM
+        self.prescreen = prescreen
+        # With a ControlIndex every section is scored against every CSF
+        # control and uncovered controls become gaps without an LLM call
+        self.controls = controls
+        self.coverage_threshold = coverage_threshold
+        self.coverage_scope = coverage_scope
     
-    def extract_policy_sections(self, policy_text: str) -> Dict[str, str]:
+    @staticmethod
+    def extract_policy_sections(policy_text: str) -> Dict[str, str]:
         """Extract sections from policy text"""
-        sections = {}
-        lines = policy_text.split('\n')
-        current_section = "Header"
-        current_content = []
-        
-        for line in lines:
-            line = line.strip()
-            if line and (line.startswith('##') or line.startswith('**')):
-                if current_content:
-                    sections[current_section] = ' '.join(current_content)
-                current_section = line.replace('#', '').replace('*', '').strip()
-                current_content = []
-            else:
-                current_content.append(line)
-        
-        if current_content:
-            sections[current_section] = ' '.join(current_content)
-        
-        return sections
+        with tracer.span("extract_policy_sections", chars=len(policy_text)) as span:
+            sections = {title: ' '.join(lines) for title, _, lines in split_policy_sections(policy_text)}
+            span.set("sections", len(sections))
+            return sections
     
     def find_relevant_standards(self, policy_section: str, top_k: int = 3) -> List[str]:
         """Find relevant CIS/NIST standards for a policy section"""
         results = self.vector_store.search(policy_section, k=top_k)
         return [result['chunk']['text'] for result in results]
     
-    def analyze_gaps(self, policy_text: str) -> Dict[str, Any]:
-        """Main gap analysis function"""
+    def build_section_prompt(self, section_name: str, section_content: str,
+                             relevant_standards: List[Dict], output_format: Dict) -> Dict[str, Any]:
+        """Pack the section text and standards into the context left after the preamble
         
-     
-        sections = self.extract_policy_sections(policy_text)
+        The section text is kept first, then standards in retrieval order;
+        the report lists anything truncated or dropped. A chunk's stored
+        token_count is used only when the knowledge base was counted with
+        the LLM handler's counter; otherwise the chunk is re-tokenized.
+        """
+        stored_counts = getattr(self.vector_store, "token_counter", None) == self.llm.token_counter.name
+        builder = self.llm.prompt_builder(output_format, preamble=SECTION_ANALYSIS_PREAMBLE)
+        builder.add("section", f"Policy Section Title: {section_name}\nPolicy Section Content: {section_content}\n",
+                    priority=1)
+        builder.add("standards_header", "Relevant Standards/Requirements:", priority=2, truncatable=False)
+        for rank, chunk in enumerate(relevant_standards):
+            builder.add(f"standard_{rank + 1}", chunk['text'], priority=3 + rank,
+                        token_count=chunk.get('token_count') if stored_counts else None)
+        return builder.build()
+    
+    def analyze_section(self, section_name: str, section_content: str,
+                        relevant_standards: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Analyze a single policy section"""
+        with tracer.span("analyze_section", section=section_name) as span:
+            if relevant_standards is None:
+                relevant_standards = [result['chunk'] for result in self.vector_store.search(section_content, k=3)]
         
-        all_gaps = []
+            packed = self.build_section_prompt(section_name, section_content, relevant_standards, SECTION_OUTPUT_FORMAT)
+            analysis = self.llm.generate_structured(packed['prompt'], SECTION_OUTPUT_FORMAT,
+                                                    preamble=SECTION_ANALYSIS_PREAMBLE, schema=SECTION_SCHEMA)
         
-        for section_name, section_content in sections.items():
-           
-            relevant_standards = self.find_relevant_standards(section_content)
-            
+            if isinstance(analysis, dict):
+                # The schema is shared by all sections, so the title is set here
+                analysis['section'] = section_name
+                if packed['truncated'] or packed['dropped']:
+                    analysis['prompt_packing'] = {
+                        "truncated": packed['truncated'],
+                        "dropped": packed['dropped']
+                    }
+            if packed['truncated'] or packed['dropped']:
+                tracer.count("prompts_truncated_total", stage="section_analysis")
+                span.set("prompt_truncated_parts", packed['truncated'])
+                span.set("prompt_dropped_parts", packed['dropped'])
+            span.set("gaps", len(analysis.get('gaps', [])) if isinstance(analysis, dict) else 0)
+            span.set("prompt_truncated", bool(packed['truncated'] or packed['dropped']))
+            return analysis
+    
+    def _safe_analyze_section(self, section_name: str, section_content: str,
+                              relevant_standards: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """Analyze a section, turning failures into an error entry"""
+        try:
+            return self.analyze_section(section_name, section_content, relevant_standards)
+        except Exception as e:
+            print(f"Section analysis failed for '{section_name}': {e}")
+            return {"section": section_name, "gaps": [], "error": str(e)[:200]}
+    
+    @staticmethod
+    def section_hash(section_name: str, section_content: str) -> str:
+        """Content hash identifying a section across runs"""
+        return hashlib.sha256(f"{section_name}\n{section_content}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _previous_sections(previous_result: Optional[Dict]) -> Dict[str, Dict]:
+        """Map section hashes to reusable analyses from a previous run"""
+        if not previous_result:
+            return {}
+        manifest = previous_result.get('manifest', [])
+        analyses = previous_result.get('policy_analysis', [])
+        reusable = {}
+        for entry, analysis in zip(manifest, analyses):
+            if isinstance(analysis, dict) and 'error' not in analysis:
+                reusable[entry['hash']] = analysis
+        return reusable
+    
+    def _plan(self, policy_text: str, previous_result: Optional[Dict]) -> Dict[str, Any]:
+        """Split a policy into sections and work out which need analysis"""
+        sections = self.extract_policy_sections(policy_text)
+        manifest = [{"section": name, "hash": self.section_hash(name, content)} for name, content in sections.items()]
+        reusable = self._previous_sections(previous_result)
         
-            prompt = f"""Analyze the following policy section against cybersecurity standards:
-
-Policy Section Title: {section_name}
-Policy Section Content: {section_content}
-
-Relevant Standards/Requirements:
-{chr(10).join(relevant_standards)}
-
-Identify specific gaps where the policy is missing or insufficient compared to best practices.
-For each gap, specify:
-1. Gap Description
-2. Severity (High/Medium/Low)
-3. Relevant NIST CSF Function
-4. Recommended improvement
-
-Provide the analysis in structured format."""
+        all_gaps: List[Optional[Dict]] = [reusable.get(entry['hash']) for entry in manifest]
+        pending = [(i, name, content) for i, (name, content) in enumerate(sections.items()) if all_gaps[i] is None]
+        return {"manifest": manifest, "policy_analysis": all_gaps, "pending": pending, "sections": sections}
+    
+    def _run_sections(self, tasks: List[tuple], workers: int) -> List[Dict[str, Any]]:
+        """Analyze (name, content, standards) tasks, concurrently if workers > 1"""
+        if workers > 1 and len(tasks) > 1:
+            parent = tracer.current()
             
+            def run(task):
+                with tracer.attach(parent):
+                    return self._safe_analyze_section(*task)
             
-            output_format = {
-                "section": section_name,
-                "gaps": [
-                    {
-                        "gap_description": "Description of the gap",
-                        "severity": "High/Medium/Low",
-                        "nist_function": "Identify/Protect/Detect/Respond/Recover",
-                        "recommendation": "Specific recommendation to address gap"
-                    }
-                ]
+            with ThreadPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                return list(executor.map(run, tasks))
+        return [self._safe_analyze_section(*task) for task in tasks]
+    
+    def control_coverage(self, sections: Dict[str, str]) -> Dict[str, Any]:
+        """Section x control coverage matrix and the controls left uncovered
+        
+        Sections are embedded with the query cache (sections searched during
+        analysis are already there) and scored against the chunks of every
+        control in one matrix product. Returns the sparse matrix, the
+        covered controls per section, and the uncovered controls.
+        """
+        names = [name for name, content in sections.items() if content.strip()]
+        with tracer.span("control_coverage", sections=len(names), controls=len(self.controls)) as span:
+            embeddings = self.vector_store.encode_queries([sections[name] for name in names]) if names else []
+            matrix = self.controls.coverage(embeddings, self.vector_store.embeddings, self.coverage_threshold)
+            by_section: Dict[str, List[str]] = {name: [] for name in names}
+            for row, column, _ in sorted(matrix['entries'], key=lambda entry: -entry[2]):
+                by_section[names[row]].append(matrix['controls'][column])
+            uncovered = self.controls.uncovered(matrix, self.coverage_scope)
+            span.set("covered", len({column for _, column, _ in matrix['entries']}))
+            span.set("uncovered", len(uncovered))
+        return {"sections": names, **matrix, "by_section": by_section, "uncovered": uncovered}
+    
+    def _assemble(self, plan: Dict[str, Any], analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge fresh analyses into a plan and build the result"""
+        all_gaps = plan['policy_analysis']
+        for (i, _, _), analysis in zip(plan['pending'], analyses):
+            all_gaps[i] = analysis
+        
+        coverage = None
+        if self.controls is not None and self.vector_store.embeddings is not None:
+            coverage = self.control_coverage(plan['sections'])
+            for analysis in all_gaps:
+                if isinstance(analysis, dict):
+                    analysis['controls'] = coverage['by_section'].get(analysis.get('section'), [])
+            if coverage['uncovered']:
+                # After the section entries, so they stay aligned with the manifest
+                all_gaps.append({"section": COVERAGE_SECTION,
+                                 "gaps": [self.controls.gap(control) for control in coverage['uncovered']]})
+        
+        result = {
+            "policy_analysis": all_gaps,
+            "summary": self.summarize(all_gaps),
+            "manifest": plan['manifest'],
+            "incremental": {
+                "reused_sections": len(plan['manifest']) - len(plan['pending']),
+                "analyzed_sections": len(plan['pending'])
             }
+        }
+        if self.prescreen is not None:
+            # Verdicts for this run only; reused sections are in "incremental"
+            result["prescreen"] = PreScreener.counts(analyses)
+        if coverage is not None:
+            result["coverage"] = coverage
+        return result
+    
+    def analyze_gaps(self, policy_text: str, max_workers: Optional[int] = None,
+                     previous_result: Optional[Dict] = None) -> Dict[str, Any]:
+        """Main gap analysis function
+        
+        Sections are analyzed concurrently when max_workers > 1. Results keep
+        section order and a failing section does not abort the others.
+        When previous_result is given, sections whose content hash is unchanged
+        reuse the earlier analysis and only added or edited sections are sent
+        to the LLM. Standards for all pending sections are retrieved with one
+        batched search.
+        """
+        return self.analyze_batch({"policy": policy_text}, max_workers,
+                                  {"policy": previous_result} if previous_result else None)["policy"]
+    
+    def analyze_batch(self, policies: Dict[str, str], max_workers: Optional[int] = None,
+                      previous_results: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict[str, Any]]:
+        """Analyze several policies with one batched retrieval over all sections
+        
+        Every pending section from every policy is embedded and searched in a
+        single VectorStore.search_batch call, then the LLM work is shared by
+        one worker pool and the results are fanned back out per policy.
+        With self.prescreen, trivial sections skip retrieval and covered
+        ones skip the LLM; both are recorded with a "prescreen" verdict.
+        """
+        previous_results = previous_results or {}
+        with tracer.span("analyze_batch", policies=len(policies)) as span:
+            plans = {name: self._plan(text, previous_results.get(name)) for name, text in policies.items()}
+            
+            pending = [(section_name, content) for plan in plans.values() for _, section_name, content in plan['pending']]
+            span.set("sections", sum(len(plan['manifest']) for plan in plans.values()))
+            span.set("pending_sections", len(pending))
             
+            verdicts: List[Optional[Dict]] = [None] * len(pending)
+            if self.prescreen is not None:
+                verdicts = [self.prescreen.screen_text(name, content) for name, content in pending]
+            searched = [i for i, verdict in enumerate(verdicts) if verdict is None]
+            hits = self.vector_store.search_batch([pending[i][1] for i in searched], k=3) if searched else []
             
-            analysis = self.llm.generate_structured(prompt, output_format)
-            all_gaps.append(analysis)
+            analyses: List[Optional[Dict]] = [None] * len(pending)
+            tasks = []
+            task_positions = []
+            for i, section_hits in zip(searched, hits):
+                if self.prescreen is not None:
+                    verdicts[i] = self.prescreen.screen_hits(section_hits)
+                    if verdicts[i]['status'] == "covered":
+                        continue
+                tasks.append((pending[i][0], pending[i][1], [hit['chunk'] for hit in section_hits]))
+                task_positions.append(i)
+            
+            for i, analysis in zip(task_positions, self._run_sections(tasks, max_workers or self.max_workers)):
+                analyses[i] = analysis
+            if self.prescreen is not None:
+                for i, verdict in enumerate(verdicts):
+                    if analyses[i] is None:
+                        analyses[i] = PreScreener.analysis(pending[i][0], verdict)
+                    elif isinstance(analyses[i], dict):
+                        analyses[i]['prescreen'] = verdict
+                counts = PreScreener.counts(analyses)
+                for status, count in counts.items():
+                    span.set(status, count)
+                    tracer.count("prescreen_sections_total", count, status=status)
+            span.set("llm_sections", len(tasks))
         
+        results = {}
+        offset = 0
+        for name, plan in plans.items():
+            count = len(plan['pending'])
+            results[name] = self._assemble(plan, analyses[offset:offset + count])
+            offset += count
+        return results
+    
+    @staticmethod
+    def summarize(all_gaps: List[Dict]) -> Dict[str, int]:
+        """Compute summary counts for a list of section analyses
+        
+        Control coverage gaps come from a similarity threshold rather than
+        the LLM, so they are counted separately from the totals.
+        """
+        analyzed = [item for item in all_gaps if item.get('section') != COVERAGE_SECTION]
         return {
-            "policy_analysis": all_gaps,
-            "summary": {
-                "total_gaps": sum(len(item.get('gaps', [])) for item in all_gaps),
-                "high_priority_gaps": sum(1 for item in all_gaps for gap in item.get('gaps', []) if gap.get('severity') == 'High')
-            }
-        }
\ No newline at end of file
+            "total_gaps": sum(len(item.get('gaps', [])) for item in analyzed),
+            "high_priority_gaps": sum(1 for item in analyzed for gap in item.get('gaps', []) if gap.get('severity') == 'High'),
+            "coverage_gaps": sum(len(item.get('gaps', [])) for item in all_gaps if item.get('section') == COVERAGE_SECTION)
+        }
@@ -0,0 +1,32 @@
+from typing import Any, Dict, List, Optional
+
+def schema_from_example(example: Any, enums: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    """Build a JSON schema from an example output_format dict
+
+    Strings, numbers and booleans become their JSON types, lists take the
+    schema of their first item and dicts require every key. enums maps a
+    property name to its allowed string values wherever it appears.
+    """
+    enums = enums or {}
+    if isinstance(example, dict):
+        properties = {}
+        for key, value in example.items():
+            if key in enums:
+                properties[key] = {"type": "string", "enum": list(enums[key])}
+            else:
+                properties[key] = schema_from_example(value, enums)
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": list(example.keys()),
+            "additionalProperties": False
+        }
+    if isinstance(example, list):
+        return {"type": "array", "items": schema_from_example(example[0], enums) if example else {}}
+    if isinstance(example, bool):
+        return {"type": "boolean"}
+    if isinstance(example, int):
+        return {"type": "integer"}
+    if isinstance(example, float):
+        return {"type": "number"}
+    return {"type": "string"}
@@ -0,0 +1,180 @@
+import os
+import json
+import subprocess
+import threading
+from typing import Dict, Any, Iterator, Optional
+from ollama_client import OllamaClient, DEFAULT_HOST
+from resilience import LLMTimeoutError, BackendUnavailableError
+
+BACKENDS = ("http", "subprocess", "llama_cpp")
+
+class LLMBackend:
+    """Text generation backend used by LocalLLMHandler
+
+    options carries Ollama-style keys: num_predict, temperature, num_ctx.
+    json_schema, when given, asks the backend to constrain decoding so the
+    output is valid JSON matching the schema; supports_schema says whether
+    it can honour that fully.
+    """
+    name = "base"
+    supports_streaming = False
+    supports_schema = False
+
+    @property
+    def key(self) -> str:
+        """Identifies the endpoint or model file
+
+        Handlers sharing a key share one concurrency limit, and cached
+        responses are kept per key.
+        """
+        return self.name
+
+    def generate(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> Iterator[str]:
+        """Yield text chunks; closing the iterator should stop generation"""
+        yield self.generate(prompt, options, json_schema)
+
+    def close(self):
+        pass
+
+class OllamaHTTPBackend(LLMBackend):
+    """Ollama API over pooled keep-alive HTTP connections"""
+    name = "http"
+    supports_streaming = True
+    supports_schema = True
+
+    def __init__(self, model_name: str, host: str = DEFAULT_HOST, client: Optional[OllamaClient] = None):
+        self.model_name = model_name
+        self.client = client or OllamaClient(host)
+
+    @property
+    def key(self) -> str:
+        return f"http://{self.client.host}:{self.client.port}"
+
+    def generate(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> str:
+        return self.client.generate(self.model_name, prompt, options=options, format=json_schema).get('response', '')
+
+    def stream(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> Iterator[str]:
+        chunks = self.client.generate_stream(self.model_name, prompt, options=options, format=json_schema)
+        try:
+            for chunk in chunks:
+                yield chunk.get('response', '')
+        finally:
+            chunks.close()
+
+    def close(self):
+        self.client.close()
+
+class OllamaSubprocessBackend(LLMBackend):
+    """`ollama run` per prompt; options are ignored and a schema only forces JSON mode"""
+    name = "subprocess"
+
+    def __init__(self, model_name: str, timeout: int = 300):
+        self.model_name = model_name
+        self.timeout = timeout
+
+    def generate(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> str:
+        command = ["ollama", "run", self.model_name]
+        if json_schema is not None:
+            command += ["--format", "json"]
+        try:
+            result = subprocess.run(
+                command + [prompt],
+                capture_output=True,
+                text=True,
+                timeout=self.timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise LLMTimeoutError(f"Generation timed out after {self.timeout} seconds")
+
+        if result.returncode != 0:
+            raise BackendUnavailableError(f"ollama run exited with {result.returncode}: {result.stderr[:200]}")
+        return result.stdout
+
+class LlamaCppBackend(LLMBackend):
+    """In-process llama.cpp model loaded once from a GGUF file
+
+    llama.cpp keeps the KV cache of the previous call and only evaluates
+    the tokens after the longest shared prefix, and the RAM cache keeps
+    states for other prefixes, so prompts that start with the same
+    instructions and JSON schema skip re-processing that preamble.
+    Calls are serialized because a llama.cpp context is not thread-safe.
+    """
+    name = "llama_cpp"
+    supports_streaming = True
+    supports_schema = True
+
+    def __init__(self, model_path: str, n_ctx: int = 4096, n_threads: Optional[int] = None,
+                 n_gpu_layers: int = 0, cache_bytes: int = 2 << 30):
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError as e:
+            raise ImportError("The llama_cpp backend needs llama-cpp-python (pip install llama-cpp-python)") from e
+
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"GGUF model not found: {model_path}")
+
+        self.model_path = model_path
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            verbose=False
+        )
+        if cache_bytes:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=cache_bytes))
+        self._lock = threading.Lock()
+        self._grammars: Dict[str, Any] = {}
+
+    @property
+    def key(self) -> str:
+        return f"llama_cpp:{self.model_path}"
+
+    def _grammar(self, json_schema: Dict):
+        """GBNF grammar for a schema, compiled once per distinct schema"""
+        from llama_cpp import LlamaGrammar
+        key = json.dumps(json_schema, sort_keys=True)
+        if key not in self._grammars:
+            self._grammars[key] = LlamaGrammar.from_json_schema(key, verbose=False)
+        return self._grammars[key]
+
+    def _completion_args(self, options: Dict[str, Any], json_schema: Optional[Dict]) -> Dict[str, Any]:
+        args = {
+            "max_tokens": options.get('num_predict', 500),
+            "temperature": options.get('temperature', 0.1)
+        }
+        if json_schema is not None:
+            args["grammar"] = self._grammar(json_schema)
+        return args
+
+    def generate(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> str:
+        with self._lock:
+            result = self.llm.create_completion(prompt, **self._completion_args(options, json_schema))
+        return result['choices'][0]['text']
+
+    def stream(self, prompt: str, options: Dict[str, Any], json_schema: Optional[Dict] = None) -> Iterator[str]:
+        with self._lock:
+            chunks = self.llm.create_completion(prompt, stream=True, **self._completion_args(options, json_schema))
+            try:
+                for chunk in chunks:
+                    yield chunk['choices'][0]['text']
+            finally:
+                chunks.close()
+
+def create_backend(backend: str, model_name: str, host: str = DEFAULT_HOST,
+                   model_path: Optional[str] = None, n_ctx: int = 4096,
+                   n_threads: Optional[int] = None) -> LLMBackend:
+    """Build a backend by name: http, subprocess or llama_cpp"""
+    if backend == "http":
+        return OllamaHTTPBackend(model_name, host)
+    if backend == "subprocess":
+        return OllamaSubprocessBackend(model_name)
+    if backend == "llama_cpp":
+        if not model_path:
+            raise ValueError("The llama_cpp backend needs model_path pointing to a GGUF file")
+        return LlamaCppBackend(model_path, n_ctx=n_ctx, n_threads=n_threads)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
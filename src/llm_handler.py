@@ -1,14 +1,92 @@
-import subprocess
 import json
 import re
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Tuple
 import os
 import time
+from llm_cache import LLMResponseCache
+from tokenization import TokenCounter
+from prompt_builder import PromptBuilder
+from ollama_client import DEFAULT_HOST
+from llm_backends import LLMBackend, create_backend
+from json_schema import schema_from_example
+from tracing import tracer
+from resilience import LLMError, EmptyResponseError, ParseError, PromptTooLongError, RetryPolicy, guard_for
+
+# Share of the context window held back when token counts are estimated:
+# BPE tokenizers usually produce more tokens than the estimate
+ESTIMATE_MARGIN = 0.2
+
+class JSONObjectTracker:
+    """Incrementally scan streamed text for the end of the top-level JSON object"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.position = 0
+    
+    def feed(self, chunk: str) -> int:
+        """Consume a chunk; return the offset just past the closing brace, or -1"""
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.started:
+                self.in_string = True
+            elif char == '{':
+                self.started = True
+                self.depth += 1
+            elif char == '}' and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.position += i + 1
+                    return self.position
+        self.position += len(chunk)
+        return -1
 
 class LocalLLMHandler:
-    def __init__(self, model_name: str = "llama3.2:3b"):
+    def __init__(self, model_name: str = "llama3.2:3b", cache: Optional[LLMResponseCache] = None, use_cache: bool = True,
+                 backend: Any = "http", host: str = DEFAULT_HOST, model_path: Optional[str] = None,
+                 n_threads: Optional[int] = None, context_window: int = 4096, max_concurrent: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None, tokenizer: Optional[str] = None,
+                 context_margin: Optional[int] = None):
         self.model_name = model_name
+        # "http" talks to the Ollama API over pooled keep-alive connections,
+        # "subprocess" runs `ollama run` per prompt, "llama_cpp" loads the GGUF
+        # at model_path in-process; an LLMBackend instance is used as is
+        if isinstance(backend, LLMBackend):
+            self.backend = backend
+        else:
+            self.backend = create_backend(backend, model_name, host=host, model_path=model_path,
+                                          n_ctx=context_window, n_threads=n_threads)
         self.temperature = 0.1  
+        # Set bypass_cache to force fresh generations (results are still stored)
+        self.cache = cache if cache is not None else (LLMResponseCache() if use_cache else None)
+        self.bypass_cache = False
+        # Structured generations stream and stop once the JSON object closes
+        self.stream = True
+        # Structured generations pass a JSON schema to the backend so decoding
+        # can only produce valid JSON of the requested shape
+        self.constrained_decoding = True
+        self.on_token: Optional[Callable[[str], None]] = None
+        # Prompt plus completion must fit in the model context (Ollama num_ctx).
+        # Budgets are counted with the model's tokenizer when one is named
+        # (a Hugging Face name, loaded from the local cache); otherwise they
+        # are estimates and context_margin tokens are held back
+        self.context_window = context_window
+        self.token_counter = TokenCounter.from_pretrained(tokenizer) if tokenizer else TokenCounter()
+        if context_margin is None:
+            context_margin = int(context_window * ESTIMATE_MARGIN) if self.token_counter.estimated else 0
+        self.context_margin = context_margin
+        # Handlers on the same endpoint share one concurrency limit and circuit
+        # breaker, so a batch run queues for the backend instead of piling on
+        self.guard = guard_for(self.backend.key, max_concurrent)
+        self.retry_policy = retry_policy or RetryPolicy()
         
     def _clean_output(self, text: str) -> str:
         """Clean LLM output"""
@@ -18,102 +96,270 @@ class LocalLLMHandler:
         text = text.strip()
         return text
     
-    def generate_direct(self, prompt: str, max_tokens: int = 500) -> str:
-        """Generate response using Ollama directly"""
-        try:
-            import ollama
-            response = ollama.generate(
-                model=self.model_name,
-                prompt=prompt[:800],  
-                options={
-                    'num_predict': max_tokens,
-                    'temperature': self.temperature
-                }
-            )
-            return self._clean_output(response['response'])
-        except Exception as e:
-            print(f"Direct generation error: {e}")
-            
-            return self._generate_subprocess(prompt, max_tokens)
+    @staticmethod
+    def _is_usable(response: str) -> bool:
+        """Check whether a response has any content"""
+        return bool(response) and bool(response.strip())
     
-    def _generate_subprocess(self, prompt: str, max_tokens: int = 500) -> str:
-        """Fallback: Generate using subprocess"""
-        try:
-            
-            request = {
-                "model": self.model_name,
-                "prompt": prompt[:500], 
-                "stream": False,
-                "options": {
-                    "temperature": self.temperature,
-                    "num_predict": max_tokens
-                }
-            }
+    def _cached(self, prompt: str, options: Dict[str, Any], produce: Callable[[], str],
+                validate: Optional[Callable[[str], Any]] = None) -> str:
+        """Serve a generation from the cache, or produce and store it
+        
+        validate raises ParseError for output the caller cannot use; such
+        output is never stored, and a cached entry failing it counts as a
+        miss. An empty generation raises EmptyResponseError. The call is
+        traced as an llm.generate span with whether it was a cache hit and,
+        when tracing is enabled, token counts.
+        """
+        with tracer.span("llm.generate", backend=self.backend.name, stream=bool(options.get('stream')),
+                         schema='json_schema' in options) as span:
+            response = None
+            key = None
+            if self.cache is not None:
+                key = self.cache.make_key(self.model_name, prompt, options, backend=self.backend.key)
+                if not self.bypass_cache:
+                    response = self.cache.get(key)
+                if response is not None and validate is not None:
+                    try:
+                        validate(response)
+                    except ParseError:
+                        response = None
             
-           
-            result = subprocess.run(
-                ["ollama", "run", self.model_name, prompt[:500]],
-                capture_output=True,
-                text=True,
-                timeout=300  
-            )
+            span.set("cache_hit", response is not None)
+            tracer.count("llm_cache_hits_total" if response is not None else "llm_cache_misses_total")
+            if response is None:
+                response = produce()
+                if not self._is_usable(response):
+                    raise EmptyResponseError("Backend returned an empty response")
+                if validate is not None:
+                    validate(response)
+                if key is not None:
+                    self.cache.put(key, self.model_name, response)
             
-            if result.returncode == 0:
-                return self._clean_output(result.stdout)
-            else:
-                print(f"Error running Ollama: {result.stderr}")
-                return ""
-                
-        except subprocess.TimeoutExpired:
-            print(" Generation timed out after 300 seconds")
-            return "Generation timed out"
-        except Exception as e:
-            print(f"Error in LLM generation: {e}")
-            return ""
+            if tracer.enabled:
+                prompt_tokens = self.token_counter.count(prompt)
+                output_tokens = self.token_counter.count(response)
+                span.set("prompt_tokens", prompt_tokens)
+                span.set("output_tokens", output_tokens)
+                tracer.count("llm_prompt_tokens_total", prompt_tokens)
+                tracer.count("llm_output_tokens_total", output_tokens)
+            return response
+    
+    def _options(self, max_tokens: int) -> Dict[str, Any]:
+        return {
+            'num_predict': max_tokens,
+            'temperature': self.temperature,
+            'num_ctx': self.context_window
+        }
+    
+    def _check_prompt(self, prompt: str, max_tokens: int):
+        """Raise PromptTooLongError for a prompt that cannot fit the context window
+
+        Cutting the prompt here would lose whatever sits at its end, such as
+        the JSON format instructions, so it is refused instead; build
+        prompts with prompt_builder() to decide what is cut.
+        """
+        budget = self.context_window - self.context_margin - max_tokens
+        tokens = self.token_counter.count(prompt)
+        if tokens <= budget:
+            return
+        tracer.count("prompts_too_long_total")
+        span = tracer.current()
+        if span is not None:
+            span.set("prompt_tokens_over_budget", tokens - budget)
+        raise PromptTooLongError(f"Prompt of {tokens} tokens exceeds the {budget} left for it in the context window")
+    
+    def prompt_builder(self, output_format: Optional[Dict] = None, max_tokens: int = 800,
+                       preamble: str = "") -> PromptBuilder:
+        """PromptBuilder sized for this model, leaving room for the completion, preamble and JSON schema"""
+        reserve = self.context_margin + max_tokens + self.token_counter.count(preamble)
+        if output_format is not None:
+            reserve += self.token_counter.count(self.format_instructions(output_format))
+        return PromptBuilder(self.context_window, reserve, self.token_counter)
+    
+    @staticmethod
+    def _cache_options(options: Dict[str, Any], json_schema: Optional[Dict]) -> Dict[str, Any]:
+        """Options used in the cache key; a schema changes what the model may emit"""
+        if json_schema is None:
+            return options
+        return dict(options, json_schema=json_schema)
+    
+    def generate_direct(self, prompt: str, max_tokens: int = 500, json_schema: Optional[Dict] = None,
+                        validate: Optional[Callable[[str], Any]] = None) -> str:
+        """Generate response, serving repeated requests from the cache
+        
+        Raises an LLMError subclass when generation fails.
+        """
+        options = self._cache_options(self._options(max_tokens), json_schema)
+        return self._cached(prompt, options, lambda: self._generate_backend(prompt, max_tokens, json_schema),
+                            validate)
+    
+    def generate_stream(self, prompt: str, max_tokens: int = 500,
+                        on_token: Optional[Callable[[str], None]] = None,
+                        stop_at_json_end: bool = False, json_schema: Optional[Dict] = None,
+                        validate: Optional[Callable[[str], Any]] = None) -> str:
+        """Generate with a streaming response
+        
+        on_token is called with each streamed chunk. With stop_at_json_end the
+        stream is closed as soon as the top-level JSON object is complete.
+        Raises an LLMError subclass when generation fails.
+        """
+        options = dict(self._options(max_tokens), stream=True, stop_at_json_end=stop_at_json_end)
+        return self._cached(prompt, self._cache_options(options, json_schema),
+                            lambda: self._stream_backend(prompt, max_tokens, on_token, stop_at_json_end, json_schema),
+                            validate)
+    
+    def _stream_backend(self, prompt: str, max_tokens: int, on_token: Optional[Callable[[str], None]],
+                        stop_at_json_end: bool, json_schema: Optional[Dict] = None) -> str:
+        """Stream tokens from the backend, optionally stopping after the JSON object"""
+        self._check_prompt(prompt, max_tokens)
+        tracker = JSONObjectTracker()
+        parts = []
+        stream = None
+        with self.guard.call():
+            try:
+                stream = self.backend.stream(prompt, self._options(max_tokens), json_schema)
+                for token in stream:
+                    parts.append(token)
+                    if on_token:
+                        on_token(token)
+                    if stop_at_json_end:
+                        end = tracker.feed(token)
+                        if end >= 0:
+                            return self._clean_output(''.join(parts)[:end])
+            finally:
+                # Closing the stream stops generation on the backend
+                if stream is not None:
+                    stream.close()
+        return self._clean_output(''.join(parts))
+    
+    def _generate_backend(self, prompt: str, max_tokens: int = 500, json_schema: Optional[Dict] = None) -> str:
+        """Generate response with the configured backend"""
+        self._check_prompt(prompt, max_tokens)
+        with self.guard.call():
+            response = self.backend.generate(prompt, self._options(max_tokens), json_schema)
+        return self._clean_output(response)
     
     def generate(self, prompt: str, max_tokens: int = 500) -> str:
         """Main generation method"""
         return self.generate_direct(prompt, max_tokens)
     
-    def generate_with_retry(self, prompt: str, max_tokens: int = 500, retries: int = 2) -> str:
-        """Generate with retry logic"""
-        for attempt in range(retries):
-            try:
-                response = self.generate(prompt, max_tokens)
-                if response and len(response) > 10 and not response.startswith("Error"):
-                    return response
-                elif attempt < retries - 1:
-                    print(f"Empty response, retry {attempt + 1}...")
-                    time.sleep(2)
-            except Exception as e:
-                if attempt < retries - 1:
-                    print(f" Attempt {attempt + 1} failed, retrying... ({e})")
-                    time.sleep(3)
-                else:
-                    print(f"All retries failed: {e}")
-                    return f"Error: {str(e)[:100]}"
-        return ""
-    
-    def generate_structured(self, prompt: str, output_format: Dict) -> Dict:
-        """Generate structured output"""
-        structured_prompt = f"""{prompt}
+    def generate_with_retry(self, prompt: str, max_tokens: int = 500, retries: Optional[int] = None,
+                            stream: bool = False, on_token: Optional[Callable[[str], None]] = None,
+                            json_schema: Optional[Dict] = None) -> str:
+        """Generate with retry logic; returns "Error: ..." when every attempt fails
+        
+        The failure is recorded on the llm.generate_with_retry span and in
+        llm_generation_failures_total.
+        """
+        try:
+            return self._generate_retrying(prompt, max_tokens, retries, stream, on_token, json_schema)
+        except LLMError as e:
+            tracer.count("llm_generation_failures_total", kind=e.kind)
+            return f"Error: {str(e)[:100]}"
+    
+    def _generate_retrying(self, prompt: str, max_tokens: int, retries: Optional[int], stream: bool,
+                           on_token: Optional[Callable[[str], None]], json_schema: Optional[Dict],
+                           validate: Optional[Callable[[str], Any]] = None) -> str:
+        """Generate, retrying retryable failures; raises the last LLMError
+        
+        Timeouts and backend failures back off exponentially with jitter
+        (self.retry_policy). Empty or unparseable output is retried at once,
+        since waiting does not change what the model says. An open circuit
+        or a rejected request fails immediately.
+        """
+        attempts = retries or self.retry_policy.max_attempts
+        with tracer.span("llm.generate_with_retry") as span:
+            for attempt in range(attempts):
+                span.set("retries", attempt)
+                try:
+                    if stream:
+                        return self.generate_stream(prompt, max_tokens, on_token, stop_at_json_end=True,
+                                                    json_schema=json_schema, validate=validate)
+                    return self.generate_direct(prompt, max_tokens, json_schema, validate)
+                except LLMError as e:
+                    tracer.count("llm_errors_total", kind=e.kind)
+                    span.set("error_type", e.kind)
+                    if not e.retryable or attempt == attempts - 1:
+                        span.set("failed", True)
+                        raise
+                    delay = 0.0 if isinstance(e, (EmptyResponseError, ParseError)) else self.retry_policy.delay(attempt)
+                    span.set("backoff_seconds", round(span.attributes.get("backoff_seconds", 0.0) + delay, 3))
+                    tracer.count("llm_retries_total", kind=e.kind)
+                    time.sleep(delay)
+    
+    @staticmethod
+    def format_instructions(output_format: Dict) -> str:
+        """JSON format instructions appended to structured prompts"""
+        return f"""
 
 Please respond in the following JSON format:
 {json.dumps(output_format, indent=2)}
 
 Ensure your response is valid JSON."""
+    
+    @staticmethod
+    def _parse_json(response: str) -> Tuple[Any, str]:
+        """Parse a JSON response, recovering an object embedded in other text
         
-        response = self.generate_with_retry(structured_prompt, max_tokens=800)
-        
+        Returns the value and how it was found ("json" or "extracted");
+        raises ParseError when there is no usable JSON.
+        """
         try:
-            
-            return json.loads(response)
+            return json.loads(response), "json"
         except json.JSONDecodeError:
+            pass
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if not json_match:
+            raise ParseError("No JSON found", response)
+        try:
+            return json.loads(json_match.group()), "extracted"
+        except json.JSONDecodeError:
+            raise ParseError("Could not parse JSON", response)
+    
+    def generate_structured(self, prompt: str, output_format: Dict,
+                            on_token: Optional[Callable[[str], None]] = None, max_tokens: int = 800,
+                            preamble: str = "", schema: Optional[Dict] = None) -> Dict:
+        """Generate structured output
+        
+        When self.stream is set, generation stops as soon as the JSON object
+        closes and on_token (or self.on_token) receives each streamed chunk.
+        A preamble is placed before the JSON format and the prompt, so calls
+        sharing instructions and schema share a prompt prefix that backends
+        can keep in their KV cache.
+        
+        With constrained_decoding the backend is given schema (derived from
+        output_format when not supplied) as an Ollama format schema or a
+        llama.cpp grammar; _parse_json still recovers JSON embedded in text
+        for backends that cannot enforce it, and output that cannot be
+        parsed is regenerated. Failures return {"error", "error_type",
+        "raw_response"}.
+        """
+        if preamble:
+            structured_prompt = preamble + self.format_instructions(output_format) + "\n\n" + prompt
+        else:
+            structured_prompt = prompt + self.format_instructions(output_format)
+        
+        json_schema = None
+        if self.constrained_decoding:
+            json_schema = schema if schema is not None else schema_from_example(output_format)
+        
+        with tracer.span("llm.generate_structured", constrained=json_schema is not None) as span:
+            parsed = {}
             
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except:
-                    return {"error": "Could not parse JSON", "raw_response": response}
-            return {"error": "No JSON found", "raw_response": response}
\ No newline at end of file
+            def validate(response: str):
+                parsed["result"], parsed["parse"] = self._parse_json(response)
+            
+            try:
+                self._generate_retrying(structured_prompt, max_tokens, None, self.stream,
+                                        on_token or self.on_token, json_schema, validate)
+            except ParseError as e:
+                span.set("parse", "failed")
+                tracer.count("llm_parse_failures_total")
+                return {"error": str(e), "error_type": e.kind, "raw_response": e.response}
+            except LLMError as e:
+                span.set("parse", "skipped")
+                return {"error": str(e), "error_type": e.kind, "raw_response": ""}
+            
+            span.set("parse", parsed["parse"])
+            return parsed["result"]
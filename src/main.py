@@ -1,50 +1,300 @@
 
 import os
-import sys
+import re
 import json
+import argparse
 import subprocess
 import time
+import hashlib
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, Any, List, Optional
 
-def run_ollama(prompt, model="llama3.2:3b", timeout=90):
-    """Run Ollama via CLI with better error handling"""
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODELS_DIR = BASE_DIR / "models"
+KB_DIR = MODELS_DIR / "knowledge_base"
+OUTPUT_DIR = BASE_DIR / "outputs"
+TEST_POLICIES_DIR = BASE_DIR / "test_policies"
+
+_ollama_client = None
+
+def run_ollama(prompt, model="llama3.2:3b", timeout=90, backend="http"):
+    """Run a prompt through the Ollama HTTP API (pooled connections) or CLI"""
+    global _ollama_client
     try:
       
-        clean_prompt = prompt[:250].strip()
+        clean_prompt = prompt.strip()
         
         print(f"    Prompt: {clean_prompt[:50]}...")
         
-        result = subprocess.run(
-            ["ollama", "run", model, clean_prompt],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        
-        if result.returncode == 0:
-            output = result.stdout.strip()
-            
-            import re
-            output = re.sub(r'\s+', ' ', output) 
-            return output[:500]  
+        if backend == "http":
+            from ollama_client import OllamaClient
+            if _ollama_client is None:
+                _ollama_client = OllamaClient(timeout=timeout)
+            output = _ollama_client.generate(model, clean_prompt).get('response', '').strip()
         else:
-            error_msg = result.stderr[:100] if result.stderr else "Unknown error"
-            return f"Error: {error_msg}"
+            result = subprocess.run(
+                ["ollama", "run", model, clean_prompt],
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+            if result.returncode != 0:
+                error_msg = result.stderr[:100] if result.stderr else "Unknown error"
+                return f"Error: {error_msg}"
+            output = result.stdout.strip()
+        
+        output = re.sub(r'\s+', ' ', output) 
+        return output[:500]  
             
     except subprocess.TimeoutExpired:
         return "Timeout: Model took too long to respond"
+    except TimeoutError:
+        return "Timeout: Model took too long to respond"
     except Exception as e:
         return f"Exception: {str(e)[:100]}"
 
-def main():
-    print(" Simple PolicyGapFixer (CLI Version)")
+def build_simple_prompt(instruction: str, policy: str, context_window: int = 2048,
+                        reserve_tokens: int = 512) -> str:
+    """Fit the instruction and as much of the policy as the context allows"""
+    from prompt_builder import PromptBuilder
     
-    if len(sys.argv) < 2:
-        print("Usage: python simple_main.py <policy_file>")
-        return
+    packed = (PromptBuilder(context_window, reserve_tokens)
+              .add("instruction", instruction, truncatable=False)
+              .add("policy", policy, priority=1)
+              .build(separator=" "))
+    if packed['truncated'] or packed['dropped']:
+        print(f"    Policy does not fit in {packed['budget']} tokens: "
+              f"truncated {packed['truncated']}, dropped {packed['dropped']}")
+    return packed['prompt']
+
+class PolicyGapFixer:
+    """Full pipeline: gap analysis, policy revision and roadmap"""
+    
+    def __init__(self, model_name: str = "llama3.2:3b", output_dir: Path = OUTPUT_DIR,
+                 max_workers: int = 1, incremental: bool = True, backend: str = "http",
+                 model_path: Optional[str] = None, n_threads: Optional[int] = None,
+                 resume: bool = True, revision_mode: str = "auto",
+                 polish_roadmap: bool = False, max_concurrent: int = 4,
+                 prescreen: bool = False, covered_similarity: float = 0.85,
+                 coverage: bool = False, coverage_threshold: Optional[float] = None,
+                 coverage_scope: str = "categories", tokenizer: Optional[str] = None):
+        from embedding_system import VectorStore
+        from llm_handler import LocalLLMHandler
+        from gap_analyzer import GapAnalyzer
+        from policy_reviser import PolicyReviser
+        from prescreen import PreScreener
+        from csf import ControlIndex, DEFAULT_COVERAGE_THRESHOLD
+        
+        self.output_dir = Path(output_dir)
+        self.incremental = incremental
+        # Stage results of an unfinished run are kept here and picked up again
+        self.resume = resume
+        self.checkpoint_dir = self.output_dir / ".checkpoints"
+        self.llm = LocalLLMHandler(model_name, backend=backend, model_path=model_path, n_threads=n_threads,
+                                   max_concurrent=max_concurrent, tokenizer=tokenizer)
+        self.vector_store = VectorStore()
+        controls = None
+        if (KB_DIR / "manifest.json").exists():
+            self.vector_store.load_compact(str(KB_DIR))
+            # Opt-in until the threshold is calibrated for the embedding model;
+            # knowledge bases built before control tagging have no index
+            controls = ControlIndex.load(str(KB_DIR)) if coverage else None
+            if controls is not None and self.vector_store.normalized is False:
+                print("Knowledge base embeddings are not normalized; skipping control coverage (rebuild it)")
+                controls = None
+        else:
+            # Knowledge bases built before the compact format
+            self.vector_store.load_index(
+                str(MODELS_DIR / "faiss_index.bin"),
+                str(MODELS_DIR / "chunks.pkl")
+            )
+        # Trivial and already-covered sections are recorded without an LLM call
+        screener = PreScreener(covered_similarity) if prescreen else None
+        self.gap_analyzer = GapAnalyzer(
+            self.vector_store, self.llm, max_workers=max_workers, prescreen=screener, controls=controls,
+            coverage_threshold=DEFAULT_COVERAGE_THRESHOLD if coverage_threshold is None else coverage_threshold,
+            coverage_scope=coverage_scope)
+        self.reviser = PolicyReviser(self.llm, max_workers=max_workers, mode=revision_mode,
+                                     polish_roadmap=polish_roadmap)
+    
+    def warm_up(self):
+        """Load the embedding model and index now rather than on the first search"""
+        self.vector_store.search("access control policy", k=1)
+    
+    def load_previous_analysis(self, policy_name: str) -> Optional[Dict[str, Any]]:
+        """Load the gap analysis from the most recent run of this policy"""
+        if not self.output_dir.exists():
+            return None
+        
+        pattern = re.compile(rf"^{re.escape(policy_name)}_\d{{8}}_\d{{6}}(_\d{{6}})?$")
+        runs = sorted(d for d in self.output_dir.iterdir() if d.is_dir() and pattern.match(d.name))
+        for run_dir in reversed(runs):
+            analysis_file = run_dir / "gap_analysis.json"
+            if analysis_file.exists():
+                try:
+                    with open(analysis_file, 'r') as f:
+                        return json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"Could not read previous analysis {analysis_file}: {e}")
+        return None
+    
+    def build_pipeline(self, policy_text: str, policy_name: str):
+        """Stages for one policy: revision and roadmap both wait only on the analysis"""
+        from pipeline import Pipeline
+        
+        def analyze(inputs):
+            previous = self.load_previous_analysis(policy_name) if self.incremental else None
+            print(f"\n🔍 Analyzing gaps: {policy_name}")
+            return self.gap_analyzer.analyze_gaps(policy_text, previous_result=previous)
+        
+        def revise(inputs):
+            print("\n  Revising policy...")
+            return self.reviser.revise_policy(policy_text, inputs["gap_analysis"])
+        
+        def roadmap(inputs):
+            print("\n  Creating roadmap...")
+            return self.reviser.create_roadmap(inputs["gap_analysis"])
+        
+        return (Pipeline()
+                .add("gap_analysis", analyze)
+                .add("revised_policy", revise, depends=["gap_analysis"])
+                .add("roadmap", roadmap, depends=["gap_analysis"]))
+    
+    def checkpoint_path(self, policy_text: str, policy_name: str, run_id: Optional[str] = None) -> Path:
+        """Checkpoints are keyed by content so an edited policy starts fresh
+        
+        With a run_id (a server job id) they are keyed by it instead, so
+        concurrent runs of the same text never resume from each other.
+        """
+        key = run_id or hashlib.sha256(policy_text.encode('utf-8')).hexdigest()[:16]
+        return self.checkpoint_dir / f"{policy_name}_{key}"
+    
+    def process_policy(self, policy_text: str, policy_name: str, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """Run the full pipeline on a policy and save the outputs"""
+        return self._run_pipeline(policy_text, policy_name, run_id=run_id)
+    
+    def process_batch(self, file_paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Run the pipeline on many policy files with batched retrieval"""
+        policies = {}
+        for policy_name, file_path in policy_names(file_paths).items():
+            with open(file_path, 'r') as f:
+                policies[policy_name] = f.read()
+        
+        previous_results = {}
+        if self.incremental:
+            for policy_name in policies:
+                previous = self.load_previous_analysis(policy_name)
+                if previous is not None:
+                    previous_results[policy_name] = previous
+        
+        print(f"\n🔍 Analyzing gaps for {len(policies)} policies")
+        analyses = self.gap_analyzer.analyze_batch(policies, previous_results=previous_results)
+        
+        return {
+            policy_name: self._run_pipeline(policy_text, policy_name, {"gap_analysis": analyses[policy_name]})
+            for policy_name, policy_text in policies.items()
+        }
+    
+    def _run_pipeline(self, policy_text: str, policy_name: str, initial: Optional[Dict[str, Any]] = None,
+                      run_id: Optional[str] = None) -> Dict[str, Any]:
+        """Run the remaining stages for a policy, resuming from checkpoints, and save outputs"""
+        from tracing import tracer
+        from pipeline import Pipeline
+        
+        checkpoint_path = self.checkpoint_path(policy_text, policy_name, run_id) if self.resume else None
+        try:
+            with tracer.span("process_policy", policy=policy_name) as span:
+                run = self.build_pipeline(policy_text, policy_name).run(
+                    initial=initial, checkpoint_dir=str(checkpoint_path) if checkpoint_path else None)
+                span.set("resumed", run['resumed'])
+        except Exception:
+            # Nothing else can resume a run keyed by its own id
+            if checkpoint_path is not None and run_id is not None:
+                Pipeline.clear_checkpoints(str(checkpoint_path))
+            raise
+        if run['resumed']:
+            print(f" Resumed stages from checkpoint: {', '.join(run['resumed'])}")
+        
+        gap_analysis = run['results']['gap_analysis']
+        incremental = gap_analysis.get('incremental', {})
+        print(f" Sections analyzed: {incremental.get('analyzed_sections', 0)}, "
+              f"reused: {incremental.get('reused_sections', 0)}")
+        prescreen = gap_analysis.get('prescreen')
+        if prescreen:
+            print(f" Pre-screen: {prescreen['needs_review']} sent to the LLM, "
+                  f"{prescreen['covered']} covered, {prescreen['trivial']} trivial")
+        coverage = gap_analysis.get('coverage')
+        if coverage:
+            covered = len({column for _, column, _ in coverage['entries']})
+            print(f" CSF controls: {covered} of {len(coverage['controls'])} covered, "
+                  f"{len(coverage['uncovered'])} uncovered reported as gaps")
+        print(" Stage times: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in run['timings'].items()))
+        
+        results = {
+            "policy_name": policy_name,
+            **run['results'],
+            "stage_timings": run['timings']
+        }
+        results["output_dir"] = str(self.save_results(policy_name, policy_text, results))
+        if checkpoint_path is not None:
+            Pipeline.clear_checkpoints(str(checkpoint_path))
+        return results
+    
+    def process_file(self, file_path: str) -> Dict[str, Any]:
+        """Run the full pipeline on a policy file"""
+        with open(file_path, 'r') as f:
+            policy_text = f.read()
+        return self.process_policy(policy_text, Path(file_path).stem)
+    
+    def save_results(self, policy_name: str, policy_text: str, results: Dict[str, Any]) -> Path:
+        """Write run outputs, including the section manifest used by incremental runs"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Microseconds keep concurrent runs of the same policy apart; mkdir
+        # fails rather than sharing a directory if two still collide
+        while True:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            run_dir = self.output_dir / f"{policy_name}_{timestamp}"
+            try:
+                run_dir.mkdir()
+                break
+            except FileExistsError:
+                continue
+        
+        with open(run_dir / "original.txt", 'w') as f:
+            f.write(policy_text)
+        for key, filename in [("gap_analysis", "gap_analysis.json"),
+                              ("revised_policy", "revised_policy.json"),
+                              ("roadmap", "roadmap.json"),
+                              ("stage_timings", "timings.json")]:
+            with open(run_dir / filename, 'w') as f:
+                json.dump(results[key], f, indent=2)
+        
+        print(f"\n Saved to: {run_dir}")
+        return run_dir
+
+def policy_names(file_paths: List[str]) -> Dict[str, str]:
+    """Map policy names (file stems) to paths
+    
+    Outputs and previous runs are looked up by name, so two different files
+    with the same stem would overwrite each other; they raise ValueError.
+    The same file given twice is processed once.
+    """
+    names: Dict[str, str] = {}
+    for file_path in file_paths:
+        name = Path(file_path).stem
+        if name in names:
+            if Path(names[name]).resolve() == Path(file_path).resolve():
+                continue
+            raise ValueError(f"Policies {names[name]} and {file_path} share the name '{name}'; "
+                             f"rename one or process them separately")
+        names[name] = str(file_path)
+    return names
+
+def run_simple(file_path: str, backend: str = "http"):
+    """Quick two-prompt review through the Ollama HTTP API or CLI"""
+    print(" Simple PolicyGapFixer (CLI Version)")
     
-    file_path = sys.argv[1]
     if not os.path.exists(file_path):
         print(f"File not found: {file_path}")
         return
@@ -59,19 +309,19 @@ def main():
     
     
     print("\n🔍 Analyzing...")
-    analysis_prompt = f"List 2 strengths and 2 weaknesses of this policy: {policy[:150]}"
-    analysis = run_ollama(analysis_prompt, timeout=60)
+    analysis_prompt = build_simple_prompt("List 2 strengths and 2 weaknesses of this policy:", policy)
+    analysis = run_ollama(analysis_prompt, timeout=60, backend=backend)
     print(f" Analysis: {analysis[:50]}...")
     
     
     print("\n  Revising...")
-    revision_prompt = f"Suggest 3 specific improvements for: {policy[:100]}"
-    revision = run_ollama(revision_prompt, timeout=60)
+    revision_prompt = build_simple_prompt("Suggest 3 specific improvements for:", policy)
+    revision = run_ollama(revision_prompt, timeout=60, backend=backend)
     print(f" Revision: {revision[:50]}...")
     
  
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = Path(f"outputs/{policy_name}_{timestamp}")
+    output_dir = OUTPUT_DIR / f"{policy_name}_{timestamp}"
     output_dir.mkdir(parents=True, exist_ok=True)
     
     with open(output_dir / "analysis.txt", 'w') as f:
@@ -87,5 +337,100 @@ def main():
     print(f"\nAnalysis preview: {analysis[:100]}...")
     print(f"Revision preview: {revision[:100]}...")
 
+def main():
+    parser = argparse.ArgumentParser(description="Audit cybersecurity policies against CIS/NIST standards")
+    parser.add_argument("policies", nargs="*", help="Policy files or directories (default: test_policies/)")
+    parser.add_argument("--simple", action="store_true",
+                        help="Quick two-prompt review without the knowledge base, through the Ollama "
+                             "HTTP API (or `ollama run` with --backend subprocess)")
+    parser.add_argument("--workers", type=int, default=1, help="Sections analyzed concurrently")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-analyze every section, ignoring previous runs and checkpoints")
+    parser.add_argument("--backend", choices=["http", "subprocess", "llama_cpp"], default="http",
+                        help="Ollama HTTP API, `ollama run`, or an in-process llama.cpp model")
+    parser.add_argument("--model-path", help="GGUF model file for the llama_cpp backend")
+    parser.add_argument("--threads", type=int, help="CPU threads for the llama_cpp backend")
+    parser.add_argument("--max-concurrency", type=int, default=4,
+                        help="LLM requests in flight at once; other callers wait for a slot")
+    parser.add_argument("--tokenizer",
+                        help="Hugging Face tokenizer of the LLM (from the local cache) for exact prompt "
+                             "budgets; without it counts are estimated and 20%% of the context is held back")
+    parser.add_argument("--revise", choices=["auto", "single", "sections"], default="auto",
+                        help="Revise in one generation, section by section, or pick by policy size")
+    parser.add_argument("--polish-roadmap", action="store_true",
+                        help="Have the LLM write descriptions for the rule-based roadmap phases")
+    parser.add_argument("--prescreen", action="store_true",
+                        help="Record empty, boilerplate and already-covered sections without the LLM")
+    parser.add_argument("--covered-similarity", type=float, default=0.85,
+                        help="With --prescreen, similarity to a standards chunk above which a section "
+                             "skips the LLM (default 0.85, not calibrated for the embedding model; "
+                             "benchmark.py --embedder model recommends one)")
+    parser.add_argument("--coverage", action="store_true",
+                        help="Report CSF controls no section covers as gaps, without the LLM")
+    parser.add_argument("--coverage-threshold", type=float,
+                        help="With --coverage, similarity at which a section covers a CSF control "
+                             "(default 0.5, not calibrated for the embedding model)")
+    parser.add_argument("--coverage-scope", choices=["categories", "all"], default="categories",
+                        help="Report uncovered controls only in CSF categories the policy touches, or all")
+    parser.add_argument("--trace", help="Append timing spans to this JSONL file")
+    parser.add_argument("--metrics", help="Write Prometheus-format metrics to this file when done")
+    parser.add_argument("--progress", action="store_true", help="Show a dot per streamed LLM token")
+    args = parser.parse_args()
+    
+    if args.simple:
+        if len(args.policies) != 1:
+            parser.error("--simple requires a single policy file")
+        if args.backend == "llama_cpp":
+            parser.error("--simple supports the http and subprocess backends")
+        run_simple(args.policies[0], args.backend)
+        return
+    
+    files = []
+    for target in args.policies or [str(TEST_POLICIES_DIR)]:
+        path = Path(target)
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.txt")))
+        elif path.exists():
+            files.append(path)
+        else:
+            print(f"File not found: {target}")
+    if not files:
+        print("No policy files to process")
+        return
+    try:
+        policy_names([str(f) for f in files])
+    except ValueError as e:
+        parser.error(str(e))
+    
+    fixer = PolicyGapFixer(max_workers=args.workers, incremental=not args.full, resume=not args.full,
+                           backend=args.backend, model_path=args.model_path, n_threads=args.threads,
+                           revision_mode=args.revise, polish_roadmap=args.polish_roadmap,
+                           max_concurrent=args.max_concurrency, prescreen=args.prescreen,
+                           covered_similarity=args.covered_similarity,
+                           coverage=args.coverage, coverage_threshold=args.coverage_threshold,
+                           coverage_scope=args.coverage_scope,
+                           tokenizer=args.tokenizer)
+    if args.trace or args.metrics:
+        from tracing import tracer
+        tracer.configure(args.trace)
+        tracer.export_metrics = bool(args.metrics)
+    if args.progress:
+        fixer.llm.on_token = lambda token: print('.', end='', flush=True)
+    start = time.time()
+    if len(files) == 1:
+        all_results = {files[0].stem: fixer.process_file(str(files[0]))}
+    else:
+        all_results = fixer.process_batch([str(f) for f in files])
+    
+    for policy_name, results in all_results.items():
+        summary = results['gap_analysis']['summary']
+        print(f" {policy_name}: {summary['total_gaps']} gaps ({summary['high_priority_gaps']} high)")
+    print(f"\n Processed {len(all_results)} policies in {time.time() - start:.1f}s")
+    
+    if args.metrics:
+        from tracing import tracer
+        tracer.write_prometheus(args.metrics)
+        print(f" Metrics written to {args.metrics}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
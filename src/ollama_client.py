@@ -0,0 +1,132 @@
+import json
+import queue
+import http.client
+from urllib.parse import urlparse
+from typing import Dict, Any, Iterator, Optional
+
+DEFAULT_HOST = "http://localhost:11434"
+
+# Errors meaning a pooled keep-alive connection went stale and can be retried
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+class OllamaError(Exception):
+    """Ollama returned an error response; status is None for errors inside a stream"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class OllamaClient:
+    """Client for the local Ollama HTTP API with pooled keep-alive connections
+
+    Connections are reused across calls and threads instead of spawning an
+    `ollama run` process per prompt, and keep_alive is sent with every
+    request so the model stays resident between calls.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, pool_size: int = 4, timeout: float = 300,
+                 keep_alive: str = "30m"):
+        parsed = urlparse(host if "://" in host else f"http://{host}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 11434
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._pool: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, conn: http.client.HTTPConnection):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _post(self, path: str, payload: Dict[str, Any]):
+        """POST JSON and return (connection, response), retrying once on a stale connection"""
+        body = json.dumps(payload).encode('utf-8')
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if attempt == 1:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            if response.status != 200:
+                detail = response.read().decode('utf-8', errors='replace')
+                self._release(conn)
+                raise OllamaError(f"Ollama returned {response.status}: {detail[:200]}", response.status)
+            return conn, response
+
+    def generate(self, model: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                 format: Optional[Any] = None) -> Dict[str, Any]:
+        """Non-streaming /api/generate call"""
+        conn, response = self._post("/api/generate", self._payload(model, prompt, options, format, stream=False))
+        try:
+            result = json.loads(response.read())
+        except Exception:
+            conn.close()
+            raise
+        self._release(conn)
+        return result
+
+    def generate_stream(self, model: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                        format: Optional[Any] = None) -> Iterator[Dict[str, Any]]:
+        """Streaming /api/generate call yielding one dict per chunk
+
+        Closing the generator early closes the connection, which makes
+        Ollama stop generating; a fully consumed stream returns its
+        connection to the pool.
+        """
+        conn, response = self._post("/api/generate", self._payload(model, prompt, options, format, stream=True))
+        finished = False
+        try:
+            for line in response:
+                line = line.strip()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise OllamaError(chunk["error"])
+                yield chunk
+                if chunk.get("done"):
+                    finished = True
+                    break
+        finally:
+            if finished:
+                response.read()
+                self._release(conn)
+            else:
+                conn.close()
+
+    def _payload(self, model: str, prompt: str, options: Optional[Dict[str, Any]],
+                 format: Optional[Any], stream: bool) -> Dict[str, Any]:
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": options or {}
+        }
+        if format is not None:
+            payload["format"] = format
+        return payload
+
+    def close(self):
+        """Close all pooled connections"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
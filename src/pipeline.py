@@ -0,0 +1,141 @@
+import os
+import json
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Any, Iterable, Optional
+from tracing import tracer
+
+class StageError(Exception):
+    """A pipeline stage raised; completed stages are already checkpointed"""
+
+    def __init__(self, stage: str, cause: Exception):
+        super().__init__(f"Stage '{stage}' failed: {cause}")
+        self.stage = stage
+        self.cause = cause
+
+class Pipeline:
+    """Run named stages as a dependency graph
+
+    Each stage function receives a dict with the results of its
+    dependencies. A stage starts as soon as all of its dependencies are
+    done, so independent stages run concurrently. With a checkpoint_dir
+    every finished stage is written there as JSON, and a later run with the
+    same directory loads those results instead of running the stages again.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], depends: Iterable[str] = ()) -> "Pipeline":
+        """Declare a stage; dependencies must already be declared"""
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        depends = tuple(depends)
+        for dependency in depends:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self.stages[name] = {"func": func, "depends": depends}
+        return self
+
+    @staticmethod
+    def _checkpoint_path(checkpoint_dir: Path, name: str) -> Path:
+        return checkpoint_dir / f"{name}.json"
+
+    def _load_checkpoint(self, checkpoint_dir: Path, name: str):
+        path = self._checkpoint_path(checkpoint_dir, name)
+        try:
+            with open(path, 'r') as f:
+                return True, json.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Ignoring unreadable checkpoint {path}: {e}")
+            return False, None
+
+    def _save_checkpoint(self, checkpoint_dir: Path, name: str, value: Any):
+        """Write atomically so a crash never leaves a partial checkpoint"""
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        path = self._checkpoint_path(checkpoint_dir, name)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def run(self, initial: Optional[Dict[str, Any]] = None,
+            checkpoint_dir: Optional[str] = None) -> Dict[str, Any]:
+        """Run every stage and return {results, timings, resumed}
+
+        initial supplies results for stages computed elsewhere; those
+        stages are not run. timings holds the wall time of each stage that
+        ran, and resumed lists the stages loaded from checkpoints.
+        """
+        results: Dict[str, Any] = dict(initial or {})
+        timings: Dict[str, float] = {}
+        resumed = []
+        checkpoint_path = Path(checkpoint_dir) if checkpoint_dir else None
+
+        if checkpoint_path is not None:
+            for name in self.stages:
+                if name in results:
+                    continue
+                found, value = self._load_checkpoint(checkpoint_path, name)
+                if found:
+                    results[name] = value
+                    resumed.append(name)
+
+        pending = [name for name in self.stages if name not in results]
+        running = {}
+
+        parent = tracer.current()
+
+        def timed(name: str, inputs: Dict[str, Any]):
+            with tracer.attach(parent), tracer.span("pipeline.stage", stage=name):
+                start = time.perf_counter()
+                value = self.stages[name]["func"](inputs)
+                return value, time.perf_counter() - start
+
+        failure: Optional[StageError] = None
+        with ThreadPoolExecutor(max_workers=self.max_workers or max(1, len(pending))) as executor:
+            while running or (pending and failure is None):
+                if failure is None:
+                    for name in [n for n in pending if all(d in results for d in self.stages[n]["depends"])]:
+                        inputs = {d: results[d] for d in self.stages[name]["depends"]}
+                        running[executor.submit(timed, name, inputs)] = name
+                        pending.remove(name)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        value, elapsed = future.result()
+                    except Exception as e:
+                        # Stages already running finish and are checkpointed
+                        if failure is None:
+                            failure = StageError(name, e)
+                            failure.__cause__ = e
+                        continue
+                    results[name] = value
+                    timings[name] = round(elapsed, 3)
+                    if checkpoint_path is not None:
+                        self._save_checkpoint(checkpoint_path, name, value)
+
+        if failure is not None:
+            raise failure
+        return {"results": results, "timings": timings, "resumed": resumed}
+
+    @staticmethod
+    def clear_checkpoints(checkpoint_dir: str):
+        """Remove a finished run's checkpoints"""
+        path = Path(checkpoint_dir)
+        if not path.exists():
+            return
+        for checkpoint in path.glob("*.json"):
+            checkpoint.unlink()
+        try:
+            path.rmdir()
+        except OSError:
+            pass
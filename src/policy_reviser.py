@@ -1,97 +1,207 @@
+import re
+import difflib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any
 from llm_handler import LocalLLMHandler
+from gap_analyzer import split_policy_sections
+from roadmap import build_roadmap, polish_descriptions
+from tracing import tracer
+
+REVISION_MODES = ("auto", "single", "sections")
+
+# In auto mode, policies longer than this are revised section by section
+SINGLE_PASS_MAX_TOKENS = 1500
+
+SECTION_REVISION_FORMAT = {
+    "revised_section": "Full revised text of this section",
+    "gap_addressing_summary": "How the gaps were addressed in this section"
+}
+
+# Placed before the JSON format and the packed gaps and policy, so the
+# instructions are never what gets cut
+REVISION_INSTRUCTIONS = """Revise the following cybersecurity policy to address identified gaps.
+
+Please provide:
+1. A revised version of the policy with all gaps addressed
+2. Track changes showing what was added or modified
+3. Explanation of how each gap was addressed"""
+
+REVISION_OUTPUT_FORMAT = {
+    "revised_policy": "Full text of revised policy",
+    "track_changes": [
+        {
+            "section": "Section name",
+            "original": "Original text",
+            "revised": "Revised text",
+            "rationale": "Why this change was made"
+        }
+    ],
+    "gap_addressing_summary": "Summary of how gaps were addressed"
+}
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n+')
+
+def diff_changes(section: str, original: str, revised: str, rationale: str = "") -> List[Dict[str, str]]:
+    """Track changes between two versions of a section as sentence-level hunks"""
+    before = [s for s in SENTENCE_SPLIT.split(original) if s.strip()]
+    after = [s for s in SENTENCE_SPLIT.split(revised) if s.strip()]
+    changes = []
+    matcher = difflib.SequenceMatcher(a=before, b=after, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        changes.append({
+            "section": section,
+            "original": ' '.join(before[i1:i2]),
+            "revised": ' '.join(after[j1:j2]),
+            "rationale": rationale
+        })
+    return changes
 
 class PolicyReviser:
-    def __init__(self, llm_handler: LocalLLMHandler):
+    def __init__(self, llm_handler: LocalLLMHandler, max_workers: int = 1, mode: str = "auto",
+                 polish_roadmap: bool = False):
+        if mode not in REVISION_MODES:
+            raise ValueError(f"Unknown revision mode '{mode}', expected one of {REVISION_MODES}")
         self.llm = llm_handler
+        self.max_workers = max_workers
+        # "single" revises the whole document in one generation, "sections"
+        # revises each section separately and merges, "auto" picks by size
+        self.mode = mode
+        self.polish_roadmap = polish_roadmap
     
     def revise_policy(self, original_policy: str, gap_analysis: Dict) -> Dict[str, Any]:
         """Revise policy based on gap analysis"""
+        sectioned = self._use_sections(original_policy)
+        with tracer.span("reviser.revise_policy", mode="sections" if sectioned else "single"):
+            if sectioned:
+                return self.revise_sections(original_policy, gap_analysis)
+            return self.revise_whole(original_policy, gap_analysis)
+    
+    def _use_sections(self, original_policy: str) -> bool:
+        if self.mode != "auto":
+            return self.mode == "sections"
+        if len(split_policy_sections(original_policy)) < 2:
+            return False
+        return self.llm.token_counter.count(original_policy) > SINGLE_PASS_MAX_TOKENS
+    
+    def revise_whole(self, original_policy: str, gap_analysis: Dict) -> Dict[str, Any]:
+        """Revise the whole policy in one generation
         
-        # Prepare gap summary for prompt
-        gap_summary = []
-        for analysis in gap_analysis.get('policy_analysis', []):
-            for gap in analysis.get('gaps', []):
-                gap_summary.append({
-                    "issue": gap.get('gap_description', ''),
-                    "recommendation": gap.get('recommendation', '')
-                })
+        The instructions and JSON format always fit; the gaps and then the
+        policy text are packed into the rest of the context, and anything
+        truncated or dropped is reported under prompt_packing.
+        """
+        gap_lines = [f"- {gap.get('gap_description', '')}: {gap.get('recommendation', '')}"
+                     for analysis in gap_analysis.get('policy_analysis', []) for gap in analysis.get('gaps', [])]
         
-        # Create revision prompt
-        prompt = f"""Revise the following cybersecurity policy to address identified gaps:
+        packed = (self.llm.prompt_builder(REVISION_OUTPUT_FORMAT, preamble=REVISION_INSTRUCTIONS)
+                  .add("gaps", "IDENTIFIED GAPS TO ADDRESS:\n" + '\n'.join(gap_lines) + "\n", priority=0)
+                  .add("policy", f"ORIGINAL POLICY:\n{original_policy}", priority=1)
+                  .build())
+        revision = self.llm.generate_structured(packed['prompt'], REVISION_OUTPUT_FORMAT,
+                                                preamble=REVISION_INSTRUCTIONS)
+        
+        if packed['truncated'] or packed['dropped']:
+            tracer.count("prompts_truncated_total", stage="revision")
+            if isinstance(revision, dict):
+                revision['prompt_packing'] = {"truncated": packed['truncated'], "dropped": packed['dropped']}
+        return revision
+    
+    @staticmethod
+    def gaps_by_section(gap_analysis: Dict) -> Dict[str, List[Dict]]:
+        """Gaps from the analysis keyed by the section they were found in"""
+        gaps = {}
+        for analysis in gap_analysis.get('policy_analysis', []):
+            gaps.setdefault(analysis.get('section', ''), []).extend(analysis.get('gaps', []))
+        return gaps
+    
+    def revise_section(self, section_name: str, section_text: str, gaps: List[Dict]) -> Dict[str, Any]:
+        """Revise one section against only the gaps found in it"""
+        gap_lines = '\n'.join(f"- {gap.get('gap_description', '')}: {gap.get('recommendation', '')}" for gap in gaps)
+        prompt = f"""Revise the following section of a cybersecurity policy to address the identified gaps.
+Keep the wording of parts that need no change and return only the text of this section.
 
-ORIGINAL POLICY:
-{original_policy}
+SECTION: {section_name}
+{section_text}
 
 IDENTIFIED GAPS TO ADDRESS:
-{chr(10).join([f"- {gap['issue']}: {gap['recommendation']}" for gap in gap_summary])}
-
-Please provide:
-1. A revised version of the policy with all gaps addressed
-2. Track changes showing what was added or modified
-3. Explanation of how each gap was addressed
-
-Structure your response accordingly."""
-
-        output_format = {
-            "revised_policy": "Full text of revised policy",
-            "track_changes": [
-                {
-                    "section": "Section name",
-                    "original": "Original text",
-                    "revised": "Revised text",
-                    "rationale": "Why this change was made"
-                }
-            ],
-            "gap_addressing_summary": "Summary of how gaps were addressed"
-        }
-        
-        revision = self.llm.generate_structured(prompt, output_format)
+{gap_lines}"""
         
+        section_tokens = self.llm.token_counter.count(section_text)
+        max_tokens = min(max(300, 2 * section_tokens + 100), self.llm.context_window // 2)
+        with tracer.span("reviser.revise_section", section=section_name, gaps=len(gaps)):
+            return self.llm.generate_structured(prompt, SECTION_REVISION_FORMAT, max_tokens=max_tokens)
+    
+    def _safe_revise_section(self, section_name: str, section_text: str, gaps: List[Dict]) -> Dict[str, Any]:
+        try:
+            revision = self.revise_section(section_name, section_text, gaps)
+        except Exception as e:
+            return {"error": str(e)}
+        if not isinstance(revision, dict) or not isinstance(revision.get('revised_section'), str) \
+                or not revision['revised_section'].strip():
+            error = revision.get('error', 'No revised text returned') if isinstance(revision, dict) else 'Invalid response'
+            return {"error": error}
         return revision
     
-    def create_roadmap(self, gap_analysis: Dict) -> Dict[str, Any]:
-        """Create implementation roadmap"""
+    def revise_sections(self, original_policy: str, gap_analysis: Dict) -> Dict[str, Any]:
+        """Map-reduce revision: revise sections with gaps in parallel, then merge
         
-        nist_gaps = {"Identify": [], "Protect": [], "Detect": [], "Respond": [], "Recover": []}
+        Sections without gaps are kept verbatim, and a section whose revision
+        fails keeps its original text with the error recorded. track_changes
+        is a sentence-level diff of each section, not model output.
+        """
+        sections = split_policy_sections(original_policy)
+        gaps = self.gaps_by_section(gap_analysis)
+        texts = ['\n'.join(lines).strip() for _, _, lines in sections]
         
-        for analysis in gap_analysis.get('policy_analysis', []):
-            for gap in analysis.get('gaps', []):
-                nist_function = gap.get('nist_function', 'Identify')
-                if nist_function in nist_gaps:
-                    nist_gaps[nist_function].append(gap)
+        tasks = [(i, title) for i, (title, _, _) in enumerate(sections) if gaps.get(title)]
+        parent = tracer.current()
         
+        def revise(task):
+            with tracer.attach(parent):
+                return self._safe_revise_section(task[1], texts[task[0]], gaps[task[1]])
         
-        prompt = f"""Based on the following gap analysis, create a 6-month implementation roadmap aligned with NIST CSF:
-
-GAP ANALYSIS SUMMARY:
-Total Gaps: {gap_analysis.get('summary', {}).get('total_gaps', 0)}
-High Priority Gaps: {gap_analysis.get('summary', {}).get('high_priority_gaps', 0)}
-
-Gaps by NIST Function:
-Identify: {len(nist_gaps['Identify'])} gaps
-Protect: {len(nist_gaps['Protect'])} gaps
-Detect: {len(nist_gaps['Detect'])} gaps
-Respond: {len(nist_gaps['Respond'])} gaps
-Recover: {len(nist_gaps['Recover'])} gaps
-
-Create a phased implementation plan with timeline, priority, and resources needed."""
-
-        output_format = {
-            "roadmap": {
-                "phases": [
-                    {
-                        "phase": "Phase 1 (Month 1-2)",
-                        "objectives": ["Objective 1", "Objective 2"],
-                        "key_activities": ["Activity 1", "Activity 2"],
-                        "success_metrics": ["Metric 1", "Metric 2"],
-                        "resources_needed": ["Resource 1", "Resource 2"]
-                    }
-                ],
-                "timeline": "Gantt chart or timeline description",
-                "success_criteria": ["Criteria 1", "Criteria 2"]
-            }
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            revisions = list(executor.map(revise, tasks))
+        revised_by_index = dict(zip((i for i, _ in tasks), revisions))
+        
+        merged = []
+        track_changes = []
+        summaries = []
+        section_reports = []
+        for i, (title, heading, _) in enumerate(sections):
+            revision = revised_by_index.get(i)
+            text = texts[i]
+            report = {"section": title, "status": "unchanged"}
+            if revision is not None and 'error' in revision:
+                report.update(status="error", error=revision['error'])
+            elif revision is not None:
+                summary = revision.get('gap_addressing_summary', '')
+                revised_text = revision['revised_section'].strip()
+                track_changes.extend(diff_changes(title, text, revised_text, summary))
+                if summary:
+                    summaries.append(f"{title}: {summary}")
+                text = revised_text
+                report["status"] = "revised"
+            section_reports.append(report)
+            merged.append(f"{heading}\n{text}" if heading else text)
+        
+        return {
+            "revised_policy": '\n\n'.join(block.strip() for block in merged if block.strip()),
+            "track_changes": track_changes,
+            "gap_addressing_summary": '\n'.join(summaries),
+            "sections": section_reports
         }
+    
+    def create_roadmap(self, gap_analysis: Dict) -> Dict[str, Any]:
+        """Create implementation roadmap
         
-        roadmap = self.llm.generate_structured(prompt, output_format)
-        return roadmap
\ No newline at end of file
+        Gaps are scheduled by rules in roadmap.build_roadmap; with
+        polish_roadmap set the LLM only writes each phase's description.
+        """
+        with tracer.span("reviser.create_roadmap", polish=self.polish_roadmap):
+            roadmap = build_roadmap(gap_analysis)
+            if self.polish_roadmap:
+                polish_descriptions(roadmap, self.llm)
+            return roadmap
\ No newline at end of file
@@ -0,0 +1,61 @@
+from typing import List, Dict, Any, Optional
+from tokenization import TokenCounter
+
+class PromptBuilder:
+    """Pack prompt parts into a token budget in priority order
+
+    Parts are rendered in the order they were added but budget is handed
+    out by priority (lower numbers first). A part that does not fit is
+    truncated if it is marked truncatable and enough room is left,
+    otherwise it is dropped. build() reports what was cut.
+    """
+
+    def __init__(self, context_window: int = 4096, reserve_tokens: int = 0,
+                 token_counter: Optional[TokenCounter] = None, min_part_tokens: int = 32):
+        self.budget = context_window - reserve_tokens
+        self.counter = token_counter or TokenCounter()
+        self.min_part_tokens = min_part_tokens
+        self.parts: List[Dict[str, Any]] = []
+
+    def add(self, name: str, text: str, priority: int = 0, truncatable: bool = True,
+            token_count: Optional[int] = None) -> "PromptBuilder":
+        """Add a part; token_count can be supplied to skip re-tokenizing
+
+        A supplied count must come from this builder's counter, or the
+        budget mixes units.
+        """
+        self.parts.append({
+            "name": name,
+            "text": text,
+            "priority": priority,
+            "truncatable": truncatable,
+            "tokens": token_count if token_count is not None else self.counter.count(text)
+        })
+        return self
+
+    def build(self, separator: str = "\n") -> Dict[str, Any]:
+        """Return the packed prompt with a report of included, truncated and dropped parts"""
+        remaining = self.budget
+        rendered: Dict[int, str] = {}
+        report = {"included": [], "truncated": [], "dropped": []}
+
+        for i in sorted(range(len(self.parts)), key=lambda i: self.parts[i]["priority"]):
+            part = self.parts[i]
+            if part["tokens"] <= remaining:
+                rendered[i] = part["text"]
+                remaining -= part["tokens"]
+                report["included"].append(part["name"])
+            elif part["truncatable"] and remaining >= self.min_part_tokens:
+                text = self.counter.truncate(part["text"], remaining)
+                rendered[i] = text
+                remaining = max(0, remaining - self.counter.count(text))
+                report["truncated"].append(part["name"])
+            else:
+                report["dropped"].append(part["name"])
+
+        return {
+            "prompt": separator.join(rendered[i] for i in sorted(rendered)),
+            "used_tokens": self.budget - remaining,
+            "budget": self.budget,
+            **report
+        }
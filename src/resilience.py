@@ -0,0 +1,209 @@
+"""Error classification, backoff, circuit breaking and concurrency limits for LLM calls
+
+Backend exceptions are mapped to LLMError subclasses whose kind says what
+went wrong (timeout, backend down, unparseable output, ...) and whether
+retrying can help. A BackendGuard is shared by every caller of the same
+backend endpoint: its limiter caps concurrent requests, and its circuit
+breaker fails calls fast after repeated timeouts or connection failures
+instead of letting each caller wait out its own timeout.
+"""
+import errno
+import random
+import threading
+import subprocess
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Callable, Iterator
+from ollama_client import OllamaError
+from tracing import tracer
+
+class LLMError(Exception):
+    """A failed generation; kind classifies the failure"""
+    kind = "error"
+    retryable = True
+
+    def __init__(self, message: str = "", response: str = ""):
+        super().__init__(message or self.kind)
+        # Raw model output, for failures such as unparseable JSON
+        self.response = response
+
+class LLMTimeoutError(LLMError):
+    kind = "timeout"
+
+class BackendUnavailableError(LLMError):
+    """Connection refused or reset, or the server reported an internal error"""
+    kind = "backend_down"
+
+class OverloadedError(LLMError):
+    """No concurrency slot became free in time"""
+    kind = "overloaded"
+
+class CircuitOpenError(LLMError):
+    """The backend failed repeatedly; calls fail fast until the reset timeout"""
+    kind = "circuit_open"
+    retryable = False
+
+class RequestError(LLMError):
+    """The backend rejected the request itself (unknown model, bad options)"""
+    kind = "request"
+    retryable = False
+
+class PromptTooLongError(LLMError):
+    """The prompt leaves no room for the completion in the context window"""
+    kind = "prompt_too_long"
+    retryable = False
+
+class EmptyResponseError(LLMError):
+    kind = "empty"
+
+class ParseError(LLMError):
+    """The output was not the JSON the caller asked for"""
+    kind = "parse"
+
+UNREACHABLE_ERRNOS = {errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTUNREACH, errno.ENETUNREACH}
+
+def classify_error(exc: BaseException) -> LLMError:
+    """Wrap a backend exception in the matching LLMError subclass"""
+    if isinstance(exc, LLMError):
+        return exc
+    message = f"{type(exc).__name__}: {exc}"[:300]
+    if isinstance(exc, (TimeoutError, subprocess.TimeoutExpired)):
+        return LLMTimeoutError(message)
+    if isinstance(exc, ConnectionError) or (isinstance(exc, OSError) and exc.errno in UNREACHABLE_ERRNOS):
+        return BackendUnavailableError(message)
+    if isinstance(exc, OllamaError):
+        if exc.status is not None and 400 <= exc.status < 500:
+            return RequestError(message)
+        return BackendUnavailableError(message)
+    return LLMError(message)
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: sleep U(0, min(max_delay, base_delay * 2**attempt))"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 rng: Optional[random.Random] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._rng = rng or random.Random()
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the given (0-based) failed attempt"""
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+class CircuitBreaker:
+    """Open after failure_threshold consecutive health failures
+
+    While open, calls raise CircuitOpenError. After reset_timeout one probe
+    call is let through (half-open); its success closes the circuit and
+    its failure opens it again. Only timeouts and backend-down errors count:
+    bad output says nothing about the backend's health.
+    """
+    HEALTH_FAILURES = ("timeout", "backend_down")
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may proceed"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            remaining = max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+            raise CircuitOpenError(f"Backend unhealthy after {self.failures} failures, "
+                                   f"retrying in {remaining:.0f}s")
+
+    def release_probe(self):
+        """Free the half-open probe of a call that ended without an outcome"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+            self._probing = False
+
+    def record_failure(self, kind: str):
+        with self._lock:
+            if kind not in self.HEALTH_FAILURES:
+                if self.state == "half_open":
+                    # The probe reached the backend, so it is up
+                    self.state = "closed"
+                    self.failures = 0
+                self._probing = False
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    tracer.count("llm_circuit_opened_total")
+                self.state = "open"
+                self.opened_at = self.clock()
+            self._probing = False
+
+class BackendGuard:
+    """Concurrency limit and circuit breaker shared by all callers of one backend"""
+
+    def __init__(self, max_concurrent: int = 4, acquire_timeout: Optional[float] = 600.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout = acquire_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """Hold a concurrency slot for one backend call and report its outcome
+
+        The breaker is checked once, after a slot is acquired: callers queued
+        behind a failing backend fail fast once the circuit opens, and the
+        call that claims a half-open probe is the one that goes on to reach
+        the backend. Exceptions leave as LLMError subclasses.
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise OverloadedError(f"No free slot among {self.max_concurrent} after {self.acquire_timeout}s")
+        try:
+            self.breaker.allow()
+            try:
+                yield
+            except Exception as e:
+                error = classify_error(e)
+                self.breaker.record_failure(error.kind)
+                if error is e:
+                    raise
+                raise error from e
+            except BaseException:
+                # Interrupted without an outcome; let the next call probe
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+        finally:
+            self._slots.release()
+
+_guards: Dict[str, BackendGuard] = {}
+_guards_lock = threading.Lock()
+
+def guard_for(key: str, max_concurrent: int = 4) -> BackendGuard:
+    """The process-wide guard for a backend endpoint
+
+    The first caller for a key sets its concurrency limit; later callers
+    share that guard.
+    """
+    with _guards_lock:
+        if key not in _guards:
+            _guards[key] = BackendGuard(max_concurrent)
+        return _guards[key]
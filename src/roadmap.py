@@ -0,0 +1,188 @@
+from typing import Dict, List, Any, Tuple, Optional
+from gap_analyzer import NIST_FUNCTIONS
+from csf import find_controls, function_of
+
+SEVERITIES = ["High", "Medium", "Low"]
+
+# Phase a gap is due in by severity; prerequisites can pull a gap earlier
+PHASES = [
+    {"phase": "Phase 1 (Month 1-2)", "severity": "High"},
+    {"phase": "Phase 2 (Month 3-4)", "severity": "Medium"},
+    {"phase": "Phase 3 (Month 5-6)", "severity": "Low"}
+]
+
+FUNCTION_RESOURCES = {
+    "Govern": "Leadership and policy owners for roles, risk strategy and oversight",
+    "Identify": "Asset owners and risk management for inventory and risk assessment",
+    "Protect": "IT and security engineering for access control and hardening",
+    "Detect": "Security operations with logging and monitoring tooling",
+    "Respond": "Incident response team and communication plan owners",
+    "Recover": "Business continuity and backup owners"
+}
+
+def _normalize(value: Any, allowed: List[str], default: Optional[str]) -> Optional[str]:
+    """Match a model-produced label such as 'high' or 'Protect (PR.AC)' to an allowed value"""
+    text = str(value or '').strip().lower()
+    for option in allowed:
+        if text.startswith(option.lower()):
+            return option
+    return default
+
+def _control(gap: Dict) -> Optional[str]:
+    """CSF control of a gap: its control field, or an ID in its nist_function text"""
+    if gap.get('control'):
+        return gap['control']
+    controls = find_controls(str(gap.get('nist_function') or ''))
+    return controls[0] if controls else None
+
+class GapIndex:
+    """Gaps from a gap analysis with lookup tables built in one pass
+
+    Each gap gets an integer id; by_severity, by_function, by_control and
+    by_section_function map to lists of ids in document order. A gap tied
+    to a CSF control (coverage gaps, or a model answer naming an ID such as
+    PR.AC-01) takes its function from the control ID; other labels are
+    matched by name, falling back to the function of the section's best
+    covered control.
+    """
+
+    def __init__(self, gap_analysis: Dict):
+        self.gaps: List[Dict[str, Any]] = []
+        self.by_severity: Dict[str, List[int]] = {severity: [] for severity in SEVERITIES}
+        self.by_function: Dict[str, List[int]] = {function: [] for function in NIST_FUNCTIONS}
+        self.by_control: Dict[str, List[int]] = {}
+        self.by_section_function: Dict[Tuple[str, str], List[int]] = {}
+
+        for analysis in gap_analysis.get('policy_analysis', []):
+            section = analysis.get('section', '')
+            section_controls = analysis.get('controls') or []
+            for gap in analysis.get('gaps', []):
+                if not isinstance(gap, dict):
+                    continue
+                gap_id = len(self.gaps)
+                severity = _normalize(gap.get('severity'), SEVERITIES, "Medium")
+                control = _control(gap)
+                if control:
+                    function = function_of(control)
+                else:
+                    function = _normalize(gap.get('nist_function'), NIST_FUNCTIONS, None)
+                    if function is None:
+                        function = function_of(section_controls[0]) if section_controls else "Identify"
+                self.gaps.append({
+                    "id": gap_id,
+                    "section": section,
+                    "severity": severity,
+                    "nist_function": function,
+                    "control": control,
+                    "gap_description": gap.get('gap_description', ''),
+                    "recommendation": gap.get('recommendation', '')
+                })
+                self.by_severity[severity].append(gap_id)
+                self.by_function[function].append(gap_id)
+                if control:
+                    self.by_control.setdefault(control, []).append(gap_id)
+                self.by_section_function.setdefault((section, function), []).append(gap_id)
+
+    def __len__(self) -> int:
+        return len(self.gaps)
+
+    def schedule(self) -> List[int]:
+        """Phase number (0-based) for every gap id
+
+        A gap starts in the phase for its severity. Within a section, NIST
+        functions build on each other (Identify before Protect before
+        Detect ...), so a gap is pulled forward to the earliest phase of any
+        later-function gap in the same section that depends on it.
+        """
+        severity_phase = {entry["severity"]: i for i, entry in enumerate(PHASES)}
+        phases = [severity_phase[gap["severity"]] for gap in self.gaps]
+
+        sections = {section for section, _ in self.by_section_function}
+        for section in sections:
+            earliest_dependent = len(PHASES)
+            for function in reversed(NIST_FUNCTIONS):
+                ids = self.by_section_function.get((section, function), [])
+                for gap_id in ids:
+                    phases[gap_id] = min(phases[gap_id], earliest_dependent)
+                if ids:
+                    earliest_dependent = min(phases[gap_id] for gap_id in ids)
+        return phases
+
+def build_roadmap(gap_analysis: Dict) -> Dict[str, Any]:
+    """Schedule the gaps of an analysis into a phased roadmap without an LLM"""
+    index = GapIndex(gap_analysis)
+    phase_of = index.schedule()
+    function_order = {function: i for i, function in enumerate(NIST_FUNCTIONS)}
+    severity_order = {severity: i for i, severity in enumerate(SEVERITIES)}
+
+    members: List[List[int]] = [[] for _ in PHASES]
+    for gap_id, phase in enumerate(phase_of):
+        members[phase].append(gap_id)
+
+    phases = []
+    for entry, ids in zip(PHASES, members):
+        if not ids:
+            continue
+        ids.sort(key=lambda i: (function_order[index.gaps[i]["nist_function"]],
+                                severity_order[index.gaps[i]["severity"]], i))
+        gaps = [index.gaps[i] for i in ids]
+        functions = [f for f in NIST_FUNCTIONS if any(gap["nist_function"] == f for gap in gaps)]
+
+        objectives = []
+        for function in functions:
+            in_function = [gap for gap in gaps if gap["nist_function"] == function]
+            high = sum(1 for gap in in_function if gap["severity"] == "High")
+            objectives.append(f"{function}: close {len(in_function)} gaps ({high} high severity)")
+
+        activities = []
+        for gap in gaps:
+            activity = gap["recommendation"] or gap["gap_description"]
+            if activity and activity not in activities:
+                activities.append(activity)
+
+        high_total = sum(1 for gap in gaps if gap["severity"] == "High")
+        metrics = [f"{len(gaps)} scheduled gaps closed"]
+        if high_total:
+            metrics.append(f"All {high_total} high severity gaps remediated and verified")
+
+        phases.append({
+            "phase": entry["phase"],
+            "objectives": objectives,
+            "key_activities": activities,
+            "success_metrics": metrics,
+            "resources_needed": [FUNCTION_RESOURCES[f] for f in functions],
+            "controls": sorted({gap["control"] for gap in gaps if gap["control"]}),
+            "gap_ids": ids
+        })
+
+    return {
+        "roadmap": {
+            "phases": phases,
+            "timeline": "; ".join(f"{p['phase']}: {len(p['gap_ids'])} gaps" for p in phases) or "No gaps to schedule",
+            "success_criteria": [
+                f"All {len(index.by_severity['High'])} high severity gaps closed by the end of Phase 1",
+                f"All {len(index)} identified gaps closed within 6 months"
+            ]
+        },
+        "gaps": index.gaps
+    }
+
+PHASE_DESCRIPTION_FORMAT = {"description": "Two or three sentence description of the phase"}
+
+def polish_descriptions(roadmap: Dict[str, Any], llm_handler: Any, max_tokens: int = 200) -> Dict[str, Any]:
+    """Add an LLM-written description to each phase; the schedule itself is unchanged"""
+    for phase in roadmap.get("roadmap", {}).get("phases", []):
+        prompt = f"""Write a short description of this phase of a cybersecurity policy implementation roadmap.
+
+{phase['phase']}
+Objectives: {'; '.join(phase['objectives'])}
+Key activities: {'; '.join(phase['key_activities'][:10])}"""
+        try:
+            result = llm_handler.generate_structured(prompt, PHASE_DESCRIPTION_FORMAT, max_tokens=max_tokens)
+        except Exception as e:
+            print(f"Could not describe {phase['phase']}: {e}")
+            continue
+        description = result.get("description") if isinstance(result, dict) else None
+        if isinstance(description, str) and description.strip():
+            phase["description"] = description.strip()
+    return roadmap
@@ -0,0 +1,223 @@
+"""Long-lived analysis server that keeps the models loaded between jobs
+
+Jobs are submitted over localhost HTTP and run by a fixed pool of worker
+threads sharing one PolicyGapFixer. The job queue is bounded: when it is
+full, submissions are refused with 503 and a Retry-After header instead of
+piling up.
+
+    POST /jobs          {"policy_name": ..., "policy_text": ...} -> 202 {"job_id": ...}
+    GET  /jobs/<job_id> -> {"status": "queued|running|done|error", ...}
+    GET  /health        -> queue depth and job counts
+    GET  /metrics       -> Prometheus text format metrics
+"""
+import re
+import json
+import queue
+import argparse
+import threading
+import uuid
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional
+from tracing import tracer
+
+DEFAULT_PORT = 8765
+
+# Policy names become output directory names, so no path separators or leading dot
+POLICY_NAME = re.compile(r"^(?!\.)[\w .-]{1,128}$")
+
+class JobQueue:
+    """Bounded job queue with worker threads and a table of recent jobs"""
+
+    def __init__(self, process, workers: int = 2, queue_size: int = 8, keep_finished: int = 1000):
+        self.process = process
+        self.keep_finished = keep_finished
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, policy_name: str, policy_text: str) -> Optional[str]:
+        """Queue a job and return its id, or None when the queue is full"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"job_id": job_id, "policy_name": policy_name, "status": "queued",
+                                  "policy_text": policy_text}
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            return None
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return {k: v for k, v in job.items() if k != "policy_text"} if job else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"queued": self._queue.qsize(), "capacity": self._queue.maxsize,
+                "workers": len(self._threads), "jobs": counts}
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs[job_id]
+                job["status"] = "running"
+                policy_text = job.pop("policy_text")
+            try:
+                result = self.process(policy_text, job["policy_name"], job_id)
+                update = {"status": "done", "result": result}
+            except Exception as e:
+                update = {"status": "error", "error": str(e)}
+            with self._lock:
+                job.update(update)
+                self._evict_finished()
+            self._queue.task_done()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "error")]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def close(self):
+        """Stop the workers after the jobs already queued"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+class PolicyServer(ThreadingHTTPServer):
+    """HTTP server that turns on metrics export while it is open
+
+    /metrics is served, so the metrics that are only kept when exported
+    are recorded; server_close restores the previous setting.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self._exported_metrics = tracer.export_metrics
+        tracer.export_metrics = True
+
+    def server_close(self):
+        super().server_close()
+        tracer.export_metrics = self._exported_metrics
+
+class PolicyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        jobs: JobQueue = self.server.jobs
+        if self.path == "/health":
+            self._send(200, jobs.stats())
+        elif self.path == "/metrics":
+            body = tracer.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith("/jobs/"):
+            job = jobs.get(self.path[len("/jobs/"):])
+            if job is None:
+                self._send(404, {"error": "Unknown job"})
+            else:
+                self._send(200, job)
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            policy_name = str(payload["policy_name"])
+            policy_text = str(payload["policy_text"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": f"Expected policy_name and policy_text: {e}"})
+            return
+        if not POLICY_NAME.match(policy_name):
+            self._send(400, {"error": "policy_name may only contain letters, digits, spaces, '.', '_' and '-', "
+                                      "and may not start with '.'"})
+            return
+
+        job_id = self.server.jobs.submit(policy_name, policy_text)
+        if job_id is None:
+            self._send(503, {"error": "Job queue is full"}, {"Retry-After": str(self.server.retry_after)})
+        else:
+            self._send(202, {"job_id": job_id})
+
+def create_server(process, host: str = "127.0.0.1", port: int = DEFAULT_PORT, workers: int = 2,
+                  queue_size: int = 8, retry_after: int = 5) -> PolicyServer:
+    """HTTP server running process(policy_text, policy_name, job_id) for each submitted job"""
+    server = PolicyServer((host, port), PolicyRequestHandler)
+    server.jobs = JobQueue(process, workers=workers, queue_size=queue_size)
+    server.retry_after = retry_after
+    return server
+
+def main():
+    from main import PolicyGapFixer
+
+    parser = argparse.ArgumentParser(description="Serve policy analysis with models kept loaded")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind (keep it local)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--jobs", type=int, default=2, help="Policies processed concurrently")
+    parser.add_argument("--queue-size", type=int, default=8, help="Queued jobs before submissions are refused")
+    parser.add_argument("--workers", type=int, default=1, help="Sections analyzed concurrently per policy")
+    parser.add_argument("--backend", choices=["http", "subprocess", "llama_cpp"], default="http")
+    parser.add_argument("--model-path", help="GGUF model file for the llama_cpp backend")
+    parser.add_argument("--threads", type=int, help="CPU threads for the llama_cpp backend")
+    parser.add_argument("--max-concurrency", type=int, default=4,
+                        help="LLM requests in flight at once across all jobs")
+    parser.add_argument("--tokenizer", help="Hugging Face tokenizer of the LLM for exact prompt budgets")
+    parser.add_argument("--trace", help="Append timing spans to this JSONL file")
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.configure(args.trace)
+
+    fixer = PolicyGapFixer(max_workers=args.workers, backend=args.backend,
+                           model_path=args.model_path, n_threads=args.threads,
+                           max_concurrent=args.max_concurrency, tokenizer=args.tokenizer)
+    print("Loading models...")
+    fixer.warm_up()
+
+    server = create_server(fixer.process_policy, args.host, args.port, workers=args.jobs,
+                           queue_size=args.queue_size)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} "
+          f"({args.jobs} concurrent jobs, queue of {args.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+        server.jobs.close()
+
+if __name__ == "__main__":
+    main()
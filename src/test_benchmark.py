@@ -0,0 +1,63 @@
+import json
+import unittest
+from benchmark import StubBackend, synthetic_policy, run_benchmark
+from gap_analyzer import GapAnalyzer, SECTION_SCHEMA
+
+class TestStubBackend(unittest.TestCase):
+    
+    def test_deterministic_schema_instances(self):
+        backend = StubBackend(latency=0, token_rate=1e6)
+        first = backend.generate("prompt", {}, SECTION_SCHEMA)
+        self.assertEqual(first, "".join(backend.stream("prompt", {}, SECTION_SCHEMA)))
+        gaps = json.loads(first)["gaps"]
+        self.assertEqual(len(gaps), 2)
+        self.assertIn(gaps[0]["severity"], ["High", "Medium", "Low"])
+        self.assertNotEqual(first, backend.generate("other prompt", {}, SECTION_SCHEMA))
+
+class TestBenchmark(unittest.TestCase):
+    
+    def test_synthetic_policy_sections(self):
+        sections = GapAnalyzer.extract_policy_sections(synthetic_policy(1, sections=5, sentences_per_section=2))
+        self.assertEqual(len(sections), 6)
+    
+    def test_reports_every_stage(self):
+        results = run_benchmark(policies=2, section_counts=[2, 3], standards_docs=2, standards_sentences=20,
+                                latency=0, token_rate=1e6, workers=2)
+        stages = results["stages"]
+        self.assertEqual(list(stages), ["extraction", "index_build", "sections", "embedding", "retrieval",
+                                        "analysis", "revision", "roadmap"])
+        self.assertEqual(stages["extraction"]["pages"], 4)
+        # The two metadata-only "Header" sections are trivial and skip the LLM
+        analysis = stages["analysis"]
+        self.assertEqual(analysis["sections"], 7)
+        self.assertEqual(analysis["trivial"], 2)
+        self.assertEqual(analysis["llm_calls"], 7 - 2 - analysis["covered"])
+        for stats in stages.values():
+            self.assertLessEqual(stats["p50_ms"], stats["p95_ms"])
+            self.assertGreater(stats["peak_rss_mb"], 0)
+    
+    def test_calibration_separates_restated_chunks(self):
+        """Restated chunks score above the recommended threshold, synthetic sections below"""
+        results = run_benchmark(policies=1, section_counts=[2], standards_docs=4, standards_sentences=40,
+                                latency=0, token_rate=1e6, workers=1)
+        calibration = results["prescreen_calibration"]
+        recommended = calibration["recommended_covered_similarity"]
+        self.assertIsNotNone(recommended)
+        row = next(row for row in calibration["sweep"] if row["threshold"] == recommended)
+        self.assertGreaterEqual(row["precision"], calibration["target_precision"])
+        self.assertEqual(results["config"]["covered_similarity"], recommended)
+    
+    def test_coverage_calibration_sweeps_thresholds(self):
+        """Synthetic standards state controls, and the sweep recommends a threshold meeting the target precision"""
+        results = run_benchmark(policies=1, section_counts=[2], standards_docs=4, standards_sentences=40,
+                                latency=0, token_rate=1e6, workers=1)
+        calibration = results["coverage_calibration"]
+        self.assertGreater(calibration["controls"], 0)
+        recommended = calibration["recommended_coverage_threshold"]
+        self.assertIsNotNone(recommended)
+        row = next(row for row in calibration["sweep"] if row["threshold"] == recommended)
+        self.assertGreaterEqual(row["precision"], calibration["target_precision"])
+        self.assertTrue(all(0 <= row["recall"] <= 1 for row in calibration["sweep"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import tempfile
+import unittest
+import numpy as np
+from csf import find_controls, function_of, tag_chunk, ControlIndex
+
+CHUNKS = [
+    {"text": "PR.AA-01: Identities and credentials are managed. PR.AA-03: Users are authenticated."},
+    {"text": "Introductory text without control identifiers."},
+    {"text": "PR.AA-1 again, then RC.RP-01: The recovery plan is executed."}
+]
+
+class TestCSF(unittest.TestCase):
+    
+    def test_find_and_tag_controls(self):
+        """IDs from CSF 1.1 and 2.0 are normalized to two digits"""
+        self.assertEqual(find_controls("See PR.AC-1, GV.OC-01 and PR.AC-01"), ["PR.AC-01", "GV.OC-01"])
+        self.assertEqual(function_of("GV.OC-01"), "Govern")
+        chunk = tag_chunk(dict(CHUNKS[2]))
+        self.assertEqual(chunk["csf_subcategories"], "PR.AA-01;RC.RP-01")
+        self.assertEqual(chunk["csf_categories"], "PR.AA;RC.RP")
+        self.assertEqual(chunk["csf_functions"], "Protect;Recover")
+        self.assertEqual(tag_chunk({"text": "none"})["csf_subcategories"], "")
+    
+    def test_index_build_and_round_trip(self):
+        index = ControlIndex.build(CHUNKS)
+        self.assertEqual(index.controls, ["PR.AA-01", "PR.AA-03", "RC.RP-01"])
+        self.assertEqual(index.chunk_ids["PR.AA-01"], [0, 2])
+        self.assertEqual(index.descriptions["PR.AA-01"], "Identities and credentials are managed.")
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(ControlIndex.load(tmp))
+            index.save(tmp)
+            loaded = ControlIndex.load(tmp)
+        self.assertEqual(loaded.chunk_ids, index.chunk_ids)
+        self.assertEqual(loaded.categories, {"PR.AA": ["PR.AA-01", "PR.AA-03"], "RC.RP": ["RC.RP-01"]})
+    
+    def test_coverage_matches_brute_force(self):
+        """Each entry is the best similarity over the control's chunks"""
+        rng = np.random.default_rng(0)
+        kb = rng.normal(size=(3, 8)).astype('float32')
+        kb /= np.linalg.norm(kb, axis=1, keepdims=True)
+        sections = np.vstack([kb[0], kb[1], -kb[2]])
+        index = ControlIndex.build(CHUNKS)
+        coverage = index.coverage(sections, kb, threshold=0.9)
+        
+        expected = []
+        for row in range(len(sections)):
+            for column, control in enumerate(index.controls):
+                score = max(float(sections[row] @ kb[i]) for i in index.chunk_ids[control])
+                if score >= 0.9:
+                    expected.append([row, column])
+        self.assertEqual([entry[:2] for entry in coverage["entries"]], expected)
+        self.assertEqual(sorted(expected), [[0, 0], [0, 1]])
+    
+    def test_uncovered_scope(self):
+        """By default only controls in partly covered categories are reported"""
+        index = ControlIndex.build(CHUNKS)
+        coverage = {"controls": index.controls, "entries": [[0, 0, 0.8]]}
+        self.assertEqual(index.uncovered(coverage), ["PR.AA-03"])
+        self.assertEqual(index.uncovered(coverage, "all"), ["PR.AA-03", "RC.RP-01"])
+        gap = index.gap("PR.AA-03")
+        self.assertEqual((gap["control"], gap["nist_function"]), ("PR.AA-03", "Protect"))
+        self.assertIn("Users are authenticated.", gap["gap_description"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from data_preparation import PDFExtractor
+from tokenization import TokenCounter
+from benchmark import write_pdf
+
+class RecordingExecutor(ThreadPoolExecutor):
+    """Thread pool that records how many tasks were submitted"""
+    submitted = 0
+    
+    def submit(self, *args, **kwargs):
+        RecordingExecutor.submitted += 1
+        return super().submit(*args, **kwargs)
+
+class TestChunking(unittest.TestCase):
+    
+    def setUp(self):
+        self.extractor = PDFExtractor("unused.pdf", token_counter=TokenCounter())
+    
+    def test_long_sentence_is_split(self):
+        """No chunk exceeds chunk_size even when one sentence does"""
+        text = " ".join(f"word{i}" for i in range(50)) + ". Short sentence."
+        chunks = self.extractor.chunk_text(text, chunk_size=12)
+        self.assertTrue(all(chunk['token_count'] <= 12 for chunk in chunks))
+        self.assertEqual(" ".join(c['text'] for c in chunks).split(), text.split())
+    
+    def test_overlap_repeats_trailing_sentences(self):
+        """Consecutive chunks share trailing sentences up to the overlap"""
+        text = "Alpha one. Beta two. Gamma three. Delta four. Epsilon five."
+        chunks = self.extractor.chunk_text(text, chunk_size=9, overlap=3)
+        self.assertEqual([c['text'] for c in chunks], [
+            "Alpha one. Beta two. Gamma three.",
+            "Gamma three. Delta four. Epsilon five."
+        ])
+        self.assertEqual([c['token_count'] for c in chunks], [9, 9])
+    
+    def test_word_counts_without_tokenizer(self):
+        """Without a counter chunks are sized in words and carry no token_count"""
+        chunks = PDFExtractor("unused.pdf").chunk_text("One two. Three four.", chunk_size=2)
+        self.assertEqual([c['text'] for c in chunks], ["One two.", "Three four."])
+        self.assertNotIn('token_count', chunks[0])
+
+class TestPDFStreaming(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "doc.pdf")
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_page_provenance(self):
+        """Chunks record the pages they span, including sentences crossing a page break"""
+        write_pdf(self.path, ["First page. It continues", "onto page two. Done.", "", "Last."])
+        chunks = list(PDFExtractor(self.path, max_workers=1).iter_chunks(chunk_size=5))
+        self.assertEqual([(c['text'], c['page_start'], c['page_end']) for c in chunks], [
+            ("First page.", 1, 1),
+            ("It continues\nonto page two.", 1, 2),
+            ("Done. Last.", 2, 4)
+        ])
+    
+    def test_empty_pdf_has_no_chunks(self):
+        write_pdf(self.path, [])
+        self.assertEqual(list(PDFExtractor(self.path, max_workers=1).iter_chunks()), [])
+        write_pdf(self.path, ["", ""])
+        self.assertEqual(list(PDFExtractor(self.path, max_workers=1).iter_chunks()), [])
+    
+    def test_process_pool_keeps_page_order(self):
+        pages = [f"Page {i} text." for i in range(1, 8)]
+        write_pdf(self.path, pages)
+        extractor = PDFExtractor(self.path, max_workers=2, pages_per_task=2)
+        self.assertEqual(list(extractor.iter_pages()), list(enumerate(pages, 1)))
+    
+    def test_in_flight_ranges_are_bounded(self):
+        """Only max_workers * 2 page ranges are submitted before the first is consumed"""
+        write_pdf(self.path, [f"Page {i}." for i in range(1, 21)])
+        extractor = PDFExtractor(self.path, max_workers=2, pages_per_task=1)
+        RecordingExecutor.submitted = 0
+        with mock.patch("data_preparation.ProcessPoolExecutor", RecordingExecutor):
+            pages = extractor.iter_pages()
+            self.assertEqual(next(pages), (1, "Page 1."))
+            self.assertEqual(RecordingExecutor.submitted, 4)
+            self.assertEqual(len(list(pages)), 19)
+        self.assertEqual(RecordingExecutor.submitted, 20)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from embedding_system import ChunkStore, VectorStore, INDEX_TYPES, is_normalized
+from embedding_cache import EmbeddingCache
+
+class TestChunkStore(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_round_trip(self):
+        """Chunks written in columnar form read back unchanged"""
+        chunks = [
+            {'text': 'Identify assets.', 'chunk_id': 0},
+            {'text': 'Protect données — unicode.', 'chunk_id': 1},
+            {'text': '', 'chunk_id': 2}
+        ]
+        fields = ChunkStore.write(self.tmp.name, chunks)
+        self.assertEqual(fields, {'text': 'str', 'chunk_id': 'int'})
+        
+        store = ChunkStore(self.tmp.name, fields, len(chunks))
+        self.assertEqual(len(store), 3)
+        self.assertEqual(list(store), chunks)
+        self.assertEqual(store[-2], chunks[1])
+        self.assertEqual(store.text(1), 'Protect données — unicode.')
+        with self.assertRaises(IndexError):
+            store[3]
+    
+    def test_keys_missing_from_the_first_chunk(self):
+        """A key that first appears in a later chunk still gets a column"""
+        chunks = [
+            {'text': 'Identify assets.'},
+            {'text': 'PR.AA-01 Identities are managed.', 'csf_subcategories': 'PR.AA-01'}
+        ]
+        fields = ChunkStore.write(self.tmp.name, chunks)
+        self.assertEqual(fields, {'text': 'str', 'csf_subcategories': 'str'})
+        store = ChunkStore(self.tmp.name, fields, len(chunks))
+        self.assertEqual(store[0]['csf_subcategories'], '')
+        self.assertEqual(store[1]['csf_subcategories'], 'PR.AA-01')
+
+class TestIndexTypes(unittest.TestCase):
+    
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.standard_normal((300, 32)).astype('float32')
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+    
+    def build(self, index_type, **kwargs):
+        store = VectorStore(index_type=index_type, pq_m=8, **kwargs)
+        store.embeddings = self.embeddings
+        store.index = store._build_index(self.embeddings)
+        return store
+    
+    def test_every_index_type_searches(self):
+        """Each index type returns k neighbours per query and a recall in [0, 1]"""
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                store = self.build(index_type, nlist=16, nprobe=16)
+                self.assertEqual(store.index.ntotal, len(self.embeddings))
+                distances, indices = store.index.search(self.embeddings[:5], 3)
+                self.assertEqual(indices.shape, (5, 3))
+                self.assertTrue((indices >= 0).all())
+                report = store.recall_at_k(k=5, num_queries=20)
+                self.assertGreaterEqual(report["recall"], 0.0)
+                self.assertLessEqual(report["recall"], 1.0)
+                if index_type == "flat":
+                    self.assertEqual(report["recall"], 1.0)
+    
+    def test_nlist_is_clamped_to_the_corpus(self):
+        store = self.build("ivf_flat", nlist=1000)
+        self.assertEqual(store.index.nlist, len(self.embeddings))
+    
+    def test_search_params_reach_the_index(self):
+        import faiss
+        store = self.build("ivf_pq", nlist=8)
+        store.set_search_params(nprobe=3)
+        self.assertEqual(faiss.extract_index_ivf(store.index).nprobe, 3)
+        store = self.build("hnsw")
+        store.set_search_params(ef_search=17)
+        self.assertEqual(store.index.hnsw.efSearch, 17)
+    
+    def test_pq_m_must_divide_the_dimension(self):
+        with self.assertRaises(ValueError):
+            VectorStore(index_type="ivf_pq", pq_m=7)._build_index(self.embeddings)
+    
+    def test_unknown_index_type(self):
+        with self.assertRaises(ValueError):
+            VectorStore(index_type="lsh")
+
+class ScaledEncoder:
+    """Encoder returning vectors of arbitrary length"""
+    
+    def encode(self, texts, batch_size=32, show_progress_bar=False):
+        return np.array([[len(text), 1.0, 0.0, 2.0] for text in texts], dtype='float32') * 3
+
+class TestNormalization(unittest.TestCase):
+    
+    def test_corpus_and_queries_are_normalized(self):
+        """Distances convert to cosine similarities whatever the encoder's scale"""
+        store = VectorStore(embedding_cache=EmbeddingCache(max_entries=10))
+        store.model = ScaledEncoder()
+        store.create_embeddings([{'text': 'short'}, {'text': 'a longer chunk'}])
+        self.assertTrue(is_normalized(store.embeddings))
+        self.assertTrue(is_normalized(store.encode_queries(["short", "query"])))
+        self.assertAlmostEqual(store.search("short", k=1)[0]['score'], 0.0, places=5)
+        self.assertFalse(is_normalized(ScaledEncoder().encode(["x"])))
+    
+    def test_compact_format_keeps_flags(self):
+        """The manifest records normalization and which counter produced token_count"""
+        store = VectorStore(embedding_cache=EmbeddingCache(max_entries=10))
+        store.model = ScaledEncoder()
+        store.create_embeddings([{'text': 'short', 'token_count': 1}, {'text': 'a longer chunk', 'token_count': 3}])
+        store.token_counter = "estimate"
+        with tempfile.TemporaryDirectory() as kb_dir:
+            store.save_compact(kb_dir)
+            loaded = VectorStore()
+            loaded.load_compact(kb_dir)
+            self.assertTrue(loaded.normalized)
+            self.assertEqual(loaded.token_counter, "estimate")
+            self.assertEqual(loaded.chunks[1]['token_count'], 3)
+
+class TestEmbeddingCache(unittest.TestCase):
+    
+    def test_normalized_lookup_and_stats(self):
+        """Whitespace differences hit the same entry and are counted"""
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("Purpose:  protect\n data", np.ones(4))
+        self.assertIsNotNone(cache.get("Purpose: protect data"))
+        self.assertIsNone(cache.get("Scope"))
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+    
+    def test_lru_eviction(self):
+        """The least recently used embedding is evicted first"""
+        cache = EmbeddingCache(max_entries=2)
+        cache.put("a", np.zeros(2))
+        cache.put("b", np.zeros(2))
+        cache.get("a")
+        cache.put("c", np.zeros(2))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+    
+    def test_persistent_backing_store(self):
+        """Embeddings survive a new cache instance on the same file"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "embeddings.sqlite")
+            cache = EmbeddingCache(path=path, namespace="model")
+            cache.put("Enforcement", np.arange(3, dtype='float32'))
+            cache.close()
+            
+            reopened = EmbeddingCache(path=path, namespace="model")
+            np.testing.assert_array_equal(reopened.get("Enforcement"), np.arange(3, dtype='float32'))
+            self.assertIsNone(EmbeddingCache(path=path, namespace="other").get("Enforcement"))
+            reopened.close()
+
+if __name__ == "__main__":
+    unittest.main()
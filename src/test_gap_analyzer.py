@@ -0,0 +1,199 @@
+import threading
+import unittest
+from gap_analyzer import GapAnalyzer
+from prompt_builder import PromptBuilder
+import numpy as np
+from prescreen import PreScreener
+from csf import ControlIndex
+from tokenization import TokenCounter
+
+class FakeVectorStore:
+    def __init__(self):
+        self.batch_calls = 0
+    
+    def search(self, query, k=5):
+        return [{'chunk': {'text': f"standard for {query[:20]}"}, 'score': 0.5}]
+    
+    def search_batch(self, queries, k=5):
+        self.batch_calls += 1
+        return [self.search(query, k) for query in queries]
+
+class FakeLLM:
+    """Returns one gap per section and records which sections were sent"""
+    
+    def __init__(self, fail_on=None):
+        self.sections = []
+        self.prompts = []
+        self.fail_on = fail_on
+        self.token_counter = TokenCounter()
+    
+    def prompt_builder(self, output_format=None, max_tokens=800, preamble=""):
+        return PromptBuilder(context_window=150, reserve_tokens=50)
+    
+    def generate_structured(self, prompt, output_format, preamble="", schema=None):
+        section = prompt.split("\n")[0].replace("Policy Section Title: ", "")
+        self.sections.append(section)
+        self.prompts.append(prompt)
+        if section == self.fail_on:
+            raise RuntimeError("backend exploded")
+        return {"section": section, "gaps": [{"gap_description": f"gap in {section}", "severity": "High"}]}
+
+class BarrierLLM(FakeLLM):
+    """Each call waits until `parties` calls are in flight at once"""
+    
+    def __init__(self, parties):
+        super().__init__()
+        self.barrier = threading.Barrier(parties, timeout=5)
+    
+    def generate_structured(self, prompt, output_format, preamble="", schema=None):
+        self.barrier.wait()
+        return super().generate_structured(prompt, output_format, preamble, schema)
+
+POLICY = """Intro line
+## Purpose
+Protect data.
+## Scope
+All staff.
+## Enforcement
+Violations are reported."""
+
+class TestGapAnalyzer(unittest.TestCase):
+    
+    def test_concurrent_results_keep_section_order(self):
+        """All four sections are analyzed at once, and results come back in document order"""
+        store = FakeVectorStore()
+        # A serial run would break the barrier and turn every section into an error
+        analyzer = GapAnalyzer(store, BarrierLLM(4), max_workers=4)
+        result = analyzer.analyze_gaps(POLICY)
+        names = [item["section"] for item in result["policy_analysis"]]
+        self.assertEqual(names, ["Header", "Purpose", "Scope", "Enforcement"])
+        self.assertFalse(any("error" in item for item in result["policy_analysis"]))
+        self.assertEqual(result["summary"]["total_gaps"], 4)
+        self.assertEqual(store.batch_calls, 1)
+    
+    def test_section_failure_is_isolated(self):
+        """A failing section becomes an error entry, others still succeed"""
+        analyzer = GapAnalyzer(FakeVectorStore(), FakeLLM(fail_on="Scope"), max_workers=2)
+        result = analyzer.analyze_gaps(POLICY)
+        by_name = {item["section"]: item for item in result["policy_analysis"]}
+        self.assertIn("error", by_name["Scope"])
+        self.assertEqual(result["summary"]["total_gaps"], 3)
+    
+    def test_incremental_reanalyzes_only_changed_sections(self):
+        """Unchanged sections are reused from the previous result"""
+        first = GapAnalyzer(FakeVectorStore(), FakeLLM()).analyze_gaps(POLICY)
+        
+        llm = FakeLLM()
+        edited = POLICY.replace("All staff.", "All staff and contractors.") + "\n## Review\nAnnually."
+        result = GapAnalyzer(FakeVectorStore(), llm).analyze_gaps(edited, previous_result=first)
+        
+        self.assertEqual(sorted(llm.sections), ["Review", "Scope"])
+        self.assertEqual(result["incremental"], {"reused_sections": 3, "analyzed_sections": 2})
+        self.assertEqual(result["summary"]["total_gaps"], 5)
+
+    def test_batch_uses_one_search_for_all_policies(self):
+        """Sections from every policy share a single batched search"""
+        store = FakeVectorStore()
+        analyzer = GapAnalyzer(store, FakeLLM(), max_workers=3)
+        results = analyzer.analyze_batch({"a": POLICY, "b": "## Access\nUse MFA."})
+        
+        self.assertEqual(store.batch_calls, 1)
+        self.assertEqual(results["a"]["summary"]["total_gaps"], 4)
+        self.assertEqual([item["section"] for item in results["b"]["policy_analysis"]], ["Access"])
+
+    def test_prescreen_sends_only_needs_review_sections(self):
+        """Trivial sections skip retrieval and covered ones skip the LLM"""
+        store = FakeVectorStore()
+        llm = FakeLLM()
+        policy = ("Version: 2.1 Owner: CISO\n## Revision History\nv1 rewritten for the new audit cycle entirely.\n"
+                  "## Access\nAdministrators review privileged accounts every quarter and revoke stale access.")
+        analyzer = GapAnalyzer(store, llm, prescreen=PreScreener(covered_similarity=0.9))
+        result = analyzer.analyze_gaps(policy)
+        
+        self.assertEqual(llm.sections, ["Access"])
+        self.assertEqual(result["prescreen"], {"covered": 0, "trivial": 2, "needs_review": 1})
+        statuses = [item["prescreen"]["status"] for item in result["policy_analysis"]]
+        self.assertEqual(statuses, ["trivial", "trivial", "needs_review"])
+        
+        llm = FakeLLM()
+        # FakeVectorStore scores 0.5, a cosine similarity of 0.75
+        result = GapAnalyzer(store, llm, prescreen=PreScreener(covered_similarity=0.7)).analyze_gaps(policy)
+        self.assertEqual(llm.sections, [])
+        self.assertEqual(result["prescreen"]["covered"], 1)
+        self.assertEqual(result["summary"]["total_gaps"], 0)
+    
+    def test_prescreen_counts_only_this_run(self):
+        """Sections reused from a previous run are not counted as sent to the LLM"""
+        first = GapAnalyzer(FakeVectorStore(), FakeLLM(), prescreen=PreScreener()).analyze_gaps(POLICY)
+        self.assertEqual(first["prescreen"]["needs_review"], 4)
+        
+        llm = FakeLLM()
+        edited = POLICY.replace("All staff.", "All staff and contractors.")
+        result = GapAnalyzer(FakeVectorStore(), llm, prescreen=PreScreener()).analyze_gaps(edited, previous_result=first)
+        self.assertEqual(llm.sections, ["Scope"])
+        self.assertEqual(result["prescreen"], {"covered": 0, "trivial": 0, "needs_review": 1})
+        self.assertEqual(result["incremental"]["reused_sections"], 3)
+    
+    def test_similarity_thresholds_require_normalized_embeddings(self):
+        """Pre-screening and control coverage refuse an index of raw distances"""
+        store = FakeVectorStore()
+        store.normalized = False
+        with self.assertRaises(ValueError):
+            GapAnalyzer(store, FakeLLM(), prescreen=PreScreener())
+        with self.assertRaises(ValueError):
+            GapAnalyzer(store, FakeLLM(), controls=ControlIndex.build([{"text": "PR.AA-01: Identities."}]))
+        GapAnalyzer(store, FakeLLM())
+    
+    def test_uncovered_controls_become_gaps(self):
+        """Controls in a covered category that no section matches are reported without the LLM"""
+        chunks = [{"text": "PR.AA-01: Identities are managed."}, {"text": "PR.AA-03: Users are authenticated."},
+                  {"text": "RC.RP-01: The recovery plan is executed."}]
+        
+        class EmbeddingStore(FakeVectorStore):
+            embeddings = np.eye(3, dtype='float32')
+            
+            def encode_queries(self, queries):
+                # "Access" sections match the PR.AA-01 chunk only
+                return np.vstack([np.eye(3, dtype='float32')[0] if "identit" in q.lower() else np.zeros(3, 'float32')
+                                  for q in queries])
+        
+        llm = FakeLLM()
+        analyzer = GapAnalyzer(EmbeddingStore(), llm, controls=ControlIndex.build(chunks))
+        result = analyzer.analyze_gaps("## Access\nUser identities are issued by IT.")
+        
+        self.assertEqual(llm.sections, ["Access"])
+        self.assertEqual(result["policy_analysis"][0]["controls"], ["PR.AA-01"])
+        coverage_entry = result["policy_analysis"][-1]
+        self.assertEqual(coverage_entry["section"], "Control coverage")
+        self.assertEqual([gap["control"] for gap in coverage_entry["gaps"]], ["PR.AA-03"])
+        self.assertEqual(coverage_entry["gaps"][0]["severity"], "Low")
+        self.assertEqual(result["coverage"]["uncovered"], ["PR.AA-03"])
+        # Threshold-based coverage gaps are counted apart from the LLM's
+        self.assertEqual(result["summary"], {"total_gaps": 1, "high_priority_gaps": 1, "coverage_gaps": 1})
+    
+    def test_over_budget_prompt_keeps_instructions(self):
+        """Standards are dropped before instructions or section text"""
+        llm = FakeLLM()
+        analyzer = GapAnalyzer(FakeVectorStore(), llm)
+        long_section = "## Access\n" + "Users must authenticate. " * 30
+        result = analyzer.analyze_gaps(long_section)
+        
+        packing = result["policy_analysis"][0]["prompt_packing"]
+        self.assertIn("section", packing["truncated"])
+        self.assertIn("standard_1", packing["dropped"])
+        self.assertTrue(llm.prompts[0].startswith("Policy Section Title: Access"))
+
+    def test_stored_token_counts_need_the_same_counter(self):
+        """A chunk's token_count is trusted only when it came from the LLM handler's counter"""
+        store = FakeVectorStore()
+        analyzer = GapAnalyzer(store, FakeLLM())
+        standard = {'text': "Standard text. " * 40, 'token_count': 1}
+        packed = analyzer.build_section_prompt("Access", "Users log in.", [standard], {})
+        self.assertEqual(packed['dropped'] + packed['truncated'], ["standard_1"])
+        
+        store.token_counter = "estimate"
+        packed = analyzer.build_section_prompt("Access", "Users log in.", [standard], {})
+        self.assertIn("standard_1", packed['included'])
+
+if __name__ == "__main__":
+    unittest.main()
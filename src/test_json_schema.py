@@ -0,0 +1,25 @@
+import unittest
+from json_schema import schema_from_example
+from gap_analyzer import SECTION_SCHEMA
+
+class TestSchemaFromExample(unittest.TestCase):
+    
+    def test_nested_format(self):
+        """Dicts require every key and lists take their first item's schema"""
+        schema = schema_from_example({"phases": [{"phase": "Phase 1", "weeks": 4}], "final": True})
+        self.assertEqual(schema["required"], ["phases", "final"])
+        self.assertFalse(schema["additionalProperties"])
+        item = schema["properties"]["phases"]["items"]
+        self.assertEqual(item["properties"]["phase"], {"type": "string"})
+        self.assertEqual(item["properties"]["weeks"], {"type": "integer"})
+        self.assertEqual(schema["properties"]["final"], {"type": "boolean"})
+    
+    def test_enums_apply_at_any_depth(self):
+        """Enum constraints replace the placeholder text of matching keys"""
+        gap = SECTION_SCHEMA["properties"]["gaps"]["items"]
+        self.assertEqual(gap["properties"]["severity"]["enum"], ["High", "Medium", "Low"])
+        self.assertIn("Recover", gap["properties"]["nist_function"]["enum"])
+        self.assertEqual(SECTION_SCHEMA["properties"]["section"], {"type": "string"})
+
+if __name__ == "__main__":
+    unittest.main()
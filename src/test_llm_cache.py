@@ -0,0 +1,106 @@
+import unittest
+import os
+import tempfile
+from unittest import mock
+from llm_cache import LLMResponseCache, default_cache_path
+from llm_handler import LocalLLMHandler
+from llm_backends import LLMBackend
+
+class CountingBackend(LLMBackend):
+    """Backend that counts calls instead of talking to a model"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def generate(self, prompt, options, json_schema=None):
+        self.calls += 1
+        return f"response {self.calls} for: {prompt}"
+
+class GGUFBackend(CountingBackend):
+    def __init__(self, model_path):
+        super().__init__()
+        self.model_path = model_path
+    
+    @property
+    def key(self):
+        return f"llama_cpp:{self.model_path}"
+
+class TestLLMResponseCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "cache.sqlite")
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_key_depends_on_all_inputs(self):
+        """Model, backend, prompt and options all change the key"""
+        base = LLMResponseCache.make_key("m", "p", {"temperature": 0.1})
+        self.assertEqual(base, LLMResponseCache.make_key("m", "p", {"temperature": 0.1}))
+        self.assertNotEqual(base, LLMResponseCache.make_key("m2", "p", {"temperature": 0.1}))
+        self.assertNotEqual(base, LLMResponseCache.make_key("m", "p2", {"temperature": 0.1}))
+        self.assertNotEqual(base, LLMResponseCache.make_key("m", "p", {"temperature": 0.2}))
+        self.assertNotEqual(base, LLMResponseCache.make_key("m", "p", {"temperature": 0.1}, backend="llama_cpp:a.gguf"))
+    
+    def test_lru_eviction(self):
+        """Least recently used entries are evicted first"""
+        cache = LLMResponseCache(self.path, max_entries=2)
+        cache.put("a", "m", "first")
+        cache.put("b", "m", "second")
+        cache.get("a")
+        cache.put("c", "m", "third")
+        self.assertEqual(cache.get("a"), "first")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+        cache.close()
+    
+    def test_persists_across_instances(self):
+        """Entries survive reopening the cache file"""
+        cache = LLMResponseCache(self.path)
+        cache.put("k", "m", "stored")
+        cache.close()
+        reopened = LLMResponseCache(self.path)
+        self.assertEqual(reopened.get("k"), "stored")
+        self.assertEqual(reopened.stats()["hits"], 1)
+        reopened.close()
+    
+    def test_default_path_is_outside_the_source_tree(self):
+        """The default cache lives in the user cache directory, overridable by environment"""
+        with mock.patch.dict(os.environ, {"POLICYGAPFIXER_CACHE_DIR": self.tmp.name}):
+            self.assertEqual(default_cache_path(), os.path.join(self.tmp.name, "llm_responses.sqlite"))
+            cache = LLMResponseCache()
+            self.assertEqual(cache.path, default_cache_path())
+            cache.close()
+        with mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp.name}):
+            os.environ.pop("POLICYGAPFIXER_CACHE_DIR", None)
+            self.assertEqual(default_cache_path(), os.path.join(self.tmp.name, "policygapfixer", "llm_responses.sqlite"))
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.assertFalse(default_cache_path().startswith(repo))
+    
+    def test_handler_skips_model_on_hit(self):
+        """Repeated prompts are served from the cache unless bypassed"""
+        backend = CountingBackend()
+        handler = LocalLLMHandler(cache=LLMResponseCache(self.path), backend=backend)
+        first = handler.generate_with_retry("same prompt")
+        second = handler.generate_with_retry("same prompt")
+        self.assertEqual(first, second)
+        self.assertEqual(backend.calls, 1)
+        
+        handler.bypass_cache = True
+        handler.generate_with_retry("same prompt")
+        self.assertEqual(backend.calls, 2)
+        self.assertEqual(handler.cache.stats()["misses"], 1)
+        handler.cache.close()
+    
+    def test_backends_do_not_share_entries(self):
+        """A GGUF model is not served responses cached from another backend or file"""
+        cache = LLMResponseCache(self.path)
+        backends = [CountingBackend(), GGUFBackend("a.gguf"), GGUFBackend("b.gguf"), GGUFBackend("a.gguf")]
+        for backend in backends:
+            LocalLLMHandler(cache=cache, backend=backend).generate_with_retry("same prompt")
+        self.assertEqual([backend.calls for backend in backends], [1, 1, 1, 0])
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from llm_handler import JSONObjectTracker, LocalLLMHandler
+from llm_backends import LLMBackend
+from resilience import PromptTooLongError
+
+class RecordingBackend(LLMBackend):
+    def __init__(self):
+        self.prompts = []
+    
+    def generate(self, prompt, options, json_schema=None):
+        self.prompts.append(prompt)
+        return '{"gaps": []}'
+
+class TestJSONObjectTracker(unittest.TestCase):
+    
+    def feed_in_chunks(self, text, size):
+        tracker = JSONObjectTracker()
+        for i in range(0, len(text), size):
+            end = tracker.feed(text[i:i + size])
+            if end >= 0:
+                return end
+        return -1
+    
+    def test_stops_at_top_level_close(self):
+        """The end offset lands just past the outermost closing brace"""
+        text = 'Sure! {"gaps": [{"severity": "High"}]} Let me know if...'
+        for size in (1, 3, 7, len(text)):
+            end = self.feed_in_chunks(text, size)
+            self.assertEqual(text[:end], 'Sure! {"gaps": [{"severity": "High"}]}')
+    
+    def test_braces_inside_strings_are_ignored(self):
+        """Braces and escaped quotes inside strings do not close the object"""
+        text = '{"a": "}{ \\" }", "b": 1} tail'
+        end = self.feed_in_chunks(text, 2)
+        self.assertEqual(text[:end], '{"a": "}{ \\" }", "b": 1}')
+    
+    def test_incomplete_object(self):
+        """No end is reported until the object closes"""
+        self.assertEqual(self.feed_in_chunks('{"a": {"b": 1}', 4), -1)
+
+class ChunkedBackend(LLMBackend):
+    """Streams fixed chunks and records how many were consumed and whether the stream was closed"""
+    name = "chunked"
+    supports_streaming = True
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+    
+    def stream(self, prompt, options, json_schema=None):
+        try:
+            for chunk in self.chunks:
+                self.consumed += 1
+                yield chunk
+        finally:
+            self.closed = True
+
+class TestStreaming(unittest.TestCase):
+    
+    def test_stream_stops_after_the_json_object(self):
+        """Tokens after the closing brace are never pulled, and the backend stream is closed"""
+        backend = ChunkedBackend(['Sure: {"gaps": ', '[{"a": "}"}', ']}', ' trailing', ' text'])
+        handler = LocalLLMHandler(backend=backend, use_cache=False)
+        seen = []
+        response = handler.generate_stream("prompt", on_token=seen.append, stop_at_json_end=True)
+        
+        self.assertEqual(response, 'Sure: {"gaps": [{"a": "}"}]}')
+        self.assertEqual(backend.consumed, 3)
+        self.assertTrue(backend.closed)
+        self.assertEqual(seen, backend.chunks[:3])
+
+class TestPromptBudget(unittest.TestCase):
+    
+    def test_over_long_prompt_is_refused_not_cut(self):
+        """A prompt that does not fit never reaches the backend, and structured calls report it"""
+        backend = RecordingBackend()
+        handler = LocalLLMHandler(backend=backend, use_cache=False, context_window=100)
+        handler.stream = False
+        with self.assertRaises(PromptTooLongError):
+            handler.generate_direct("word " * 200, max_tokens=50)
+        result = handler.generate_structured("word " * 200, {"gaps": []}, max_tokens=50)
+        self.assertEqual(result["error_type"], "prompt_too_long")
+        self.assertEqual(backend.prompts, [])
+        
+        self.assertEqual(handler.generate_direct("short prompt", max_tokens=50), '{"gaps": []}')
+    
+    def test_estimated_counts_hold_back_a_margin(self):
+        """Without a tokenizer a share of the window is reserved; an explicit margin overrides it"""
+        handler = LocalLLMHandler(backend=RecordingBackend(), use_cache=False, context_window=1000)
+        self.assertTrue(handler.token_counter.estimated)
+        self.assertEqual(handler.context_margin, 200)
+        self.assertEqual(handler.prompt_builder(max_tokens=100).budget, 700)
+        
+        exact = LocalLLMHandler(backend=RecordingBackend(), use_cache=False, context_window=1000, context_margin=0)
+        self.assertEqual(exact.prompt_builder(max_tokens=100).budget, 900)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from main import policy_names, PolicyGapFixer
+
+class TestPolicyNames(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for sub in ("a", "b"):
+            os.makedirs(os.path.join(self.tmp.name, sub))
+            with open(os.path.join(self.tmp.name, sub, "policy.txt"), 'w') as f:
+                f.write(sub)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_duplicate_stems_are_rejected(self):
+        """Two files with the same stem would overwrite each other's results"""
+        a = os.path.join(self.tmp.name, "a", "policy.txt")
+        b = os.path.join(self.tmp.name, "b", "policy.txt")
+        with self.assertRaises(ValueError) as raised:
+            policy_names([a, b])
+        self.assertIn("policy", str(raised.exception))
+    
+    def test_same_file_twice_is_processed_once(self):
+        a = os.path.join(self.tmp.name, "a", "policy.txt")
+        self.assertEqual(policy_names([a, a]), {"policy": a})
+
+class TestSaveResults(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # save_results and load_previous_analysis only need output_dir
+        self.fixer = SimpleNamespace(output_dir=Path(self.tmp.name) / "outputs",
+                                     checkpoint_dir=Path(self.tmp.name) / "outputs" / ".checkpoints")
+        self.results = {"gap_analysis": {"run": 1}, "revised_policy": {}, "roadmap": {}, "stage_timings": {}}
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_runs_of_the_same_policy_get_their_own_directory(self):
+        first = PolicyGapFixer.save_results(self.fixer, "policy", "text", self.results)
+        self.results["gap_analysis"] = {"run": 2}
+        second = PolicyGapFixer.save_results(self.fixer, "policy", "text", self.results)
+        self.assertNotEqual(first, second)
+        self.assertEqual(PolicyGapFixer.load_previous_analysis(self.fixer, "policy"), {"run": 2})
+    
+    def test_jobs_do_not_share_checkpoints(self):
+        """The same text shares checkpoints across CLI runs, but not across server jobs"""
+        path = PolicyGapFixer.checkpoint_path
+        self.assertEqual(path(self.fixer, "text", "policy"), path(self.fixer, "text", "policy"))
+        self.assertNotEqual(path(self.fixer, "text", "policy", "job1"), path(self.fixer, "text", "policy", "job2"))
+
+if __name__ == "__main__":
+    unittest.main()
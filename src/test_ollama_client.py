@@ -0,0 +1,123 @@
+import sys
+import unittest
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from ollama_client import OllamaClient, OllamaError
+from llm_handler import LocalLLMHandler
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal /api/generate stub recording requests and client connections"""
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(payload)
+        self.server.connections.add(self.client_address)
+        
+        if payload["model"] == "missing":
+            body = json.dumps({"error": "model not found"}).encode()
+            self.send_response(404)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
+        text = '{"gaps": []} and then some rambling the caller should never wait for'
+        if not payload["stream"]:
+            body = json.dumps({"response": text, "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        try:
+            for i, token in enumerate(tokens):
+                line = json.dumps({"response": token, "done": i == len(tokens) - 1}).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class StubOllamaServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients closing a stream early is expected; report anything else
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class TestOllamaClient(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubOllamaServer(("127.0.0.1", 0), StubOllamaHandler)
+        cls.server.requests = []
+        cls.server.connections = set()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.host = f"http://127.0.0.1:{cls.server.server_address[1]}"
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.connections.clear()
+    
+    def test_connection_is_reused(self):
+        """Sequential calls share one keep-alive connection"""
+        client = OllamaClient(self.host, keep_alive="10m")
+        for _ in range(3):
+            self.assertIn("gaps", client.generate("m", "prompt")["response"])
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(self.server.requests[0]["keep_alive"], "10m")
+        client.close()
+    
+    def test_full_stream_returns_connection_to_pool(self):
+        """A fully consumed stream leaves its connection reusable"""
+        client = OllamaClient(self.host)
+        chunks = list(client.generate_stream("m", "prompt"))
+        self.assertTrue(chunks[-1]["done"])
+        client.generate("m", "again")
+        self.assertEqual(len(self.server.connections), 1)
+        client.close()
+    
+    def test_error_status_raises(self):
+        """Non-200 responses raise OllamaError"""
+        client = OllamaClient(self.host)
+        with self.assertRaises(OllamaError):
+            client.generate("missing", "prompt")
+        client.close()
+    
+    def test_handler_stops_stream_at_json_end(self):
+        """Structured generation returns only the JSON object from the stream"""
+        handler = LocalLLMHandler(use_cache=False, host=self.host)
+        tokens = []
+        result = handler.generate_structured("Analyze", {"gaps": []}, on_token=tokens.append)
+        self.assertEqual(result, {"gaps": []})
+        self.assertLess(len("".join(tokens)), 30)
+        self.assertEqual(self.server.requests[0]["options"]["num_ctx"], handler.context_window)
+    
+    def test_structured_generation_sends_schema(self):
+        """The output format is sent to Ollama as a JSON schema unless disabled"""
+        handler = LocalLLMHandler(use_cache=False, host=self.host)
+        handler.generate_structured("Analyze", {"gaps": []})
+        self.assertEqual(self.server.requests[-1]["format"]["required"], ["gaps"])
+        
+        handler.constrained_decoding = False
+        handler.generate_structured("Analyze", {"gaps": []})
+        self.assertNotIn("format", self.server.requests[-1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from pipeline import Pipeline, StageError
+
+class TestPipeline(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    
+    def test_independent_stages_run_concurrently(self):
+        """Both dependents of a stage start before either finishes"""
+        barrier = threading.Barrier(2, timeout=5)
+        
+        def dependent(inputs):
+            barrier.wait()
+            return inputs["analysis"] + 1
+        
+        run = (Pipeline()
+               .add("analysis", lambda inputs: 1)
+               .add("revision", dependent, depends=["analysis"])
+               .add("roadmap", dependent, depends=["analysis"])
+               .run())
+        self.assertEqual(run["results"], {"analysis": 1, "revision": 2, "roadmap": 2})
+        self.assertEqual(set(run["timings"]), {"analysis", "revision", "roadmap"})
+    
+    def test_resume_from_checkpoint(self):
+        """A failed run keeps finished stages and the rerun only runs the rest"""
+        calls = []
+        
+        def build(fail):
+            def analysis(inputs):
+                calls.append("analysis")
+                return {"gaps": 3}
+            
+            def revision(inputs):
+                calls.append("revision")
+                if fail:
+                    raise RuntimeError("backend down")
+                return inputs["analysis"]["gaps"] * 2
+            
+            return Pipeline().add("analysis", analysis).add("revision", revision, depends=["analysis"])
+        
+        with self.assertRaises(StageError) as raised:
+            build(fail=True).run(checkpoint_dir=self.tmp)
+        self.assertEqual(raised.exception.stage, "revision")
+        
+        run = build(fail=False).run(checkpoint_dir=self.tmp)
+        self.assertEqual(run["resumed"], ["analysis"])
+        self.assertEqual(run["results"]["revision"], 6)
+        self.assertEqual(calls, ["analysis", "revision", "revision"])
+    
+    def test_initial_results_skip_stages(self):
+        """Stages given in initial are not run"""
+        def explode(inputs):
+            raise AssertionError("should not run")
+        
+        run = (Pipeline()
+               .add("analysis", explode)
+               .add("roadmap", lambda inputs: inputs["analysis"] + "!", depends=["analysis"])
+               .run(initial={"analysis": "done"}))
+        self.assertEqual(run["results"]["roadmap"], "done!")
+        self.assertNotIn("analysis", run["timings"])
+    
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            Pipeline().add("revision", lambda inputs: None, depends=["analysis"])
+
+if __name__ == "__main__":
+    unittest.main()
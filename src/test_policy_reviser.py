@@ -0,0 +1,110 @@
+import unittest
+from policy_reviser import PolicyReviser, diff_changes
+from tokenization import TokenCounter
+from prompt_builder import PromptBuilder
+
+POLICY = """Access Policy
+## Passwords
+Passwords must be 8 characters. Passwords are stored securely.
+## Logging
+Systems keep logs.
+## Scope
+This policy applies to all staff."""
+
+class FakeLLM:
+    """Appends a sentence to each section it is asked to revise"""
+    
+    def __init__(self, fail_on=None):
+        self.token_counter = TokenCounter()
+        self.context_window = 4096
+        self.prompts = []
+        self.fail_on = fail_on
+    
+    def generate_structured(self, prompt, output_format, max_tokens=800):
+        self.prompts.append(prompt)
+        lines = prompt.split("\n")
+        section = lines[3].replace("SECTION: ", "")
+        if section == self.fail_on:
+            raise RuntimeError("model unavailable")
+        text = lines[4]
+        return {"revised_section": f"{text} {section} are reviewed yearly.",
+                "gap_addressing_summary": f"Added review of {section.lower()}"}
+
+class WholePolicyLLM:
+    """Records the prompt and preamble of a single-pass revision"""
+    
+    def __init__(self, context_window=120):
+        self.token_counter = TokenCounter()
+        self.context_window = context_window
+        self.calls = []
+    
+    def prompt_builder(self, output_format=None, max_tokens=800, preamble=""):
+        return PromptBuilder(self.context_window, self.token_counter.count(preamble), self.token_counter)
+    
+    def generate_structured(self, prompt, output_format, preamble=""):
+        self.calls.append((preamble, prompt))
+        return {"revised_policy": "Revised.", "track_changes": [], "gap_addressing_summary": ""}
+
+def analysis(*sections):
+    return {"policy_analysis": [
+        {"section": name, "gaps": [{"gap_description": f"{name} gap", "recommendation": "Review"}]}
+        for name in sections
+    ]}
+
+class TestSectionedRevision(unittest.TestCase):
+    
+    def test_only_sections_with_gaps_are_revised(self):
+        """Each prompt carries one section and its own gaps; the rest is kept verbatim"""
+        llm = FakeLLM()
+        reviser = PolicyReviser(llm, max_workers=2, mode="sections")
+        result = reviser.revise_policy(POLICY, analysis("Passwords", "Logging"))
+        
+        self.assertEqual(len(llm.prompts), 2)
+        self.assertNotIn("Logging gap", next(p for p in llm.prompts if "SECTION: Passwords" in p))
+        self.assertIn("## Passwords\nPasswords must be 8 characters.", result["revised_policy"])
+        self.assertIn("Logging are reviewed yearly.", result["revised_policy"])
+        self.assertTrue(result["revised_policy"].endswith("## Scope\nThis policy applies to all staff."))
+        self.assertEqual([c["revised"] for c in result["track_changes"]],
+                         ["Passwords are reviewed yearly.", "Logging are reviewed yearly."])
+        self.assertEqual([s["status"] for s in result["sections"]], ["unchanged", "revised", "revised", "unchanged"])
+    
+    def test_failed_section_keeps_original(self):
+        llm = FakeLLM(fail_on="Logging")
+        result = PolicyReviser(llm, mode="sections").revise_policy(POLICY, analysis("Passwords", "Logging"))
+        self.assertIn("## Logging\nSystems keep logs.\n", result["revised_policy"])
+        self.assertEqual(result["sections"][2]["status"], "error")
+    
+    def test_auto_mode_keeps_short_policies_single_pass(self):
+        reviser = PolicyReviser(FakeLLM())
+        self.assertFalse(reviser._use_sections(POLICY))
+        self.assertTrue(reviser._use_sections(POLICY * 200))
+
+class TestWholeRevision(unittest.TestCase):
+    
+    def test_long_policy_is_cut_before_gaps_and_instructions(self):
+        """Instructions go in the preamble, gaps are packed first, and the policy is cut with its line breaks"""
+        llm = WholePolicyLLM()
+        reviser = PolicyReviser(llm, mode="single")
+        result = reviser.revise_policy(POLICY * 20, analysis("Passwords", "Logging"))
+        
+        preamble, prompt = llm.calls[0]
+        self.assertTrue(preamble.startswith("Revise the following cybersecurity policy"))
+        self.assertTrue(prompt.startswith("IDENTIFIED GAPS TO ADDRESS:\n- Passwords gap: Review\n- Logging gap: Review"))
+        self.assertIn("ORIGINAL POLICY:\nAccess Policy\n## Passwords\n", prompt)
+        self.assertEqual(result["prompt_packing"], {"truncated": ["policy"], "dropped": []})
+    
+    def test_short_policy_is_sent_whole(self):
+        llm = WholePolicyLLM(context_window=4096)
+        result = PolicyReviser(llm, mode="single").revise_policy(POLICY, analysis("Passwords"))
+        self.assertTrue(llm.calls[0][1].endswith(POLICY))
+        self.assertNotIn("prompt_packing", result)
+
+class TestDiffChanges(unittest.TestCase):
+    
+    def test_sentence_hunks(self):
+        changes = diff_changes("S", "One. Two. Three.", "One. Two and more. Three. Four.")
+        self.assertEqual([(c["original"], c["revised"]) for c in changes],
+                         [("Two.", "Two and more."), ("", "Four.")])
+
+if __name__ == "__main__":
+    unittest.main()
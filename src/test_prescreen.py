@@ -0,0 +1,38 @@
+import unittest
+from prescreen import PreScreener, similarity_from_distance
+
+class TestPreScreener(unittest.TestCase):
+    
+    def setUp(self):
+        self.screener = PreScreener(covered_similarity=0.85)
+    
+    def test_trivial_sections(self):
+        """Empty, boilerplate and metadata-only sections are trivial"""
+        self.assertEqual(self.screener.screen_text("Header", "  ")["reason"], "empty")
+        self.assertEqual(self.screener.screen_text("2.0 Table of Contents", "1 Purpose 2 Scope 3 Access Control "
+                                                   "4 Incident Response 5 Enforcement")["reason"], "boilerplate")
+        header = "Version: 1.2 Effective Date: 2024-01-01 Owner: CISO Page 1 of 9"
+        self.assertEqual(self.screener.screen_text("Header", header)["reason"], "metadata")
+        self.assertIsNone(self.screener.screen_text("Access", "Administrators review privileged accounts every quarter."))
+    
+    def test_short_requirements_are_reviewed(self):
+        """A short section can still be a requirement, so it goes on to retrieval"""
+        self.assertIsNone(self.screener.screen_text("Passwords", "Passwords must rotate quarterly."))
+        self.assertIsNone(self.screener.screen_text("Header", "Information Security Policy Version: 1.2"))
+    
+    def test_similarity_verdicts(self):
+        """The best hit decides between covered and needs_review"""
+        self.assertAlmostEqual(similarity_from_distance(0.0), 1.0)
+        self.assertAlmostEqual(similarity_from_distance(2.0), 0.0)
+        covered = self.screener.screen_hits([{'score': 0.9}, {'score': 0.2}])
+        self.assertEqual(covered, {"status": "covered", "similarity": 0.9})
+        self.assertEqual(self.screener.screen_hits([{'score': 0.6}])["status"], "needs_review")
+        self.assertEqual(self.screener.screen_hits([])["status"], "needs_review")
+    
+    def test_counts(self):
+        analyses = [PreScreener.analysis("a", {"status": "covered"}), {"section": "b", "gaps": []},
+                    {"section": "c", "gaps": [], "prescreen": {"status": "needs_review"}}]
+        self.assertEqual(PreScreener.counts(analyses), {"covered": 1, "trivial": 0, "needs_review": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from prompt_builder import PromptBuilder
+
+class TestPromptBuilder(unittest.TestCase):
+    
+    def test_everything_fits(self):
+        """Parts render in insertion order when within budget"""
+        packed = (PromptBuilder(context_window=100)
+                  .add("a", "first part", priority=2)
+                  .add("b", "second part", priority=0)
+                  .build(separator=" | "))
+        self.assertEqual(packed["prompt"], "first part | second part")
+        self.assertEqual(packed["included"], ["b", "a"])
+        self.assertEqual(packed["used_tokens"], 4)
+    
+    def test_priority_order_and_report(self):
+        """Low-priority parts are truncated or dropped first"""
+        packed = (PromptBuilder(context_window=50, reserve_tokens=10, min_part_tokens=5)
+                  .add("instructions", "keep these instructions", priority=0, truncatable=False)
+                  .add("section", " ".join(["word"] * 45), priority=1)
+                  .add("standard_1", "never fits", priority=2, token_count=40)
+                  .build())
+        self.assertEqual(packed["budget"], 40)
+        self.assertEqual(packed["truncated"], ["section"])
+        self.assertEqual(packed["dropped"], ["standard_1"])
+        self.assertTrue(packed["prompt"].startswith("keep these instructions\nword"))
+        self.assertLessEqual(packed["used_tokens"], 40)
+    
+    def test_precomputed_token_count_is_trusted(self):
+        """A supplied token_count is used instead of re-tokenizing"""
+        packed = PromptBuilder(context_window=10).add("chunk", "tiny", token_count=11).build()
+        self.assertEqual(packed["dropped"], ["chunk"])
+
+if __name__ == "__main__":
+    unittest.main()
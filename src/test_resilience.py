@@ -0,0 +1,193 @@
+import random
+import threading
+import time
+import unittest
+from tracing import tracer
+from ollama_client import OllamaError
+from llm_handler import LocalLLMHandler
+from llm_backends import LLMBackend
+from resilience import (classify_error, RetryPolicy, CircuitBreaker, BackendGuard, CircuitOpenError,
+                        OverloadedError, LLMTimeoutError, BackendUnavailableError, RequestError)
+
+class ScriptedBackend(LLMBackend):
+    """Backend replaying a list of responses; exceptions in the list are raised"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    def generate(self, prompt, options, json_schema=None):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else self.last
+        self.last = step
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_handler(backend, failure_threshold=5):
+    handler = LocalLLMHandler(backend=backend, use_cache=False, retry_policy=RetryPolicy(base_delay=0))
+    handler.stream = False
+    handler.guard = BackendGuard(breaker=CircuitBreaker(failure_threshold=failure_threshold))
+    return handler
+
+class TestResilience(unittest.TestCase):
+
+    def test_classify_error(self):
+        """Exceptions map to timeout, backend-down and rejected-request errors"""
+        self.assertIsInstance(classify_error(TimeoutError("read timed out")), LLMTimeoutError)
+        self.assertIsInstance(classify_error(ConnectionRefusedError()), BackendUnavailableError)
+        self.assertIsInstance(classify_error(OllamaError("boom", 500)), BackendUnavailableError)
+        self.assertIsInstance(classify_error(OllamaError("model not found", 404)), RequestError)
+        self.assertFalse(classify_error(OllamaError("model not found", 404)).retryable)
+        self.assertEqual(classify_error(ValueError("odd")).kind, "error")
+
+    def test_backoff_grows_and_is_capped(self):
+        """Delays are jittered below an exponentially growing, capped bound"""
+        policy = RetryPolicy(base_delay=1, max_delay=5, rng=random.Random(0))
+        for attempt, bound in enumerate([1, 2, 4, 5, 5]):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= d <= bound for d in delays))
+            self.assertGreater(max(delays), bound / 2)
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        """Health failures open the circuit; one probe after the timeout closes it"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure("parse")
+        breaker.record_failure("timeout")
+        breaker.allow()
+        breaker.record_failure("backend_down")
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+
+        clock.now = 11
+        breaker.allow()
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+        breaker.record_failure("timeout")
+        self.assertEqual(breaker.state, "open")
+
+        clock.now = 22
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.allow()
+
+    def test_guard_recovers_after_the_reset_timeout(self):
+        """Through BackendGuard.call, one probe after the timeout reaches the backend and closes the circuit"""
+        clock = FakeClock()
+        guard = BackendGuard(breaker=CircuitBreaker(failure_threshold=5, reset_timeout=30, clock=clock))
+        for _ in range(5):
+            with self.assertRaises(BackendUnavailableError):
+                with guard.call():
+                    raise ConnectionRefusedError()
+        with self.assertRaises(CircuitOpenError):
+            with guard.call():
+                self.fail("an open circuit must not reach the backend")
+        
+        clock.now = 31
+        reached = []
+        with guard.call():
+            # While the probe is out, other calls still fail fast
+            with self.assertRaises(CircuitOpenError):
+                with guard.call():
+                    pass
+            reached.append(True)
+        self.assertEqual(reached, [True])
+        self.assertEqual(guard.breaker.state, "closed")
+        with guard.call():
+            pass
+    
+    def test_interrupted_probe_is_released(self):
+        """A probe that ends without an outcome does not leave the circuit stuck"""
+        clock = FakeClock()
+        guard = BackendGuard(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock))
+        with self.assertRaises(LLMTimeoutError):
+            with guard.call():
+                raise TimeoutError()
+        clock.now = 11
+        with self.assertRaises(KeyboardInterrupt):
+            with guard.call():
+                raise KeyboardInterrupt()
+        with guard.call():
+            pass
+        self.assertEqual(guard.breaker.state, "closed")
+    
+    def test_limiter_caps_concurrency(self):
+        """No more than max_concurrent calls run at once; waiters time out as overloaded"""
+        guard = BackendGuard(max_concurrent=2, acquire_timeout=5)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def call():
+            with guard.call():
+                with lock:
+                    active.append(1)
+                    peak.append(len(active))
+                time.sleep(0.02)
+                with lock:
+                    active.pop()
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+
+        busy = BackendGuard(max_concurrent=1, acquire_timeout=0.01)
+        with busy.call():
+            with self.assertRaises(OverloadedError):
+                with busy.call():
+                    pass
+
+    def test_retries_transient_errors(self):
+        """Timeouts and empty output are retried; the next good answer is returned"""
+        backend = ScriptedBackend([TimeoutError("slow"), "", "real answer"])
+        handler = make_handler(backend)
+        self.assertEqual(handler.generate_with_retry("prompt"), "real answer")
+        self.assertEqual(backend.calls, 3)
+
+    def test_rejected_request_is_not_retried(self):
+        backend = ScriptedBackend([OllamaError("model not found", 404), "never"])
+        handler = make_handler(backend)
+        key = ("llm_generation_failures_total", (("kind", "request"),))
+        before = tracer.counters.get(key, 0)
+        self.assertTrue(handler.generate_with_retry("prompt").startswith("Error:"))
+        self.assertEqual(backend.calls, 1)
+        self.assertEqual(tracer.counters[key], before + 1)
+
+    def test_open_circuit_fails_fast(self):
+        """Once the backend is down, calls fail without reaching it"""
+        backend = ScriptedBackend([ConnectionRefusedError()])
+        handler = make_handler(backend, failure_threshold=3)
+        result = handler.generate_structured("prompt", {"gaps": []})
+        self.assertEqual(result["error_type"], "backend_down")
+        self.assertEqual(backend.calls, 3)
+
+        result = handler.generate_structured("prompt", {"gaps": []})
+        self.assertEqual(result["error_type"], "circuit_open")
+        self.assertEqual(backend.calls, 3)
+
+    def test_unparseable_output_is_regenerated(self):
+        """A parse failure is retried instead of returned, and never cached"""
+        backend = ScriptedBackend(["not json at all", '{"gaps": ["x"]}'])
+        handler = make_handler(backend)
+        self.assertEqual(handler.generate_structured("prompt", {"gaps": []}), {"gaps": ["x"]})
+
+        backend = ScriptedBackend(["still not json"])
+        handler = make_handler(backend)
+        result = handler.generate_structured("prompt", {"gaps": []})
+        self.assertEqual(result["error_type"], "parse")
+        self.assertEqual(result["raw_response"], "still not json")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from roadmap import GapIndex, build_roadmap, polish_descriptions
+
+def gap(severity, function, recommendation):
+    return {"gap_description": recommendation, "severity": severity,
+            "nist_function": function, "recommendation": recommendation}
+
+ANALYSIS = {"policy_analysis": [
+    {"section": "Access", "gaps": [
+        gap("Low", "Identify", "Inventory accounts"),
+        gap("High", "Protect", "Enforce MFA"),
+        gap("medium", "Detect (DE.CM)", "Monitor logins")
+    ]},
+    {"section": "Backups", "gaps": [gap("Low", "Recover", "Test restores")]}
+]}
+
+class TestRoadmap(unittest.TestCase):
+    
+    def test_index_normalizes_labels(self):
+        index = GapIndex(ANALYSIS)
+        self.assertEqual(index.by_severity["Medium"], [2])
+        self.assertEqual(index.by_function["Detect"], [2])
+        self.assertEqual(index.by_section_function[("Access", "Protect")], [1])
+    
+    def test_control_ids_decide_the_function(self):
+        """A control ID outranks the function name, and gaps are indexed by control"""
+        analysis = {"policy_analysis": [{"section": "Control coverage", "gaps": [
+            dict(gap("Medium", "Protect", "Add governance"), control="GV.OC-01"),
+            gap("Low", "Respond per RS.MA-1", "Triage incidents")
+        ]}]}
+        analysis["policy_analysis"].append({"section": "Logging", "controls": ["DE.CM-01"],
+                                            "gaps": [gap("Low", "unknown", "Collect logs")]})
+        index = GapIndex(analysis)
+        self.assertEqual([g["nist_function"] for g in index.gaps], ["Govern", "Respond", "Detect"])
+        self.assertEqual(index.by_control, {"GV.OC-01": [0], "RS.MA-01": [1]})
+        phases = build_roadmap(analysis)["roadmap"]["phases"]
+        self.assertEqual([p["controls"] for p in phases], [["GV.OC-01"], ["RS.MA-01"]])
+    
+    def test_prerequisites_are_pulled_forward(self):
+        """A low severity Identify gap moves into the phase of the Protect gap that builds on it"""
+        self.assertEqual(GapIndex(ANALYSIS).schedule(), [0, 0, 1, 2])
+        
+        phases = build_roadmap(ANALYSIS)["roadmap"]["phases"]
+        self.assertEqual([p["phase"] for p in phases],
+                         ["Phase 1 (Month 1-2)", "Phase 2 (Month 3-4)", "Phase 3 (Month 5-6)"])
+        self.assertEqual(phases[0]["key_activities"], ["Inventory accounts", "Enforce MFA"])
+        self.assertEqual(phases[2]["gap_ids"], [3])
+    
+    def test_polish_only_adds_descriptions(self):
+        class FakeLLM:
+            def generate_structured(self, prompt, output_format, max_tokens=800):
+                return {"description": "Focus on access."}
+        
+        roadmap = build_roadmap(ANALYSIS)
+        schedule = [p["gap_ids"] for p in roadmap["roadmap"]["phases"]]
+        polish_descriptions(roadmap, FakeLLM())
+        self.assertEqual([p["gap_ids"] for p in roadmap["roadmap"]["phases"]], schedule)
+        self.assertTrue(all(p["description"] == "Focus on access." for p in roadmap["roadmap"]["phases"]))
+    
+    def test_large_batch(self):
+        """Every gap of a large analysis is scheduled; timing is measured by benchmark.py"""
+        analysis = {"policy_analysis": [
+            {"section": f"S{i}", "gaps": [gap("High", "Protect", f"r{i}"), gap("Low", "Identify", f"i{i}")]}
+            for i in range(500)
+        ]}
+        roadmap = build_roadmap(analysis)
+        self.assertEqual(len(roadmap["roadmap"]["phases"][0]["gap_ids"]), 1000)
+
+if __name__ == "__main__":
+    unittest.main()
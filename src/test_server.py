@@ -0,0 +1,67 @@
+import time
+import threading
+import unittest
+from server import create_server
+from client import PolicyClient
+from tracing import tracer
+
+class TestServer(unittest.TestCase):
+    
+    def setUp(self):
+        self.release = threading.Event()
+        self.job_ids = []
+        self.exporting = tracer.export_metrics
+        
+        def process(policy_text, policy_name, job_id):
+            self.job_ids.append(job_id)
+            self.release.wait(5)
+            if policy_name == "broken":
+                raise ValueError("bad policy")
+            return {"policy_name": policy_name, "length": len(policy_text)}
+        
+        self.server = create_server(process, port=0, workers=1, queue_size=1, retry_after=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = PolicyClient(port=self.server.server_address[1])
+    
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.jobs.close()
+    
+    def test_full_queue_is_refused(self):
+        """With one worker busy and one job queued, further jobs get 503"""
+        first = self.client.submit("a", "text")
+        # Wait until the worker has taken the first job off the queue
+        while self.client.status(first)["status"] != "running":
+            time.sleep(0.01)
+        self.client.submit("b", "text")
+        with self.assertRaises(RuntimeError):
+            self.client.submit("c", "text", max_wait=0)
+        
+        self.release.set()
+        self.assertEqual(self.client.wait(first, poll_interval=0.01)["result"], {"policy_name": "a", "length": 4})
+        self.assertEqual(self.job_ids[0], first)
+    
+    def test_metrics_export_ends_with_the_server(self):
+        """The server turns on metrics export and server_close restores the previous setting"""
+        self.assertTrue(tracer.export_metrics)
+        self.server.server_close()
+        self.assertEqual(tracer.export_metrics, self.exporting)
+    
+    def test_failed_job_reports_error(self):
+        self.release.set()
+        job = self.client.wait(self.client.submit("broken", "text"), poll_interval=0.01)
+        self.assertEqual(job["status"], "error")
+        self.assertIn("bad policy", job["error"])
+        self.assertEqual(self.client._request("GET", "/health")[2]["jobs"], {"error": 1})
+
+    def test_unsafe_policy_names_are_rejected(self):
+        """Names become output directories, so path separators and leading dots are refused"""
+        for name in ("../../tmp/x", "a/b", "..", ".hidden", ""):
+            with self.assertRaises(RuntimeError):
+                self.client.submit(name, "text", max_wait=0)
+        self.assertEqual(self.client._request("GET", "/health")[2]["jobs"], {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+import unittest
+from benchmark_startup import heavy_imports, PIPELINE_MODULES
+
+class TestStartup(unittest.TestCase):
+    
+    def test_pipeline_modules_import_without_heavy_dependencies(self):
+        """Embedding, FAISS and PDF libraries load only when they are used"""
+        self.assertEqual(heavy_imports(PIPELINE_MODULES), [])
+
+class TestLazyVectorStore(unittest.TestCase):
+    
+    def test_model_loads_on_first_use(self):
+        from embedding_system import VectorStore
+        store = VectorStore()
+        self.assertIsNone(store._model)
+        self.assertIsNone(store.index)
+
+if __name__ == "__main__":
+    unittest.main()
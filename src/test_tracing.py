@@ -0,0 +1,122 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from tracing import Tracer
+from llm_handler import LocalLLMHandler
+from llm_backends import LLMBackend
+from tokenization import TokenCounter
+
+class EchoBackend(LLMBackend):
+    def generate(self, prompt, options, json_schema=None):
+        return '{"gaps": []}'
+
+class CountingTokenCounter(TokenCounter):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+    
+    def count(self, text):
+        self.calls += 1
+        return super().count(text)
+
+class TestTracer(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.trace_path = os.path.join(self.tmp, "trace.jsonl")
+        self.tracer = Tracer(self.trace_path)
+    
+    def tearDown(self):
+        self.tracer.configure(None)
+        shutil.rmtree(self.tmp)
+    
+    def read_trace(self):
+        with open(self.trace_path) as f:
+            return [json.loads(line) for line in f]
+    
+    def test_nested_spans_and_errors(self):
+        with self.tracer.span("outer", policy="p") as outer:
+            with self.tracer.span("inner") as inner:
+                inner.set("tokens", 5)
+            with self.assertRaises(ValueError):
+                with self.tracer.span("failing"):
+                    raise ValueError("boom")
+        
+        inner, failing, outer_record = self.read_trace()
+        self.assertEqual(inner["parent_id"], outer.span_id)
+        self.assertEqual(inner["trace_id"], outer_record["trace_id"])
+        self.assertEqual(inner["attributes"], {"tokens": 5})
+        self.assertEqual(failing["status"], "error")
+        self.assertIsNone(outer_record["parent_id"])
+    
+    def test_attach_parents_spans_in_other_threads(self):
+        with self.tracer.span("batch") as batch:
+            def work():
+                with self.tracer.attach(batch), self.tracer.span("section"):
+                    pass
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        self.assertEqual(self.read_trace()[0]["parent_id"], batch.span_id)
+    
+    def test_prometheus_text(self):
+        self.tracer.count("llm_retries_total", 2)
+        with self.tracer.span("vector_store.search"):
+            pass
+        text = self.tracer.prometheus_text()
+        self.assertIn("policygapfixer_llm_retries_total 2", text)
+        self.assertIn('policygapfixer_span_duration_seconds_bucket{span="vector_store.search",le="+Inf"} 1', text)
+        self.assertIn('policygapfixer_span_duration_seconds_count{span="vector_store.search"} 1', text)
+
+class TestHandlerTracing(unittest.TestCase):
+    
+    def test_generation_span_attributes(self):
+        """llm.generate spans record tokens and cache hits"""
+        import tracing
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "trace.jsonl")
+        tracing.tracer.configure(path)
+        try:
+            from llm_cache import LLMResponseCache
+            cache = LLMResponseCache(os.path.join(tmp, "cache.sqlite"))
+            handler = LocalLLMHandler(backend=EchoBackend(), cache=cache)
+            handler.stream = False
+            handler.generate_structured("Analyze this section", {"gaps": []})
+            handler.generate_structured("Analyze this section", {"gaps": []})
+            cache.close()
+        finally:
+            tracing.tracer.configure(None)
+        with open(path) as f:
+            spans = [json.loads(line) for line in f]
+        shutil.rmtree(tmp)
+        
+        generates = [s for s in spans if s["name"] == "llm.generate"]
+        self.assertEqual([s["attributes"]["cache_hit"] for s in generates], [False, True])
+        self.assertGreater(generates[0]["attributes"]["prompt_tokens"], 0)
+        structured = [s for s in spans if s["name"] == "llm.generate_structured"]
+        self.assertEqual(structured[0]["attributes"]["parse"], "json")
+    
+    def test_tokens_are_not_counted_when_tracing_is_off(self):
+        """Without a trace file or metrics export, generations skip token counting"""
+        import tracing
+        exporting = tracing.tracer.export_metrics
+        tracing.tracer.export_metrics = False
+        try:
+            handler = LocalLLMHandler(backend=EchoBackend(), use_cache=False)
+            handler.stream = False
+            handler.token_counter = CountingTokenCounter()
+            handler.generate_direct("Analyze this section")
+            # Only the count that checks the prompt fits the context window
+            self.assertEqual(handler.token_counter.calls, 1)
+            
+            tracing.tracer.export_metrics = True
+            handler.generate_direct("Analyze this section")
+        finally:
+            tracing.tracer.export_metrics = exporting
+        self.assertEqual(handler.token_counter.calls, 4)
+
+if __name__ == "__main__":
+    unittest.main()
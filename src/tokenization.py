@@ -0,0 +1,75 @@
+import re
+from typing import List, Optional, Any
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Name of the counter used when no tokenizer is given
+ESTIMATE = "estimate"
+
+class TokenCounter:
+    """Count tokens with a Hugging Face tokenizer, or estimate them without one
+
+    The estimate counts words and punctuation marks separately, which tracks
+    WordPiece/BPE counts for English prose closely enough for budgeting, but
+    tends to undercount; callers budgeting a context window should leave a
+    margin when estimated is set. name identifies the counter, so stored
+    counts can be checked against the counter about to use them.
+    """
+
+    def __init__(self, tokenizer: Optional[Any] = None, name: Optional[str] = None):
+        self.tokenizer = tokenizer
+        if tokenizer is None:
+            self.name = ESTIMATE
+        else:
+            self.name = name or getattr(tokenizer, "name_or_path", None) or type(tokenizer).__name__
+
+    @property
+    def estimated(self) -> bool:
+        """True when counts are estimates rather than a tokenizer's"""
+        return self.tokenizer is None
+
+    @classmethod
+    def from_pretrained(cls, model_name: str) -> "TokenCounter":
+        """Load a tokenizer by name, falling back to the estimate if unavailable"""
+        try:
+            from transformers import AutoTokenizer
+            return cls(AutoTokenizer.from_pretrained(model_name), name=model_name)
+        except Exception as e:
+            print(f"Tokenizer {model_name} unavailable, estimating token counts ({e})")
+            return cls()
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text"""
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return len(WORD_PATTERN.findall(text))
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        """Split text on word boundaries into pieces of at most max_tokens"""
+        pieces = []
+        current = []
+        current_tokens = 0
+        for word in text.split():
+            word_tokens = self.count(word)
+            if current and current_tokens + word_tokens > max_tokens:
+                pieces.append(' '.join(current))
+                current = []
+                current_tokens = 0
+            current.append(word)
+            current_tokens += word_tokens
+        if current:
+            pieces.append(' '.join(current))
+        return pieces
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the leading words of text that fit in max_tokens, with their original spacing"""
+        end = 0
+        used = 0
+        for match in re.finditer(r"\S+", text):
+            used += self.count(match.group())
+            if used > max_tokens:
+                break
+            end = match.end()
+        return text[:end]
@@ -0,0 +1,208 @@
+"""Lightweight spans, counters and exporters for the pipeline
+
+Spans time a block of work and carry attributes (tokens, cache hits,
+retries). Every finished span feeds a duration histogram, and when a trace
+file is configured it is also appended there as one JSON line. Metrics are
+rendered in the Prometheus text format for a file or an HTTP endpoint.
+
+    from tracing import tracer
+    with tracer.span("vector_store.search", queries=3) as span:
+        ...
+        span.set("cache_hits", 2)
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple, Iterator
+
+METRIC_PREFIX = "policygapfixer"
+
+# Histogram buckets for span durations, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Span:
+    """A timed unit of work; attributes are written with set()"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start", "duration", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> "Span":
+        self.attributes[key] = value
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(1000 * (self.duration or 0), 3),
+            "status": "error" if self.error else "ok",
+            "attributes": self.attributes
+        }
+        if self.error:
+            record["error"] = self.error
+        return record
+
+class Tracer:
+    """Collects spans and counters; thread-safe
+
+    The active span is tracked per thread, so nested spans get their parent
+    automatically. Work handed to another thread can pass parent= explicitly.
+    """
+
+    def __init__(self, trace_path: Optional[str] = None):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.histograms: Dict[str, Dict[str, Any]] = {}
+        # Set when metrics are exported (--metrics, the server's /metrics)
+        self.export_metrics = False
+        if trace_path:
+            self.configure(trace_path)
+
+    def configure(self, trace_path: Optional[str] = None):
+        """Start (or stop, with None) appending finished spans to a JSONL file"""
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+            if trace_path:
+                directory = os.path.dirname(trace_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._trace_file = open(trace_path, 'a', buffering=1)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether spans are written or metrics exported
+
+        Callers skip computing attributes, such as token counts, that
+        nothing would read otherwise.
+        """
+        return self._trace_file is not None or self.export_metrics
+
+    def current(self) -> Optional[Span]:
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes) -> Iterator[Span]:
+        """Time the enclosed block as a span; exceptions mark it as failed and propagate"""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        span = Span(name, parent or self.current(), attributes)
+        self._local.stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:200]
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            self._local.stack.pop()
+            self._finish(span)
+
+    @contextmanager
+    def attach(self, span: Optional[Span]) -> Iterator[None]:
+        """Parent spans opened in this thread under span, e.g. in a worker pool"""
+        if span is None:
+            yield
+            return
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        self._local.stack.append(span)
+        try:
+            yield
+        finally:
+            self._local.stack.pop()
+
+    def _finish(self, span: Span):
+        with self._lock:
+            histogram = self.histograms.setdefault(span.name, {
+                "buckets": [0] * len(DURATION_BUCKETS), "count": 0, "sum": 0.0, "errors": 0
+            })
+            histogram["count"] += 1
+            histogram["sum"] += span.duration
+            if span.error:
+                histogram["errors"] += 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    histogram["buckets"][i] += 1
+            if self._trace_file is not None:
+                self._trace_file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Add to a counter such as llm_cache_hits_total"""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        """Clear counters and histograms"""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        def escape(value) -> str:
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def prometheus_text(self) -> str:
+        """Counters and span duration histograms in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((name, dict(h, buckets=list(h["buckets"]))) for name, h in self.histograms.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{self._labels(labels)} {value:g}")
+
+        if histograms:
+            metric = f"{METRIC_PREFIX}_span_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in histograms:
+                for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{metric}_bucket{self._labels([('span', name), ('le', f'{bound:g}')])} {count}")
+                lines.append(f"{metric}_bucket{self._labels([('span', name), ('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{metric}_sum{self._labels([('span', name)])} {histogram['sum']:.6f}")
+                lines.append(f"{metric}_count{self._labels([('span', name)])} {histogram['count']}")
+            errors = f"{METRIC_PREFIX}_span_errors_total"
+            lines.append(f"# TYPE {errors} counter")
+            for name, histogram in histograms:
+                lines.append(f"{errors}{self._labels([('span', name)])} {histogram['errors']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write metrics atomically, e.g. for the node_exporter textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+# Process-wide tracer used by the pipeline modules
+tracer = Tracer()